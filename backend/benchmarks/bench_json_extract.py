@@ -0,0 +1,80 @@
+"""
+Benchmark: JSON extraction from LLM replies.
+
+Compares the previous quadratic extractor (every '{' start x every '}' end,
+json.loads on each candidate) with services.json_extract.extract_json_block
+on a truncated 3A-style reply: the outer object never closes, so the naive
+extractor re-parses the whole prefix once for every closing brace.
+
+Run from backend/:  python -m benchmarks.bench_json_extract
+"""
+import json
+import re
+import time
+
+from services.json_extract import extract_json_block
+
+
+def naive_extract_json_block(text: str) -> str | None:
+    """The original llm_service._extract_json_block, kept for comparison."""
+    start_idxs = [m.start() for m in re.finditer(r'\{', text)]
+    end_idxs = [m.start() for m in re.finditer(r'\}', text)]
+    if not start_idxs or not end_idxs:
+        return None
+
+    for s in start_idxs:
+        for e in reversed(end_idxs):
+            if e <= s:
+                continue
+            candidate = text[s:e+1]
+            try:
+                json.loads(candidate)
+                return candidate
+            except Exception:
+                continue
+    return None
+
+
+def truncated_reply(entities: int) -> str:
+    """A 3A reply cut off before the closing brackets (e.g. max output tokens hit)."""
+    steps = "annual = monthly x 12; kg -> tonnes / 1000; " * 8
+    rows = ", ".join('{"entity_id": "e%d", "emission_tonnes": 1.5}' % i for i in range(entities))
+    return (
+        'Result:\n{"scope": "Scope 3", "raw_emissions": 12.5, '
+        f'"raw_calculation_steps": "{steps}", "entity_emissions": [{rows}'
+    )
+
+
+def valid_reply(objects: int) -> str:
+    payload = {
+        "scope": "Scope 3",
+        "raw_emissions": 12.5,
+        "raw_calculation_steps": "x {not json} " * objects,
+        "entity_emissions": [{"entity_id": f"e{i}", "emission_tonnes": 0.1} for i in range(objects)],
+    }
+    return "<<<JSON_START>>>\n" + json.dumps(payload) + "\n<<<JSON_END>>>"
+
+
+def timed(fn, text: str) -> float:
+    started = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - started
+
+
+def main():
+    print(f"{'case':<22}{'chars':>10}{'naive (s)':>14}{'linear (s)':>14}")
+    for entities in (50, 200, 800, 3200, 20000):
+        text = truncated_reply(entities)
+        # the naive extractor is only run while it finishes in reasonable time
+        naive = f"{timed(naive_extract_json_block, text):.4f}" if entities <= 3200 else "skipped"
+        linear = timed(extract_json_block, text)
+        print(f"{'truncated x' + str(entities):<22}{len(text):>10}{naive:>14}{linear:>14.4f}")
+
+    for objects in (10, 1000, 10000):
+        text = valid_reply(objects)
+        assert json.loads(extract_json_block(text))["scope"] == "Scope 3"
+        print(f"{'delimited x' + str(objects):<22}{len(text):>10}{'-':>14}{timed(extract_json_block, text):>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
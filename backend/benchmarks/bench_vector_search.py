@@ -0,0 +1,221 @@
+"""
+Benchmark: filtered top-k over vector_memory-shaped data, exact vs ANN.
+
+Loads synthetic rows into a scratch table (bench_vector_memory, dropped
+afterwards) shaped like vector_memory: sessions of --session-size rows spread
+over 10 categories, each session clustered around its own centroid. Queries
+use the production filter (session_id = ? AND category != ?) and report, per
+table size, exact-scan latency and for every ef_search the recall@k against
+the exact result, p50/p95 latency, and how often the index alone returned
+fewer than k rows (where semantic_search falls back to the exact query).
+
+Ground truth is always the exact search over full-precision vectors. With
+--storage halfvec and/or --storage-dim N the column is then converted the way
+`migrate.py --vector-storage` does it, and --quantization binary indexes
+binary_quantize(embedding) and re-ranks --rerank-factor * k candidates, so the
+recall column shows what compact storage costs. Table and index sizes are
+printed for each step.
+
+Needs DATABASE_URL pointing at a scratch database with pgvector.
+Run from backend/:
+
+    python -m benchmarks.bench_vector_search --sizes 10000,100000,1000000
+    python -m benchmarks.bench_vector_search --storage halfvec --storage-dim 768 --quantization binary
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector
+
+TABLE = "bench_vector_memory"
+CATEGORIES = [f"category-{i}" for i in range(10)]
+
+
+
+def ann_query(column: str, quantization: str, rerank_factor: int) -> str:
+    vec = "$3::vector" if column.startswith("vector") else f"$3::vector::{column}"
+    if quantization == "binary":
+        dim = column[column.index("(") + 1:-1]
+        return f"""
+            WITH candidates AS MATERIALIZED (
+                SELECT id, embedding FROM {TABLE}
+                WHERE session_id = $1 AND category != $2
+                ORDER BY binary_quantize(embedding)::bit({dim}) <~> binary_quantize({vec})::bit({dim})
+                LIMIT $4 * {rerank_factor}
+            )
+            SELECT id FROM candidates ORDER BY embedding <=> {vec} LIMIT $4
+        """
+    return f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT id, embedding <=> {vec} AS distance
+            FROM {TABLE}
+            WHERE session_id = $1 AND category != $2
+            ORDER BY embedding <=> {vec}
+            LIMIT $4
+        )
+        SELECT id FROM candidates ORDER BY distance
+    """
+
+
+EXACT_QUERY = f"""
+    SELECT id FROM {TABLE}
+    WHERE session_id = $1 AND category != $2
+    ORDER BY (embedding <=> $3) + 0
+    LIMIT $4
+"""
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+async def load(connection, rows: int, dim: int, session_size: int, rng):
+    await connection.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    await connection.execute(f"""
+        CREATE TABLE {TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            session_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            content TEXT NOT NULL,
+            embedding vector({dim}) NOT NULL
+        )
+    """)
+
+    chunk = 5000
+    for start in range(0, rows, chunk):
+        ids = np.arange(start, min(start + chunk, rows))
+        sessions = ids // session_size
+        centroids = _unit(np.random.default_rng(sessions[:, None] + 1).standard_normal((len(ids), dim)))
+        vectors = _unit(centroids + 0.6 * rng.standard_normal((len(ids), dim))).astype(np.float32)
+        records = [
+            (int(s), CATEGORIES[int(i) % len(CATEGORIES)], f"row {int(i)}", v)
+            for i, s, v in zip(ids, sessions, vectors)
+        ]
+        await connection.copy_records_to_table(
+            TABLE, records=records, columns=["session_id", "category", "content", "embedding"]
+        )
+
+    await connection.execute(f"CREATE INDEX ON {TABLE} (session_id, category)")
+    await connection.execute(f"ANALYZE {TABLE}")
+
+
+async def timed_fetch(connection, query: str, args) -> tuple:
+    started = time.perf_counter()
+    rows = await connection.fetch(query, *args)
+    return [r["id"] for r in rows], (time.perf_counter() - started) * 1000
+
+
+async def sizes(connection, label: str):
+    row = await connection.fetchrow(f"""
+        SELECT pg_size_pretty(pg_table_size('{TABLE}')) AS heap,
+               pg_size_pretty(COALESCE(pg_relation_size(to_regclass('{TABLE}_ann')), 0)) AS ann
+    """)
+    print(f"{'':>9} {label}: table {row['heap']}, ANN index {row['ann']}")
+
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args):
+    rng = np.random.default_rng(7)
+    connection = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    await connection.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    await register_vector(connection)
+
+    version = await connection.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    iterative = tuple(int(p) for p in version.split(".")[:2]) >= (0, 8)
+    print(f"pgvector {version} (iterative scans: {'yes' if iterative else 'no'}), dim={args.dim}, k={args.k}")
+    print(f"{'rows':>9} {'mode':<14}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'short':>8}")
+
+    try:
+        for rows in args.sizes:
+            await load(connection, rows, args.dim, args.session_size, rng)
+            sessions = max(rows // args.session_size, 1)
+
+            queries = []
+            for _ in range(args.queries):
+                session = int(rng.integers(sessions))
+                vector = _unit(rng.standard_normal(args.dim)).astype(np.float32)
+                queries.append((session, CATEGORIES[int(rng.integers(len(CATEGORIES)))], vector, args.k))
+
+            exact, exact_ms = [], []
+            for q in queries:
+                ids, ms = await timed_fetch(connection, EXACT_QUERY, q)
+                exact.append(set(ids))
+                exact_ms.append(ms)
+            print(f"{rows:>9} {'exact':<14}{1.0:>10.3f}{pct(exact_ms, 50):>10.2f}{pct(exact_ms, 95):>10.2f}{0:>8}")
+
+            await sizes(connection, "vector")
+
+            dim = args.storage_dim or args.dim
+            column = f"{args.storage}({dim})"
+            if column != f"vector({args.dim})":
+                source = "embedding" if dim == args.dim else f"subvector(embedding, 1, {dim})"
+                await connection.execute(
+                    f"ALTER TABLE {TABLE} ALTER COLUMN embedding TYPE {column} USING {source}::{column}"
+                )
+                await sizes(connection, column)
+
+            expression, opclass = "embedding", f"{args.storage}_cosine_ops"
+            if args.quantization == "binary":
+                expression, opclass = f"(binary_quantize(embedding)::bit({dim}))", "bit_hamming_ops"
+
+            started = time.perf_counter()
+            await connection.execute(f"""
+                CREATE INDEX {TABLE}_ann ON {TABLE}
+                USING hnsw ({expression} {opclass}) WITH (m = 16, ef_construction = 64)
+            """)
+            build_s = time.perf_counter() - started
+            print(f"{rows:>9} hnsw build {build_s:.1f}s")
+            await sizes(connection, f"{column} {args.quantization}")
+
+            query = ann_query(column, args.quantization, args.rerank_factor)
+            if iterative:
+                await connection.execute("SET hnsw.iterative_scan = relaxed_order")
+            for ef in args.ef_search:
+                candidates = args.k * (args.rerank_factor if args.quantization == "binary" else 1)
+                await connection.execute(f"SET hnsw.ef_search = {max(int(ef), candidates)}")
+                recalls, latencies, short = [], [], 0
+                for (session, category, vector, k), truth in zip(queries, exact):
+                    ids, ms = await timed_fetch(connection, query, (session, category, vector[:dim], k))
+                    latencies.append(ms)
+                    short += len(ids) < min(args.k, len(truth))
+                    recalls.append(len(truth & set(ids)) / len(truth) if truth else 1.0)
+                mode = f"hnsw ef={ef}"
+                print(f"{rows:>9} {mode:<14}{statistics.mean(recalls):>10.3f}"
+                      f"{pct(latencies, 50):>10.2f}{pct(latencies, 95):>10.2f}{short:>8}")
+            await connection.execute("RESET hnsw.ef_search")
+    finally:
+        await connection.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        type=lambda s: [int(x) for x in s.split(",")])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--session-size", type=int, default=200)
+    parser.add_argument("--ef-search", default="40,100,200",
+                        type=lambda s: [int(x) for x in s.split(",")])
+    parser.add_argument("--storage", choices=["vector", "halfvec"], default="vector")
+    parser.add_argument("--storage-dim", type=int, default=None)
+    parser.add_argument("--quantization", choices=["none", "binary"], default="none")
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,80 @@
 import os
+import time
+import asyncio
 import asyncpg
 from pgvector.asyncpg import register_vector
 from contextlib import asynccontextmanager
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-conn = None
+# Pool sizing (override through env for bigger deployments)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+
+# Apply pending schema migrations (migrate.py) before the pool opens
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+pool: asyncpg.Pool | None = None
+_background: set = set()
+
+# Acquire wait-time counters, reported through pool_stats()
+_acquire_count = 0
+_acquire_wait_total = 0.0
+_acquire_wait_max = 0.0
+
+
+class _Connection(asyncpg.Connection):
+    def get_reset_query(self) -> str:
+        # the pool runs this on every release; its RESET ALL would also drop
+        # the vector search defaults of _init_connection, so they are
+        # re-applied in the same round trip
+        from services.vector_index import session_settings
+        return "\n".join([super().get_reset_query(), *session_settings()])
+
+
+async def _init_connection(connection: asyncpg.Connection):
+    """Runs once for every new pooled connection."""
+    await register_vector(connection)
+
+    # json/jsonb in and out as Python values: no json.dumps before writes,
+    # no json.loads after reads
+    from services import fast_json
+    for typename in ("json", "jsonb"):
+        await connection.set_type_codec(
+            typename, schema="pg_catalog", encoder=fast_json.dumps, decoder=fast_json.loads
+        )
+
+    from services.vector_index import configure_connection
+    await configure_connection(connection)
+
 
 @asynccontextmanager
 async def lifespan(app):
-    global conn
+    global pool
 
     # --- STARTUP ---
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute("SELECT 1;")
-        print("✅ Database connected.")
-        await register_vector(conn)
+        if DB_AUTO_MIGRATE:
+            from migrate import run_migrations
+            await run_migrations(DATABASE_URL)
+
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            init=_init_connection,
+            connection_class=_Connection,
+        )
+        await pool.execute("SELECT 1;")
+        print(f"✅ Database pool ready (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
+
+        from services import write_behind
+        write_behind.start()
+
+        from services import vector_index
+        if vector_index.VECTOR_INDEX_AUTO_BUILD and vector_index.ann_enabled():
+            _background.add(asyncio.create_task(vector_index.build_in_background(DATABASE_URL)))
     except Exception as e:
         print("❌ Database connection failed:", e)
         raise
@@ -24,11 +82,74 @@ async def lifespan(app):
     yield
 
     # --- SHUTDOWN ---
+    for task in _background:
+        task.cancel()
+
+    from services import category_digest
+    await category_digest.stop()
+
+    from services import write_behind
+    await write_behind.stop()
+
+    from services.context_cache import close_context_caches
+    await close_context_caches()
+
+    from services.genai_client import close_client
+    await close_client()
+
     try:
-        await conn.close()
-        print("🔌 Database disconnected.")
+        await pool.close()
+        print("🔌 Database pool closed.")
     except Exception as e:
         print("⚠️ Error during DB shutdown:", e)
 
+
+@asynccontextmanager
+async def acquire():
+    """
+    Borrow a connection from the pool for the duration of the block.
+    Services should keep the block short (no LLM calls inside it) so
+    the connection goes back to the pool as soon as the DB work is done.
+    """
+    global _acquire_count, _acquire_wait_total, _acquire_wait_max
+
+    if pool is None:
+        raise RuntimeError("Database pool is not initialised")
+
+    started = time.perf_counter()
+    connection = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    waited = time.perf_counter() - started
+
+    _acquire_count += 1
+    _acquire_wait_total += waited
+    _acquire_wait_max = max(_acquire_wait_max, waited)
+
+    try:
+        yield connection
+    finally:
+        await pool.release(connection)
+
+
 async def get_conn():
-    return conn
\ No newline at end of file
+    """FastAPI dependency: one pooled connection per request, released afterwards."""
+    async with acquire() as connection:
+        yield connection
+
+
+def pool_stats() -> dict:
+    if pool is None:
+        return {"status": "down"}
+
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "status": "up",
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+        "acquire_count": _acquire_count,
+        "acquire_wait_avg_ms": round(1000 * _acquire_wait_total / _acquire_count, 3) if _acquire_count else 0.0,
+        "acquire_wait_max_ms": round(1000 * _acquire_wait_max, 3),
+    }
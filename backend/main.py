@@ -14,6 +14,7 @@ from routers.summary_router import router as summary_router
 from routers.emissions_router import router as emissions_router
 from routers.confidence_router import router as confidence_router
 from routers.results_router import router as results_router
+from routers.stats_router import router as stats_router
 
 app = FastAPI(title="ecoAgent API", lifespan=lifespan)
 
@@ -32,6 +33,7 @@ app.include_router(summary_router, prefix="/summary", tags=["Summary"])
 app.include_router(emissions_router, prefix="/emissions", tags=["Emissions"])
 app.include_router(results_router, prefix="/results", tags=["Results"])
 app.include_router(confidence_router, prefix="/confidence", tags=["Confidence"])
+app.include_router(stats_router, prefix="/stats", tags=["Stats"])
 
 @app.get("/")
 def root():
@@ -0,0 +1,227 @@
+"""
+Schema migrations.
+
+Migrations are plain SQL files in backend/migrations named NNNN_description.sql.
+Pending files are applied in version order, each in its own transaction, and
+recorded in schema_migrations. A file starting with "-- migrate: no-transaction"
+runs statement by statement outside a transaction instead, which
+CREATE INDEX CONCURRENTLY needs; invalid indexes left by an interrupted run
+of such a file are dropped before it is retried. A Postgres advisory lock
+keeps several workers starting at once from applying the same migration twice.
+
+Applied automatically from lifespan (DB_AUTO_MIGRATE=1, the default) or by hand
+from backend/:
+
+    python migrate.py                   # apply pending migrations
+    python migrate.py --status          # list applied and pending migrations
+    python migrate.py --dedupe-snapshots [--yes]
+                                        # list duplicate emissions_snapshots rows that
+                                        # block migration 0006; --yes copies them to
+                                        # emissions_snapshots_removed and deletes them
+    python migrate.py --vector-index    # also build the ANN index (services/vector_index.py)
+    python migrate.py --vector-storage  # also convert vector_memory.embedding to
+                                        # VECTOR_STORAGE(EMBEDDING_DIM) and rebuild the index
+"""
+import asyncio
+import os
+import re
+import sys
+from pathlib import Path
+
+import asyncpg
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# arbitrary, but fixed: every worker must use the same advisory lock key
+MIGRATION_LOCK_KEY = 781_240_011
+
+NO_TRANSACTION = "-- migrate: no-transaction"
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+
+def _discover():
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9][0-9]_*.sql")):
+        migrations.append((int(path.name[:4]), path.stem, path))
+    return migrations
+
+
+async def _applied(connection: asyncpg.Connection) -> set:
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    rows = await connection.fetch("SELECT version FROM schema_migrations")
+    return {r["version"] for r in rows}
+
+
+def statements(sql: str) -> list:
+    """Split a migration into statements; semicolons inside $$ bodies do not end one."""
+    found, current, quoted = [], [], False
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith("--")):
+            continue
+        current.append(line)
+        if line.count("$$") % 2:
+            quoted = not quoted
+        if not quoted and not stripped.startswith("--") and stripped.endswith(";"):
+            found.append("\n".join(current))
+            current = []
+    if current:
+        found.append("\n".join(current))
+    return found
+
+
+async def _drop_invalid_indexes(connection: asyncpg.Connection, sql: str):
+    for name in _CONCURRENT_INDEX.findall(sql):
+        invalid = await connection.fetchval("""
+            SELECT NOT i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = $1
+        """, name)
+        if invalid:
+            print(f"🔁 Dropping invalid index {name} left by an interrupted build")
+            await connection.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+async def _lock(connection: asyncpg.Connection):
+    # polled rather than pg_advisory_lock: a worker blocked inside that
+    # statement holds a snapshot, and CREATE INDEX CONCURRENTLY in the
+    # worker holding the lock would wait for it forever
+    while not await connection.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_KEY):
+        await asyncio.sleep(0.5)
+
+
+async def migrate(connection: asyncpg.Connection) -> list:
+    """Apply every pending migration; returns the names applied."""
+    await _lock(connection)
+    try:
+        applied = await _applied(connection)
+        done = []
+        for version, name, path in _discover():
+            if version in applied:
+                continue
+            sql = path.read_text()
+            if sql.startswith(NO_TRANSACTION):
+                await _drop_invalid_indexes(connection, sql)
+                for statement in statements(sql):
+                    await connection.execute(statement)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version, name
+                )
+            else:
+                async with connection.transaction():
+                    await connection.execute(sql)
+                    await connection.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        version, name
+                    )
+            print(f"🗄️ Applied migration {name}")
+            done.append(name)
+        return done
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def run_migrations(dsn: str) -> list:
+    # plain connection: the pool's init hook needs the vector extension to exist already
+    connection = await asyncpg.connect(dsn)
+    try:
+        return await migrate(connection)
+    finally:
+        await connection.close()
+
+
+async def _status(dsn: str):
+    connection = await asyncpg.connect(dsn)
+    try:
+        applied = await _applied(connection)
+    finally:
+        await connection.close()
+
+    for version, name, _ in _discover():
+        print(f"{'applied' if version in applied else 'pending':<8} {name}")
+
+
+async def dedupe_snapshots(dsn: str, delete: bool) -> int:
+    """
+    List the emissions_snapshots rows that have a newer row for the same
+    (session_id, category); with delete=True copy them to
+    emissions_snapshots_removed and delete them. Returns the number of rows.
+    """
+    connection = await asyncpg.connect(dsn)
+    try:
+        rows = await connection.fetch("""
+            SELECT older.id, older.session_id, older.category, older.raw_emissions, older.created_at
+            FROM emissions_snapshots older
+            WHERE EXISTS (
+                SELECT 1 FROM emissions_snapshots newer
+                WHERE newer.session_id = older.session_id
+                  AND newer.category = older.category
+                  AND newer.id > older.id
+            )
+            ORDER BY older.session_id, older.category, older.id
+        """)
+        for r in rows:
+            print(f"{'delete' if delete else 'duplicate'} id={r['id']} session={r['session_id']} "
+                  f"category={r['category']!r} raw_emissions={r['raw_emissions']} created_at={r['created_at']}")
+
+        if not rows or not delete:
+            print(f"{len(rows)} older duplicate snapshot(s) found; the newest row of each category is kept."
+                  + (" Re-run with --yes to remove them." if rows else ""))
+            return len(rows)
+
+        ids = [r["id"] for r in rows]
+        async with connection.transaction():
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS emissions_snapshots_removed
+                    (LIKE emissions_snapshots)
+            """)
+            await connection.execute("""
+                INSERT INTO emissions_snapshots_removed
+                SELECT * FROM emissions_snapshots WHERE id = ANY($1::bigint[])
+            """, ids)
+            await connection.execute("DELETE FROM emissions_snapshots WHERE id = ANY($1::bigint[])", ids)
+        print(f"🗑️ {len(ids)} duplicate snapshot(s) moved to emissions_snapshots_removed.")
+        return len(ids)
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    dsn = os.getenv("DATABASE_URL")
+    if "--status" in sys.argv[1:]:
+        asyncio.run(_status(dsn))
+    elif "--dedupe-snapshots" in sys.argv[1:]:
+        asyncio.run(dedupe_snapshots(dsn, delete="--yes" in sys.argv[1:]))
+    else:
+        names = asyncio.run(run_migrations(dsn))
+        print(f"✅ {len(names)} migration(s) applied.")
+
+        if "--vector-storage" in sys.argv[1:]:
+            from services.vector_index import convert_storage, storage_stats
+
+            async def _convert():
+                connection = await asyncpg.connect(dsn)
+                try:
+                    print("before:", await storage_stats(connection))
+                    if await convert_storage(connection):
+                        print("after: ", await storage_stats(connection))
+                finally:
+                    await connection.close()
+
+            asyncio.run(_convert())
+        elif "--vector-index" in sys.argv[1:]:
+            from services.vector_index import build_in_background
+            asyncio.run(build_in_background(dsn))
@@ -0,0 +1,64 @@
+-- Core tables.
+-- Written with IF NOT EXISTS so databases created by hand before
+-- migrations existed are adopted as-is.
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    company_profile JSONB NOT NULL,
+    summary_text TEXT,
+    current_category TEXT,
+    missing_fields JSONB DEFAULT '[]'::jsonb,
+    category_completion BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS qa_messages (
+    id BIGSERIAL PRIMARY KEY,
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    question_text TEXT,
+    answer_text TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS vector_memory (
+    id BIGSERIAL PRIMARY KEY,
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    content TEXT NOT NULL,
+    embedding vector(1536) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS structured_fields (
+    id BIGSERIAL PRIMARY KEY,
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    entity_id TEXT,
+    field_name TEXT,
+    field_value_text TEXT,
+    field_value_float DOUBLE PRECISION,
+    entity_emission DOUBLE PRECISION,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS emissions_snapshots (
+    id BIGSERIAL PRIMARY KEY,
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    scope TEXT,
+    raw_emissions DOUBLE PRECISION,
+    steps TEXT,
+    calculation_valid BOOLEAN,
+    confidence_model DOUBLE PRECISION,
+    confidence_data DOUBLE PRECISION,
+    confidence_final DOUBLE PRECISION,
+    missing_fields JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- The indexes of the hot queries are built in 0006_hot_query_indexes.sql,
+-- CONCURRENTLY and outside a transaction.
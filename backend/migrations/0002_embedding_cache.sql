@@ -0,0 +1,10 @@
+-- Postgres tier of the embedding cache (services/embedding_cache.py).
+-- Keyed by sha256(model, dimension, normalized text); dimension-agnostic column.
+
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    content_hash TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    dimension INTEGER NOT NULL,
+    embedding vector NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
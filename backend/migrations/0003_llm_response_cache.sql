@@ -0,0 +1,17 @@
+-- Postgres tier of the LLM response cache (services/llm_cache.py).
+-- Keyed by sha256(prompt builder, model, canonical prompt inputs); the
+-- session/category columns let a data change drop that scope's entries.
+
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    cache_key TEXT PRIMARY KEY,
+    session_id UUID,
+    category TEXT,
+    builder TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS llm_response_cache_scope_idx
+    ON llm_response_cache (session_id, category);
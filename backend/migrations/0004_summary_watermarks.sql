@@ -0,0 +1,11 @@
+-- Incremental summaries (services/summary_service.py): the highest
+-- qa_messages.id of a session's category already folded into
+-- sessions.summary_text. Only newer Q/A are sent to the summary prompt.
+
+CREATE TABLE IF NOT EXISTS summary_watermarks (
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    last_qa_id BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (session_id, category)
+);
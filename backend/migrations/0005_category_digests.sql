@@ -0,0 +1,12 @@
+-- Rolling category digests (services/category_digest.py): the older part of
+-- a long category transcript condensed by the summary prompt. Chat prompts
+-- carry the digest plus the Q/A with qa_messages.id > last_qa_id.
+
+CREATE TABLE IF NOT EXISTS category_digests (
+    session_id UUID NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    digest_text TEXT NOT NULL,
+    last_qa_id BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (session_id, category)
+);
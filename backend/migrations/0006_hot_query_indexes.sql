@@ -0,0 +1,37 @@
+-- migrate: no-transaction
+-- Indexes behind the hot queries, built CONCURRENTLY so an existing database
+-- keeps taking writes while they build. migrate.py runs this file statement
+-- by statement outside a transaction and drops an invalid index left by an
+-- interrupted build before retrying.
+
+-- qa_messages: WHERE session_id AND category ORDER BY id (chat + summary)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS qa_messages_session_category_id_idx
+    ON qa_messages (session_id, category, id);
+
+-- vector_memory: WHERE session_id [AND category ...] (semantic search prefilter)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS vector_memory_session_category_idx
+    ON vector_memory (session_id, category);
+
+-- structured_fields: WHERE session_id AND category (emissions, confidence),
+-- WHERE session_id (results), entity_emission updates by entity_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS structured_fields_session_category_entity_idx
+    ON structured_fields (session_id, category, entity_id);
+
+-- emissions_snapshots: one snapshot per (session_id, category), the key of the
+-- ON CONFLICT upsert. Duplicates left by the old select-then-insert path are
+-- never deleted here: the migration stops and the operator reviews them with
+-- python migrate.py --dedupe-snapshots.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM emissions_snapshots
+        GROUP BY session_id, category
+        HAVING count(*) > 1
+    ) THEN
+        RAISE EXCEPTION 'emissions_snapshots has duplicate (session_id, category) rows; review them with: python migrate.py --dedupe-snapshots';
+    END IF;
+END
+$$;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS emissions_snapshots_session_category_key
+    ON emissions_snapshots (session_id, category);
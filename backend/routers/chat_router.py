@@ -28,23 +28,95 @@
 '''
 # routers/chat_router.py
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Union
 from schemas import ChatFirstRequest, ChatNextRequest, ChatLLMResponse
-from services.chat_service import first_question, next_question
+from services.chat_service import (
+    first_question, next_question,
+    prepare_first_turn, prepare_next_turn, stream_turn, complete_turn
+)
+from services.rate_limiter import RateLimitedError
+from services.deadlines import DeadlineExceeded, deadline_after, remaining, CHAT_DEADLINE
+from services import fast_json
 
 router = APIRouter()
 
 @router.post("/next", response_model=ChatLLMResponse)
 async def chat_next(payload: Union[ChatFirstRequest, ChatNextRequest]):
     try:
-        # FIRST QUESTION CASE
-        if isinstance(payload, ChatFirstRequest):
-            return await first_question(payload.session_id)
+        with deadline_after(CHAT_DEADLINE):
+            # FIRST QUESTION CASE
+            if isinstance(payload, ChatFirstRequest):
+                return await first_question(payload.session_id)
 
-        # NEXT QUESTION CASE
-        result = await next_question(payload.model_dump())
-        return result
+            # NEXT QUESTION CASE
+            result = await next_question(payload.model_dump())
+            return result
 
+    except DeadlineExceeded as e:
+        print("⏱️ Chat flow deadline exceeded:", e)
+        raise HTTPException(status_code=504, detail="Model did not answer in time, retry shortly")
+    except RateLimitedError as e:
+        print("⚠️ Chat flow rejected:", e)
+        raise HTTPException(status_code=503, detail="Model capacity exhausted, retry shortly", headers=e.headers())
     except Exception as e:
         print("❌ Chat flow error:", e)
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {fast_json.dumps(data)}\n\n"
+
+#Same payloads as /next, answered as server-sent events:
+#  event: token -> {"text": "..."} pieces of next_question as they are generated
+#  event: final -> full ChatLLMResponse payload
+#  event: error -> {"detail": "..."}
+#DB writes that depend on the answer run after the stream has been sent.
+#Setup and stream share one CHAT_DEADLINE, like /next.
+@router.post("/stream")
+async def chat_stream(payload: Union[ChatFirstRequest, ChatNextRequest]):
+    try:
+        with deadline_after(CHAT_DEADLINE):
+            if isinstance(payload, ChatFirstRequest):
+                turn = await prepare_first_turn(payload.session_id)
+            else:
+                turn = await prepare_next_turn(payload.model_dump())
+            # the body is sent after this handler returns, outside this scope
+            left = remaining()
+    except DeadlineExceeded as e:
+        print("⏱️ Chat stream setup deadline exceeded:", e)
+        raise HTTPException(status_code=504, detail="Model did not answer in time, retry shortly")
+    except RateLimitedError as e:
+        print("⚠️ Chat stream setup rejected:", e)
+        raise HTTPException(status_code=503, detail="Model capacity exhausted, retry shortly", headers=e.headers())
+    except Exception as e:
+        print("❌ Chat stream setup error:", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    async def events():
+        try:
+            with deadline_after(left):
+                async for event, data in stream_turn(turn):
+                    if event == "final":
+                        data = ChatLLMResponse.model_validate(data).model_dump()
+                    yield _sse(event, data)
+        except DeadlineExceeded as e:
+            print("⏱️ Chat stream deadline exceeded:", e)
+            turn.pop("llm_json", None)
+            yield _sse("error", {"detail": "Model did not answer in time, retry shortly"})
+        except RateLimitedError as e:
+            print("⚠️ Chat stream rejected:", e)
+            turn.pop("llm_json", None)
+            yield _sse("error", {"detail": "Model capacity exhausted, retry shortly", "retry_after": e.retry_after})
+        except Exception as e:
+            print("❌ Chat stream error:", e)
+            turn.pop("llm_json", None)
+            yield _sse("error", {"detail": "Internal Server Error"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(complete_turn, turn),
+    )
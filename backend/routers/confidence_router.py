@@ -3,13 +3,22 @@
 from fastapi import APIRouter, HTTPException
 from schemas import ConfidenceRequest, ConfidenceResponse
 from services.confidence_service import generate_confidence
+from services.rate_limiter import RateLimitedError
+from services.deadlines import DeadlineExceeded, deadline_after, CALCULATION_DEADLINE
 
 router = APIRouter()
 
 @router.post("/check", response_model=ConfidenceResponse)
 async def check_confidence(payload: ConfidenceRequest):
     try:
-        return await generate_confidence(payload.model_dump())
+        with deadline_after(CALCULATION_DEADLINE):
+            return await generate_confidence(payload.model_dump())
+    except DeadlineExceeded as e:
+        print("⏱️ Confidence generation deadline exceeded:", e)
+        raise HTTPException(status_code=504, detail="Model did not answer in time, retry shortly")
+    except RateLimitedError as e:
+        print("⚠️ Confidence generation rejected:", e)
+        raise HTTPException(status_code=503, detail="Model capacity exhausted, retry shortly", headers=e.headers())
     except Exception as e:
         print("❌ Confidence generation failed:", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -3,6 +3,8 @@
 from fastapi import APIRouter, HTTPException
 from schemas import EmissionsRequest, EmissionsResponse
 from services.emission_service import generate_emissions
+from services.rate_limiter import RateLimitedError
+from services.deadlines import DeadlineExceeded, deadline_after, CALCULATION_DEADLINE
 
 router = APIRouter()
 
@@ -10,9 +12,16 @@ router = APIRouter()
 @router.post("/calculate", response_model=EmissionsResponse)
 async def calculate_emissions(payload: EmissionsRequest):
     try:
-        result = await generate_emissions(payload.model_dump())
+        with deadline_after(CALCULATION_DEADLINE):
+            result = await generate_emissions(payload.model_dump())
         return result
 
+    except DeadlineExceeded as e:
+        print("⏱️ Emissions generation deadline exceeded:", e)
+        raise HTTPException(status_code=504, detail="Model did not answer in time, retry shortly")
+    except RateLimitedError as e:
+        print("⚠️ Emissions generation rejected:", e)
+        raise HTTPException(status_code=503, detail="Model capacity exhausted, retry shortly", headers=e.headers())
     except Exception as e:
         print("❌ Emissions generation failed:", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,13 +1,20 @@
 # routers/results_router.py
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from database import get_conn
 from schemas import ResultsResponse
 from services.results_service import ResultsService
+from services import write_behind
 
 router = APIRouter()
 
 
+#Runs before get_conn so no pooled connection is held while queued writes finish
+async def _session_writes_flushed(session_id: str):
+    await write_behind.wait_for_session(session_id)
+
+
 @router.get("/{session_id}", response_model=ResultsResponse)
-async def get_results(session_id: str):
-    data = await ResultsService.get_results(session_id)
+async def get_results(session_id: str, _=Depends(_session_writes_flushed), db=Depends(get_conn)):
+    data = await ResultsService.get_results(db, session_id)
     return ResultsResponse(**data)
\ No newline at end of file
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from database import get_conn
 from schemas import StartSessionInput
 from services.session_dbservice import create_session
 
@@ -6,9 +7,9 @@ router = APIRouter()
 
 #Takes company profile as input and class session service to save a session in db and returns session id
 @router.post("/start")
-async def start_session(payload: StartSessionInput):
+async def start_session(payload: StartSessionInput, connection=Depends(get_conn)):
     try:
-        session_id = await create_session(payload.company_profile)
+        session_id = await create_session(connection, payload.company_profile)
         return {"session_id": str(session_id)}
     except Exception as e:
         print("Session creation failed:", e)
@@ -0,0 +1,34 @@
+# routers/stats_router.py
+from fastapi import APIRouter
+from database import pool_stats
+from services.llm_service import llm_stats
+from services.embedding_service import embedding_stats
+from services.chat_service import stage_stats
+from services.write_behind import write_behind_stats
+from services.session_vector_cache import session_vector_stats
+from services.llm_cache import llm_cache_stats
+from services.single_flight import single_flight_stats
+from services.context_assembler import context_stats
+from services.summary_service import summary_stats
+from services.category_digest import digest_stats
+from services.session_cache import session_cache_stats
+
+router = APIRouter()
+
+#Runtime counters for monitoring (pool usage etc.)
+@router.get("")
+async def get_stats():
+    return {
+        "db_pool": pool_stats(),
+        "llm": llm_stats(),
+        "embeddings": embedding_stats(),
+        "chat_stages": stage_stats(),
+        "write_behind": write_behind_stats(),
+        "session_vectors": session_vector_stats(),
+        "llm_cache": llm_cache_stats(),
+        "single_flight": single_flight_stats(),
+        "prompt_context": context_stats(),
+        "summaries": summary_stats(),
+        "category_digests": digest_stats(),
+        "session_cache": session_cache_stats(),
+    }
@@ -2,16 +2,25 @@
 from fastapi import APIRouter, HTTPException
 from schemas import SummaryRequest, SummaryResponse
 from services.summary_service import generate_summary
+from services.rate_limiter import RateLimitedError
+from services.deadlines import DeadlineExceeded, deadline_after, SUMMARY_DEADLINE
 
 router = APIRouter()
 
 @router.post("/update", response_model=SummaryResponse)
 async def update_summary(payload: SummaryRequest):
     try:
-        return await generate_summary(
-            session_id=payload.session_id,
-            category=payload.category
-        )
+        with deadline_after(SUMMARY_DEADLINE):
+            return await generate_summary(
+                session_id=payload.session_id,
+                category=payload.category
+            )
+    except DeadlineExceeded as e:
+        print("⏱️ Summary deadline exceeded:", e)
+        raise HTTPException(status_code=504, detail="Model did not answer in time, retry shortly")
+    except RateLimitedError as e:
+        print("⚠️ Summary rejected:", e)
+        raise HTTPException(status_code=503, detail="Model capacity exhausted, retry shortly", headers=e.headers())
     except Exception as e:
         print("❌ Summary failure:", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
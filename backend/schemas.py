@@ -1,6 +1,6 @@
 #Pydantic for data validation once routers will be decided.
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Optional, List, Dict, Any
 
 #AFTER HARDCODED QUESTIONS
@@ -20,6 +20,41 @@ class ChatNextRequest(BaseModel):
     answer: str
     missing_fields: Optional[List[Dict[str, Any]]] = []
 
+def _lax_str(value):
+    # free-form model output: an entity_id of 1 is still a valid id
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float, bool)):
+        return str(value)
+    return value
+
+#FIELD EXTRACTED FROM THE LAST Q/A (also the response schema in structured-output mode)
+#Values are coerced, not rejected: /chat/next validates the answer after the turn is stored.
+class ExtractedField(BaseModel):
+    entity_id: Optional[str] = None
+    field_name: Optional[str] = None
+    field_type: Optional[str] = Field(None, description='"text" or "numeric"')
+    field_value_text: Optional[str] = None
+    field_value_float: Optional[float] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _non_numeric_float_as_text(cls, data):
+        # "12 kg" is kept as text, the way write_behind stores it
+        if isinstance(data, dict) and isinstance(data.get("field_value_float"), str):
+            try:
+                float(data["field_value_float"])
+            except ValueError:
+                data = dict(data)
+                if data.get("field_value_text") is None:
+                    data["field_value_text"] = data["field_value_float"]
+                data["field_value_float"] = None
+        return data
+
+    _str_fields = field_validator(
+        "entity_id", "field_name", "field_type", "field_value_text", mode="before"
+    )(_lax_str)
+
 #LLM RESPONSE MODEL
 class ChatLLMResponse(BaseModel):
     next_question: Optional[str]
@@ -27,7 +62,7 @@ class ChatLLMResponse(BaseModel):
     next_category: Optional[str]
     analysis_complete: bool
     updated_missing_field: Optional[List[Dict[str, Any]]]
-    extracted_fields: Optional[List[Dict[str, Any]]]
+    extracted_fields: Optional[List[ExtractedField]]
 
 
 # --- SUMMARY MODELS ---
@@ -49,6 +84,8 @@ class EntityEmission(BaseModel):
     entity_id: str
     emission_tonnes: Optional[float] = None
 
+    _entity_id = field_validator("entity_id", mode="before")(_lax_str)
+
 class EmissionsResponse(BaseModel):
     scope: str
     raw_emissions: Optional[float] = None
@@ -60,6 +97,13 @@ class ConfidenceRequest(BaseModel):
     session_id: str
     category: str
 
+#What Prompt 3B asks the model for; scope and the data/final scores are computed server-side
+class ConfidenceLLMResponse(BaseModel):
+    calculation_valid: bool
+    correction_note: Optional[str] = None
+    confidence_model: float
+    missing_fields: List[Any]
+
 class ConfidenceResponse(BaseModel):
     scope: str
     calculation_valid: bool
@@ -0,0 +1,135 @@
+# services/bulk_writes.py
+import asyncpg
+import uuid
+from typing import List, Sequence, Tuple
+
+# Set-based write primitives: one statement (one round trip) per call,
+# whatever the number of rows. Callers own the transaction.
+
+
+# ---------- ROW COERCION ----------
+# Values mostly come from LLM output: an entity_id of 1 or a
+# field_value_float of "12 kg" must not reach the typed UNNEST arrays.
+# Each *_row() returns the row tuple its writer expects; a malformed
+# session_id raises ValueError.
+def _uuid(value) -> str:
+    return str(uuid.UUID(str(value)))
+
+
+def _text(value) -> str | None:
+    return None if value is None else str(value)
+
+
+def _float(value) -> float | None:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def structured_field_row(params: Sequence) -> tuple:
+    session_id, category, entity_id, field_name, value_text, value_float = params
+    number = _float(value_float)
+    # a non-numeric "float" is kept as text rather than lost
+    if number is None and value_float is not None and value_text is None:
+        value_text = value_float
+    return (_uuid(session_id), _text(category), _text(entity_id), _text(field_name), _text(value_text), number)
+
+
+def entity_emission_row(params: Sequence) -> tuple:
+    return (_float(params[0]), _uuid(params[1]), _text(params[2]), _text(params[3]))
+
+
+def vector_memory_row(params: Sequence) -> tuple:
+    return (_uuid(params[0]), _text(params[1]), _text(params[2]), params[3])
+
+
+def llm_cache_entry_row(params: Sequence) -> tuple:
+    return (_uuid(params[0]), _text(params[1]))
+
+
+def _columns(rows: Sequence[tuple], width: int) -> List[list]:
+    """Row tuples -> one list per column, the shape UNNEST($1::t[], ...) expects."""
+    return [list(col) for col in zip(*rows)] if rows else [[] for _ in range(width)]
+
+
+async def insert_structured_fields(connection: asyncpg.Connection, rows: Sequence[Tuple]):
+    """rows: (session_id, category, entity_id, field_name, field_value_text, field_value_float)"""
+    if not rows:
+        return
+
+    await connection.execute("""
+        INSERT INTO structured_fields (
+            session_id, category, entity_id, field_name,
+            field_value_text, field_value_float
+        )
+        SELECT * FROM UNNEST(
+            $1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[], $6::float8[]
+        )
+    """, *_columns(rows, 6))
+
+
+async def update_entity_emissions(connection: asyncpg.Connection, rows: Sequence[Tuple]):
+    """rows: (emission_tonnes, session_id, category, entity_id); the last value per entity wins."""
+    if not rows:
+        return
+
+    # UPDATE ... FROM picks an arbitrary source row on duplicates, so dedupe here
+    latest = {(str(r[1]), r[2], r[3]): r for r in rows}
+
+    await connection.execute("""
+        UPDATE structured_fields AS sf
+        SET entity_emission = u.emission_tonnes
+        FROM UNNEST($1::float8[], $2::uuid[], $3::text[], $4::text[])
+            AS u(emission_tonnes, session_id, category, entity_id)
+        WHERE sf.session_id = u.session_id
+          AND sf.category = u.category
+          AND sf.entity_id = u.entity_id
+    """, *_columns(list(latest.values()), 4))
+
+
+async def insert_vector_memory(connection: asyncpg.Connection, rows: Sequence[Tuple]):
+    """rows: (session_id, content, category, embedding). executemany is pipelined: one round trip."""
+    if not rows:
+        return
+
+    # sent as vector; Postgres casts it on assignment when the column is halfvec
+    await connection.executemany("""
+        INSERT INTO vector_memory (session_id, content, category, embedding)
+        VALUES ($1, $2, $3, $4::vector)
+    """, rows)
+
+
+async def delete_llm_cache_entries(connection: asyncpg.Connection, rows: Sequence[Tuple]):
+    """rows: (session_id, category); a NULL category clears the whole session."""
+    if not rows:
+        return
+
+    await connection.execute("""
+        DELETE FROM llm_response_cache AS c
+        USING UNNEST($1::uuid[], $2::text[]) AS u(session_id, category)
+        WHERE c.session_id = u.session_id
+          AND (u.category IS NULL OR c.category = u.category)
+    """, *_columns(list(set(rows)), 2))
+
+
+async def upsert_emissions_snapshot(
+    connection: asyncpg.Connection,
+    session_id: str,
+    category: str,
+    scope: str,
+    raw_emissions,
+    steps: str
+) -> int:
+    """Insert or update the (session_id, category) snapshot in one statement; returns its id."""
+    return await connection.fetchval("""
+        INSERT INTO emissions_snapshots (session_id, category, scope, raw_emissions, steps)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (session_id, category) DO UPDATE
+        SET scope = EXCLUDED.scope,
+            raw_emissions = EXCLUDED.raw_emissions,
+            steps = EXCLUDED.steps
+        RETURNING id
+    """, session_id, category, scope, raw_emissions, steps)
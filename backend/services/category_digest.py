@@ -0,0 +1,137 @@
+# services/category_digest.py
+from contextvars import Context
+from database import acquire
+from typing import Any, Dict, List
+from services.context_assembler import estimate_tokens
+from services.deadlines import deadline_after, SUMMARY_DEADLINE
+from services.llm_service import ask_model, LLM_STRUCTURED_OUTPUT
+from services.prompt_builder import build_prompt2
+from schemas import SummaryResponse
+import asyncio
+import os
+
+# Rolling compaction of long category transcripts. Chat prompts carry the
+# category digest (category_digests table) plus the raw Q/A recorded after
+# it. Once those raw turns pass CATEGORY_COMPACT_TURNS or
+# CATEGORY_COMPACT_TOKENS, a background task folds all but the newest
+# CATEGORY_KEEP_RECENT of them into the digest with the summary prompt
+# (build_prompt2), so the transcript sent per turn stops growing.
+CATEGORY_COMPACTION = os.getenv("CATEGORY_COMPACTION", "1") == "1"
+CATEGORY_COMPACT_TURNS = int(os.getenv("CATEGORY_COMPACT_TURNS", "12"))
+CATEGORY_COMPACT_TOKENS = int(os.getenv("CATEGORY_COMPACT_TOKENS", "1500"))
+CATEGORY_KEEP_RECENT = int(os.getenv("CATEGORY_KEEP_RECENT", "4"))
+
+# (session_id, category) -> running compaction
+_tasks: Dict[tuple, asyncio.Task] = {}
+
+_compactions = 0
+_compacted_turns = 0
+_failures = 0
+
+
+async def fetch_transcript(session_id: str, category: str):
+    """(digest row or None, Q/A rows after the digest) of a session's category."""
+    async with acquire() as connection:
+        digest = await connection.fetchrow("""
+            SELECT digest_text, last_qa_id
+            FROM category_digests
+            WHERE session_id = $1 AND category = $2
+        """, session_id, category)
+
+        rows = await connection.fetch("""
+            SELECT id, question_text, answer_text
+            FROM qa_messages
+            WHERE session_id = $1 AND category = $2 AND id > $3
+            ORDER BY id ASC
+        """, session_id, category, digest["last_qa_id"] if digest else 0)
+
+    return digest, rows
+
+
+def _qa(rows) -> List[Dict[str, Any]]:
+    return [{"question": r["question_text"], "answer": r["answer_text"]} for r in rows]
+
+
+def _due(rows) -> bool:
+    older = rows[:-CATEGORY_KEEP_RECENT] if CATEGORY_KEEP_RECENT else rows
+    if not older:
+        return False
+    return len(rows) >= CATEGORY_COMPACT_TURNS or estimate_tokens(_qa(older)) >= CATEGORY_COMPACT_TOKENS
+
+
+def maybe_compact(session_id: str, category: str, rows):
+    """Start a background compaction when the raw transcript passed a threshold."""
+    if not CATEGORY_COMPACTION or not _due(rows):
+        return
+
+    key = (str(session_id), category)
+    if key in _tasks:
+        return
+
+    # a fresh context: the task must not inherit the chat request's deadline
+    task = asyncio.get_running_loop().create_task(_compact(session_id, category), context=Context())
+    _tasks[key] = task
+    task.add_done_callback(lambda t: _tasks.pop(key, None))
+
+
+async def _compact(session_id: str, category: str):
+    global _compactions, _compacted_turns, _failures
+
+    try:
+        digest, rows = await fetch_transcript(session_id, category)
+        if not _due(rows):
+            return
+
+        older = rows[:-CATEGORY_KEEP_RECENT] if CATEGORY_KEEP_RECENT else rows
+        previous = digest["digest_text"] if digest else ""
+        prompt = build_prompt2({
+            "previous_summary": previous,
+            "recent_qa": _qa(older),
+        }, structured=LLM_STRUCTURED_OUTPUT)
+
+        with deadline_after(SUMMARY_DEADLINE):
+            llm_output = await ask_model(prompt, SummaryResponse, priority="summary", session_id=session_id)
+
+        updated = (llm_output.get("updated_summary") or "").strip()
+        if not updated:
+            raise ValueError(llm_output.get("__llm_error") or "LLM returned empty digest")
+
+        # only advance from the digest this one was built on
+        async with acquire() as connection:
+            result = await connection.execute("""
+                INSERT INTO category_digests (session_id, category, digest_text, last_qa_id)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (session_id, category) DO UPDATE
+                SET digest_text = EXCLUDED.digest_text,
+                    last_qa_id = EXCLUDED.last_qa_id,
+                    updated_at = now()
+                WHERE category_digests.last_qa_id = $5
+            """, session_id, category, updated, older[-1]["id"], digest["last_qa_id"] if digest else 0)
+
+        if result.endswith(" 1"):
+            _compactions += 1
+            _compacted_turns += len(older)
+            print(f"🗜️ Compacted {len(older)} turns of {category} for {session_id}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _failures += 1
+        print(f"⚠️ Category compaction failed for {session_id}/{category}:", e)
+
+
+async def stop():
+    """Cancel running compactions on shutdown (they are redone on the next turn)."""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def digest_stats() -> Dict[str, Any]:
+    return {
+        "enabled": CATEGORY_COMPACTION,
+        "running": len(_tasks),
+        "compactions": _compactions,
+        "compacted_turns": _compacted_turns,
+        "failures": _failures,
+    }
@@ -1,144 +1,276 @@
 # services/chat_service.py
-from database import get_conn
-from typing import Dict, Any
+from database import acquire
+from typing import Dict, Any, AsyncIterator, Tuple
 from services.embedding_service import embed_text
-from services.llm_service import ask_model
+from services.json_extract import StreamingStringField
+from services.llm_service import ask_model, stream_model, parse_model_text, LLM_STRUCTURED_OUTPUT
 from services.prompt_builder import build_prompt1
+from services.context_assembler import assemble_prompt1
 from services.vector_search import semantic_search
-import json
+from services.bulk_writes import insert_structured_fields, structured_field_row
+from services import write_behind, session_vector_cache, llm_cache, category_digest, session_cache
+from schemas import ChatLLMResponse
+import asyncio
+import time
+
+# A chat turn is split in two halves so the streaming endpoint can send the
+# model output before persisting it:
+#   prepare_*_turn  -> reads/writes needed to build the prompt, returns a turn dict
+#   complete_turn   -> writes that depend on the LLM answer (turn["llm_json"])
 
 # ---------------------------
 # FIRST QUESTION
 # ---------------------------
-async def first_question(session_id: str) -> Dict[str, Any]:
-    connection = await get_conn()
-    row = await connection.fetchrow("""
-        SELECT company_profile, current_category
-        FROM sessions
-        WHERE session_id = $1
-    """, session_id)
-
-    if not row:
+async def prepare_first_turn(session_id: str) -> Dict[str, Any]:
+    state = await session_cache.get(session_id)
+
+    if not state:
         raise ValueError("Invalid session_id")
 
     data = {
-        "company_profile": row["company_profile"],
+        "company_profile": state.company_profile,
+        "company_profile_json": state.profile_json,
     }
 
-    prompt = build_prompt1(data)
-    llm_json = await ask_model(prompt)
+    return {
+        "kind": "first",
+        "session_id": session_id,
+        "current_category": state.current_category,
+        "prompt": build_prompt1(data, structured=LLM_STRUCTURED_OUTPUT),
+    }
 
-    await connection.execute("""
-        UPDATE sessions
-        SET current_category = $1
-        WHERE session_id = $2
-    """,
-        llm_json.get("next_category") or row["current_category"],
-        session_id
-    )
 
-    return llm_json
+async def _complete_first_turn(turn: Dict[str, Any]):
+    llm_json = turn["llm_json"]
+    current_category = llm_json.get("next_category") or turn["current_category"]
+
+    async with acquire() as connection:
+        await connection.execute("""
+            UPDATE sessions
+            SET current_category = $1
+            WHERE session_id = $2
+        """,
+            current_category,
+            turn["session_id"]
+        )
+    session_cache.update(turn["session_id"], current_category=current_category)
+
+
+async def first_question(session_id: str) -> Dict[str, Any]:
+    turn = await prepare_first_turn(session_id)
+    turn["llm_json"] = await ask_model(turn["prompt"], ChatLLMResponse, session_id=turn["session_id"], hedge=True)
+    await complete_turn(turn)
+    return turn["llm_json"]
 
 
 # ---------------------------
 # NEXT QUESTION
 # ---------------------------
-async def next_question(req_data: Dict[str, Any]) -> Dict[str, Any]:
+# Stage graph of a turn (independent branches run concurrently, each DB
+# stage on its own pooled connection):
+#
+#   insert_qa -> fetch_category_qa (digest + newer Q/A) -------.
+#   fetch_session -------------------------------------------+--> prompt -> llm -> persist
+#        |                                                    |
+#   embed -> (session exists?) -> semantic_search -------------'
+#
+# The vector_memory row of this turn is handed to the write-behind queue once
+# the session is known to exist; semantic_search excludes the current
+# category, so it does not need it.
+
+_stage_totals: Dict[str, list] = {}  # name -> [count, total_ms, max_ms]
+
+
+async def _stage(timings: Dict[str, float], name: str, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        timings[name] = elapsed
+        totals = _stage_totals.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] = max(totals[2], elapsed)
+
+
+def stage_stats() -> Dict[str, Any]:
+    return {
+        name: {"count": count, "avg_ms": round(total / count, 2), "max_ms": max_ms}
+        for name, (count, total, max_ms) in _stage_totals.items()
+    }
+
+
+async def _insert_qa(session_id: str, category: str, question: str, answer: str):
+    async with acquire() as connection:
+        await connection.execute("""
+            INSERT INTO qa_messages (session_id, category, question_text, answer_text)
+            VALUES ($1, $2, $3, $4)
+        """, session_id, category, question, answer)
+
+
+async def prepare_next_turn(req_data: Dict[str, Any]) -> Dict[str, Any]:
     session_id = req_data["session_id"]
     category = req_data["category"]
     question = req_data["question"]
     answer = req_data["answer"]
 
-    connection = await get_conn()
+    timings: Dict[str, float] = {}
+    content = f"Q: {question}\nA: {answer}"
 
-    # ---------- STORE Q & A ----------
-    await connection.execute("""
-        INSERT INTO qa_messages (session_id, category, question_text, answer_text)
-        VALUES ($1, $2, $3, $4)
-    """, session_id, category, question, answer)
+    # ---------- STORE Q & A, THEN Q/A IN CURRENT CATEGORY ----------
+    async def qa_branch():
+        await _stage(timings, "insert_qa", _insert_qa(session_id, category, question, answer))
+        return await _stage(timings, "fetch_category_qa", category_digest.fetch_transcript(session_id, category))
 
-    # ---------- VECTOR MEMORY INSERT ----------
-    content = f"Q: {question}\nA: {answer}"
-    entry_embedding = embed_text(content)
-
-    await connection.execute("""
-        INSERT INTO vector_memory (session_id, content, category, embedding)
-        VALUES ($1, $2, $3, $4)
-    """, session_id, content, category, entry_embedding)
-
-    # ---------- FETCH SESSION DATA ----------
-    session_row = await connection.fetchrow("""
-        SELECT company_profile, summary_text, current_category, missing_fields
-        FROM sessions WHERE session_id = $1
-    """, session_id)
-
-    # ---------- Q/A IN CURRENT CATEGORY ----------
-    qa_category_rows = await connection.fetch("""
-        SELECT question_text, answer_text
-        FROM qa_messages
-        WHERE session_id = $1 AND category = $2
-        ORDER BY created_at ASC
-    """, session_id, category)
+    session_task = asyncio.ensure_future(_stage(timings, "fetch_session", session_cache.get(session_id)))
+
+    # ---------- EMBED, THEN VECTOR MEMORY INSERT + SEMANTIC SEARCH ----------
+    async def memory_branch():
+        entry_embedding = await _stage(timings, "embed", embed_text(content))
+        # never queue a row for a session that does not exist: it would fail
+        # the write-behind batch it lands in, not this request
+        if not await session_task:
+            raise ValueError("Invalid session_id")
+        # earlier turns' vector_memory rows must be visible to the search
+        await _stage(timings, "write_behind_wait", write_behind.wait_for_session(session_id))
+        write_behind.enqueue(session_id, "vector_memory", (session_id, content, category, entry_embedding))
+        if session_vector_cache.SESSION_VECTOR_CACHE:
+            await session_vector_cache.add(session_id, content, category, entry_embedding)
+        return await _stage(timings, "semantic_search", semantic_search(
+            session_id=session_id,
+            current_category=category,
+            query_embedding=entry_embedding,
+            limit=5
+        ))
+
+    (digest, qa_category_rows), state, relevant_qa = await _stage(timings, "prepare", asyncio.gather(
+        qa_branch(),
+        session_task,
+        memory_branch(),
+    ))
+
+    if not state:
+        raise ValueError("Invalid session_id")
 
     qa_in_category = [
         {"question": r["question_text"], "answer": r["answer_text"]}
         for r in qa_category_rows
     ]
-
-    # ---------- SEMANTIC VECTOR SEARCH ----------
-    relevant_qa = await semantic_search(
-        session_id=session_id,
-        current_category=category,
-        query_embedding=entry_embedding,
-        limit=5
-    )
+    # older turns of a long category are folded into the digest in the background
+    category_digest.maybe_compact(session_id, category, qa_category_rows)
 
     # ---------- LAST Q/A ----------
     last_qa = [{"question": question, "answer": answer}]
 
     # ---------- BUILD PROMPT INPUT DATA ----------
     data = {
-        "company_profile": session_row["company_profile"],
-        "summary": session_row["summary_text"] or "",
+        "company_profile": state.company_profile,
+        "company_profile_json": state.profile_json,
+        "summary": state.summary,
         "relevant_qa": relevant_qa,
-        "missing_fields": session_row["missing_fields"] or [],
-        "current_category": session_row["current_category"],
+        "missing_fields": state.missing_fields,
+        "current_category": state.current_category,
+        "category_digest": digest["digest_text"] if digest else "",
         "qa_in_category": qa_in_category,
         "last_qa": last_qa,
     }
+    # bounded to PROMPT1_CONTEXT_BUDGET tokens, recent Q/As first
+    data, context = assemble_prompt1(data)
+
+    return {
+        "kind": "next",
+        "session_id": session_id,
+        "category": category,
+        "current_category": state.current_category,
+        "prompt": build_prompt1(data, structured=LLM_STRUCTURED_OUTPUT),
+        "timings": timings,
+        "context": context,
+    }
+
 
-    prompt = build_prompt1(data)
-    llm_json = await ask_model(prompt)
+async def _complete_next_turn(turn: Dict[str, Any]):
+    session_id = turn["session_id"]
+    category = turn["category"]
+    llm_json = turn["llm_json"]
 
-    # ---------- STORE EXTRACTED FIELDS ----------
+    # extracted fields are the user's data: written inline (one statement),
+    # not through the in-memory write-behind queue
     extracted_fields = llm_json.get("extracted_fields") or []
-    for sf in extracted_fields:
-        await connection.execute("""
-            INSERT INTO structured_fields (
-                session_id, category, entity_id, field_name,
-                field_value_text, field_value_float
+    rows = [
+        structured_field_row((
+            session_id, category,
+            sf.get("entity_id"),
+            sf.get("field_name"),
+            sf.get("field_value_text"),
+            sf.get("field_value_float")
+        ))
+        for sf in extracted_fields
+    ]
+
+    current_category = llm_json.get("next_category") or turn["current_category"]
+    missing_fields = llm_json.get("updated_missing_field") or []
+
+    async with acquire() as connection:
+        async with connection.transaction():
+            # ---------- STORE EXTRACTED FIELDS ----------
+            await insert_structured_fields(connection, rows)
+
+            # ---------- UPDATE SESSION STATE ----------
+            await connection.execute("""
+                UPDATE sessions
+                SET current_category = $1,
+                    missing_fields = $2,
+                    category_completion = $3
+                WHERE session_id = $4
+            """,
+                current_category,
+                missing_fields,
+                llm_json.get("category_complete", False),
+                session_id
             )
-            VALUES ($1, $2, $3, $4, $5, $6)
-        """,
-        session_id, category,
-        sf.get("entity_id"),
-        sf.get("field_name"),
-        sf.get("field_value_text"),
-        sf.get("field_value_float")
-    )
-
-    # ---------- UPDATE SESSION STATE ----------
-    await connection.execute("""
-        UPDATE sessions
-        SET current_category = $1,
-            missing_fields = $2,
-            category_completion = $3
-        WHERE session_id = $4
-    """,
-        llm_json.get("next_category") or session_row["current_category"],
-        json.dumps(llm_json.get("updated_missing_field") or []),
-        llm_json.get("category_complete", False),
-        session_id
-    )
-
-    return llm_json
\ No newline at end of file
+    if rows:
+        llm_cache.invalidate(session_id, category)
+    session_cache.update(session_id, current_category=current_category, missing_fields=missing_fields)
+
+
+async def next_question(req_data: Dict[str, Any]) -> Dict[str, Any]:
+    turn = await prepare_next_turn(req_data)
+    timings = turn["timings"]
+    turn["llm_json"] = await _stage(timings, "llm", ask_model(turn["prompt"], ChatLLMResponse, session_id=turn["session_id"], hedge=True))
+    await _stage(timings, "persist", complete_turn(turn))
+    return turn["llm_json"]
+
+
+# ---------------------------
+# SHARED / STREAMING
+# ---------------------------
+async def complete_turn(turn: Dict[str, Any]):
+    """Persist the LLM answer of a prepared turn (no-op if generation never finished)."""
+    if "llm_json" not in turn:
+        return
+
+    if turn["kind"] == "first":
+        await _complete_first_turn(turn)
+    else:
+        await _complete_next_turn(turn)
+
+
+async def stream_turn(turn: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields ("token", {"text": ...}) while next_question is being generated,
+    then ("final", llm_json). The parsed answer is stored on turn["llm_json"]
+    for complete_turn.
+    """
+    question = StreamingStringField("next_question")
+    chunks = []
+
+    async for chunk in stream_model(turn["prompt"], ChatLLMResponse, session_id=turn["session_id"]):
+        chunks.append(chunk)
+        text = question.feed(chunk)
+        if text:
+            yield "token", {"text": text}
+
+    llm_json = parse_model_text("".join(chunks), ChatLLMResponse)
+    turn["llm_json"] = llm_json
+    yield "final", llm_json
@@ -1,50 +1,57 @@
 # services/confidence_service.py
 
 from typing import Dict, Any
-from database import get_conn
+from database import acquire
 from services.prompt_builder import build_prompt3B
-from services.llm_service import ask_model
-import json
+from services.llm_service import ask_model, LLM_MODEL, LLM_STRUCTURED_OUTPUT
+from services import write_behind, llm_cache, session_cache
+from services.single_flight import SingleFlight
+from schemas import ConfidenceLLMResponse
+
+# concurrent identical requests (double clicks, page reloads) share one run
+_in_flight = SingleFlight("confidence")
 
 async def generate_confidence(data: Dict[str, Any]) -> Dict[str, Any]:
-    session_id = data["session_id"]
-    category = data["category"]
+    key = (str(data["session_id"]), data["category"])
+    return await _in_flight.do(key, lambda: _generate_confidence(data))
 
-    db = await get_conn()
 
-    # ---------------------------------------------------------
-    # 1. Fetch emissions snapshot
-    # ---------------------------------------------------------
-    snapshot = await db.fetchrow("""
-        SELECT id, raw_emissions, steps, scope
-        FROM emissions_snapshots
-        WHERE session_id = $1 AND category = $2
-    """, session_id, category)
+async def _generate_confidence(data: Dict[str, Any]) -> Dict[str, Any]:
+    session_id = data["session_id"]
+    category = data["category"]
 
-    if not snapshot:
-        raise ValueError("No emissions snapshot found. Run 3A first.")
+    # entity_emission updates of an earlier calculation may still be queued
+    await write_behind.wait_for_session(session_id)
+
+    async with acquire() as db:
+        # ---------------------------------------------------------
+        # 1. Fetch emissions snapshot
+        # ---------------------------------------------------------
+        snapshot = await db.fetchrow("""
+            SELECT id, raw_emissions, steps, scope
+            FROM emissions_snapshots
+            WHERE session_id = $1 AND category = $2
+        """, session_id, category)
+
+        if not snapshot:
+            raise ValueError("No emissions snapshot found. Run 3A first.")
+
+        # ---------------------------------------------------------
+        # 2. Fetch structured fields
+        # ---------------------------------------------------------
+        field_rows = await db.fetch("""
+            SELECT entity_id, field_name, field_value_text, field_value_float
+            FROM structured_fields
+            WHERE session_id = $1 AND category = $2
+        """, session_id, category)
 
     snapshot_id = snapshot["id"]
     raw_emissions = snapshot["raw_emissions"]
     raw_steps = snapshot["steps"]
     scope = snapshot["scope"]
 
-    profile_row = await db.fetchrow("""
-    SELECT company_profile
-    FROM sessions
-    WHERE session_id = $1
-    """, session_id)
-
-    company_profile = profile_row["company_profile"] if profile_row else {}
-
-    # ---------------------------------------------------------
-    # 2. Fetch structured fields
-    # ---------------------------------------------------------
-    field_rows = await db.fetch("""
-        SELECT entity_id, field_name, field_value_text, field_value_float
-        FROM structured_fields
-        WHERE session_id = $1 AND category = $2
-    """, session_id, category)
+    state = await session_cache.get(session_id)
+    company_profile = state.company_profile if state else {}
 
     structured_fields = [
         {
@@ -56,21 +63,27 @@ async def generate_confidence(data: Dict[str, Any]) -> Dict[str, Any]:
         for r in field_rows
     ]
 
-    # ---------------------------------------------------------
-    # 3. Build Prompt 3B
-    # ---------------------------------------------------------
-    prompt = build_prompt3B({
+    prompt_inputs = {
         "raw_emissions": raw_emissions,
         "raw_steps": raw_steps,
         "structured_fields": structured_fields,
         "scope": scope,
         "company_profile": company_profile
-    })
+    }
+
+    # ---------------------------------------------------------
+    # 3. Cached answer for identical inputs
+    # ---------------------------------------------------------
+    cache_key = llm_cache.cache_key("prompt3B", prompt_inputs, LLM_MODEL, LLM_STRUCTURED_OUTPUT)
+    llm_output = await llm_cache.get(cache_key)
 
     # ---------------------------------------------------------
-    # 4. Ask LLM
+    # 4. Otherwise build Prompt 3B and ask LLM
     # ---------------------------------------------------------
-    llm_output = await ask_model(prompt)
+    if llm_output is None:
+        prompt = build_prompt3B(prompt_inputs, structured=LLM_STRUCTURED_OUTPUT)
+        llm_output = await ask_model(prompt, ConfidenceLLMResponse, priority="calculation", session_id=session_id)
+        await llm_cache.put(cache_key, llm_output, session_id, category, "prompt3B", LLM_MODEL)
 
     calculation_valid = bool(llm_output.get("calculation_valid", False))
     confidence_model = float(llm_output.get("confidence_model", 0.0))
@@ -87,42 +100,39 @@ async def generate_confidence(data: Dict[str, Any]) -> Dict[str, Any]:
     confidence_data = 1.0 if total_fields == 0 else (1 - missing / total_fields)
     confidence_final = 0.5 * confidence_model + 0.5 * confidence_data
 
-    # ---------------------------------------------------------
-    # 6. Update emissions snapshot
-    # ---------------------------------------------------------
-    await db.execute("""
-        UPDATE emissions_snapshots
-        SET
-            calculation_valid = $1,
-            confidence_model = $2,
-            confidence_data = $3,
-            confidence_final = $4,
-            missing_fields = $5
-        WHERE id = $6
-    """,
-        calculation_valid,
-        confidence_model,
-        confidence_data,
-        confidence_final,
-        json.dumps(missing_fields),
-        snapshot_id
-    )
-
-    # ---------------------------------------------------------
-    # 7. UPDATE SESSIONS TABLE (only if category matches)
-    # ---------------------------------------------------------
-    session_row = await db.fetchrow("""
-        SELECT current_category
-        FROM sessions
-        WHERE session_id = $1
-    """, session_id)
-
-    if session_row and session_row["current_category"] == category:
+    async with acquire() as db:
+        # ---------------------------------------------------------
+        # 6. Update emissions snapshot
+        # ---------------------------------------------------------
         await db.execute("""
+            UPDATE emissions_snapshots
+            SET
+                calculation_valid = $1,
+                confidence_model = $2,
+                confidence_data = $3,
+                confidence_final = $4,
+                missing_fields = $5
+            WHERE id = $6
+        """,
+            calculation_valid,
+            confidence_model,
+            confidence_data,
+            confidence_final,
+            missing_fields,
+            snapshot_id
+        )
+
+        # ---------------------------------------------------------
+        # 7. UPDATE SESSIONS TABLE (only if category matches)
+        # ---------------------------------------------------------
+        result = await db.execute("""
             UPDATE sessions
             SET missing_fields = $1
-            WHERE session_id = $2
-        """, missing_fields, session_id)
+            WHERE session_id = $2 AND current_category = $3
+        """, missing_fields, session_id, category)
+
+    if result == "UPDATE 1":
+        session_cache.update(session_id, missing_fields=missing_fields)
 
     # ---------------------------------------------------------
     # 8. Return final response
@@ -0,0 +1,246 @@
+# services/context_assembler.py
+from services import fast_json
+from typing import Any, Dict, List, Tuple
+import os
+
+# Token-budgeted input data for build_prompt1. Without a bound, every Q/A of
+# the current category goes into every turn, so a long category makes each
+# prompt grow linearly (and a session's total tokens quadratically). The
+# assembler fills PROMPT1_CONTEXT_BUDGET tokens in priority order:
+#
+#   1. current category, missing fields, the last Q/A   (always kept)
+#   2. company profile, compacted                        (<= PROFILE_SHARE of the budget)
+#   3. the PROMPT1_RECENT_QA newest Q/As of the category
+#   4. category digest of the older Q/As                 (<= DIGEST_SHARE)
+#   5. summary                                           (<= SUMMARY_SHARE, tail kept)
+#   6. semantic hits, deduplicated, best first
+#   7. older Q/As of the category, newest first
+#
+# Token counts are a local estimate (UTF-8 bytes / 4); Gemini tokenizes
+# English JSON at roughly that rate, and no network call is made per turn.
+PROMPT1_CONTEXT_BUDGET = int(os.getenv("PROMPT1_CONTEXT_BUDGET", "4000"))
+PROMPT1_RECENT_QA = int(os.getenv("PROMPT1_RECENT_QA", "4"))
+PROFILE_SHARE = 0.25
+SUMMARY_SHARE = 0.25
+DIGEST_SHARE = 0.25
+# profile strings longer than this are shortened
+PROFILE_VALUE_CHARS = 300
+
+SECTIONS = ("current_category", "missing_fields", "last_qa", "company_profile",
+            "qa_in_category", "category_digest", "summary", "relevant_qa")
+
+# section -> [turns, tokens, items dropped]
+_totals: Dict[str, list] = {}
+_turns = 0
+_over_budget = 0
+
+
+def estimate_tokens(value: Any) -> int:
+    """Approximate token count of a string, or of a value's JSON encoding."""
+    if not isinstance(value, str):
+        value = fast_json.dumps(value)
+    return (len(value.encode("utf-8")) + 3) // 4
+
+
+def _shorten(text: str, tokens: int, keep_tail: bool = False) -> str:
+    limit = max(tokens, 0) * 4
+    if len(text.encode("utf-8")) <= limit:
+        return text
+    # chars, not bytes: slightly under the limit for non-ASCII text
+    limit = max(limit - 3, 0)
+    return "…" + text[-limit:] if keep_tail else text[:limit] + "…"
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        compacted = {k: _compact(v) for k, v in value.items()}
+        return {k: v for k, v in compacted.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [v for v in (_compact(v) for v in value) if v not in (None, "", [], {})]
+    if isinstance(value, str):
+        return _shorten(value.strip(), PROFILE_VALUE_CHARS // 4)
+    return value
+
+
+def compact_profile(profile: Any) -> Any:
+    """Drop empty values and shorten long strings; the profile is JSON (string or dict)."""
+    if isinstance(profile, str):
+        try:
+            profile = fast_json.loads(profile)
+        except ValueError:
+            pass
+    return _compact(profile)
+
+
+def serialize_profile(profile: Any) -> str:
+    """Compacted profile as the JSON text build_prompt1 embeds."""
+    return fast_json.dumps(compact_profile(profile))
+
+
+def _trim(value: Any, chars: int, items: int) -> Any:
+    if isinstance(value, dict):
+        return {k: _trim(v, chars, items) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_trim(v, chars, items) for v in value[:items]]
+    if isinstance(value, str):
+        return _shorten(value, chars // 4)
+    return value
+
+
+def fit_profile(profile_json: str, tokens: int) -> str:
+    """
+    The serialized profile shrunk to fit in tokens, still valid JSON: strings
+    and lists are cut shorter and shorter, then trailing keys (the later
+    onboarding answers) are dropped.
+    """
+    if estimate_tokens(profile_json) <= tokens:
+        return profile_json
+    try:
+        profile = fast_json.loads(profile_json)
+    except ValueError:
+        profile = profile_json
+
+    text, chars, items = profile_json, PROFILE_VALUE_CHARS, 8
+    while estimate_tokens(text) > tokens and chars > 16:
+        chars, items = chars // 2, max(items // 2, 1)
+        profile = _trim(profile, chars, items)
+        text = fast_json.dumps(profile)
+
+    while estimate_tokens(text) > tokens and isinstance(profile, (dict, list)) and profile:
+        if isinstance(profile, dict):
+            profile = dict(list(profile.items())[:-1])
+        else:
+            profile = profile[:-1]
+        text = fast_json.dumps(profile)
+    return text
+
+
+def _qa_key(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _qa_text(qa: Dict[str, Any]) -> str:
+    # same form as the vector_memory content of a turn
+    return f"Q: {qa.get('question', '')}\nA: {qa.get('answer', '')}"
+
+
+def _fit(items: List[Any], budget: int) -> Tuple[List[Any], int]:
+    """Leading items of a list that fit in budget tokens (stops at the first that does not)."""
+    kept, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item)
+        if used + cost > budget:
+            break
+        kept.append(item)
+        used += cost
+    return kept, used
+
+
+def assemble_prompt1(data: Dict[str, Any], budget: int | None = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Returns (prompt data, report). The prompt data has the keys build_prompt1
+    expects, the profile as compacted company_profile_json; the report gives
+    tokens and dropped items per section.
+    """
+    budget = PROMPT1_CONTEXT_BUDGET if budget is None else budget
+    qa_all = data.get("qa_in_category") or []
+    last_qa = data.get("last_qa") or []
+
+    out: Dict[str, Any] = {}
+    report: Dict[str, Dict[str, int]] = {}
+    left = budget
+
+    def take(section: str, value: Any, tokens: int, dropped: int = 0):
+        nonlocal left
+        out[section] = value
+        left -= tokens
+        entry = report.setdefault(section, {"tokens": 0, "dropped": 0})
+        entry["tokens"] += tokens
+        entry["dropped"] = dropped
+
+    # ---------- 1. REQUIRED ----------
+    for section in ("current_category", "missing_fields", "last_qa"):
+        value = data.get(section)
+        take(section, value, estimate_tokens(value))
+
+    # ---------- 2. PROFILE (serialized; session_cache keeps it ready) ----------
+    profile_json = data.get("company_profile_json")
+    if profile_json is None:
+        profile_json = serialize_profile(data.get("company_profile"))
+    profile_json = fit_profile(profile_json, max(int(budget * PROFILE_SHARE), 0))
+    take("company_profile", data.get("company_profile"), estimate_tokens(profile_json))
+    out["company_profile_json"] = profile_json
+
+    # ---------- 3. RECENT Q/A (the last Q/A is already its own section) ----------
+    seen = {_qa_key(_qa_text(qa)) for qa in last_qa}
+    history = [
+        qa for qa in qa_all
+        if _qa_key(_qa_text(qa)) not in seen
+    ]
+    newest_first = history[::-1]
+    recent, recent_cost = _fit(newest_first[:PROMPT1_RECENT_QA], max(left, 0))
+    left -= recent_cost
+
+    # ---------- 4. CATEGORY DIGEST ----------
+    digest = data.get("category_digest") or ""
+    digest_cap = min(int(budget * DIGEST_SHARE), max(left, 0))
+    if estimate_tokens(digest) > digest_cap:
+        digest = _shorten(digest, digest_cap)
+    take("category_digest", digest, estimate_tokens(digest), int(digest != (data.get("category_digest") or "")))
+
+    # ---------- 5. SUMMARY ----------
+    summary = data.get("summary") or ""
+    summary_cap = min(int(budget * SUMMARY_SHARE), max(left, 0))
+    if estimate_tokens(summary) > summary_cap:
+        # the newest part of a rolling summary is the most relevant
+        summary = _shorten(summary, summary_cap, keep_tail=True)
+    take("summary", summary, estimate_tokens(summary), int(summary != (data.get("summary") or "")))
+
+    # ---------- 6. SEMANTIC HITS ----------
+    hits, hit_keys = [], set(seen)
+    hit_keys.update(_qa_key(_qa_text(qa)) for qa in history)
+    for hit in data.get("relevant_qa") or []:
+        key = _qa_key(hit.get("content", ""))
+        if key in hit_keys:
+            continue
+        hit_keys.add(key)
+        hits.append(hit)
+    kept_hits, cost = _fit(hits, max(left, 0))
+    take("relevant_qa", kept_hits, cost, len(data.get("relevant_qa") or []) - len(kept_hits))
+
+    # ---------- 7. OLDER Q/A ----------
+    older, older_cost = ([], 0)
+    if len(recent) == min(len(newest_first), PROMPT1_RECENT_QA):
+        older, older_cost = _fit(newest_first[len(recent):], max(left, 0))
+    kept_qa = (recent + older)[::-1]
+    out["qa_in_category"] = kept_qa
+    report["qa_in_category"] = {"tokens": recent_cost + older_cost, "dropped": len(history) - len(kept_qa)}
+
+    report = {section: report[section] for section in SECTIONS}
+    total = sum(entry["tokens"] for entry in report.values())
+    _record(report, total > budget)
+    return out, {"budget": budget, "total": total, "sections": report}
+
+
+def _record(report: Dict[str, Dict[str, int]], over: bool):
+    global _turns, _over_budget
+
+    _turns += 1
+    _over_budget += int(over)
+    for section, entry in report.items():
+        totals = _totals.setdefault(section, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += entry["tokens"]
+        totals[2] += entry["dropped"]
+
+
+def context_stats() -> Dict[str, Any]:
+    return {
+        "budget": PROMPT1_CONTEXT_BUDGET,
+        "turns": _turns,
+        "over_budget": _over_budget,
+        "sections": {
+            section: {"avg_tokens": round(tokens / turns, 1), "dropped": dropped}
+            for section, (turns, tokens, dropped) in _totals.items()
+        },
+    }
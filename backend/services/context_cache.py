@@ -0,0 +1,135 @@
+# services/context_cache.py
+from google.genai import types
+from services.genai_client import get_client
+from typing import Dict, Tuple
+import asyncio
+import hashlib
+import os
+import time
+
+# Gemini explicit context caching for the static part of a Prompt
+# (services/prompt_builder.py). The prefix is uploaded once per worker as
+# cached content; calls then send only the dynamic part and reference the
+# cache by name. Whenever no cache is available (disabled, prefix below the
+# provider minimum, create failed, cache expired) callers send the plain
+# concatenation instead; since the static part comes first, Gemini's implicit
+# prefix caching can still apply then.
+LLM_CONTEXT_CACHE = os.getenv("LLM_CONTEXT_CACHE", "1") == "1"
+LLM_CONTEXT_CACHE_TTL = int(os.getenv("LLM_CONTEXT_CACHE_TTL", "3600"))
+# ~1024 tokens, the smallest cacheable content on Flash models
+LLM_CONTEXT_CACHE_MIN_CHARS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_CHARS", "4000"))
+# after a failed create, send full prompts for this long before trying again
+LLM_CONTEXT_CACHE_RETRY = float(os.getenv("LLM_CONTEXT_CACHE_RETRY", "600"))
+CREATE_TIMEOUT = 10.0
+# renew a cache this long before it expires
+RENEW_MARGIN = 120.0
+
+# key -> (cached content name, expires_at monotonic)
+_caches: Dict[str, Tuple[str, float]] = {}
+_creating: Dict[str, asyncio.Future] = {}
+_failed_until: Dict[str, float] = {}
+
+_created = 0
+_used = 0
+_fallbacks = 0
+_failures = 0
+
+
+def _key(model: str, prompt) -> str:
+    raw = f"{model}\x1f{prompt.name}\x1f{prompt.version}\x1f{prompt.static}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _create(key: str, model: str, prompt) -> str | None:
+    global _created, _failures
+
+    try:
+        cache = await get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"ecoagent-{prompt.name}-v{prompt.version}",
+                contents=[types.Content(role="user", parts=[types.Part(text=prompt.static)])],
+                ttl=f"{LLM_CONTEXT_CACHE_TTL}s",
+            ),
+        )
+        _caches[key] = (cache.name, time.monotonic() + LLM_CONTEXT_CACHE_TTL)
+        _created += 1
+        print(f"🗃️ Context cache {cache.name} for {prompt.name} v{prompt.version}")
+        return cache.name
+    except Exception as e:
+        _failures += 1
+        _failed_until[key] = time.monotonic() + LLM_CONTEXT_CACHE_RETRY
+        print(f"⚠️ Context cache for {prompt.name} unavailable, sending full prompts:", e)
+        return None
+    finally:
+        _creating.pop(key, None)
+
+
+async def cached_content_for(model: str, prompt) -> str | None:
+    """Name of the cached content holding prompt.static, or None to send prompt.text."""
+    global _used, _fallbacks
+
+    if not LLM_CONTEXT_CACHE or len(prompt.static) < LLM_CONTEXT_CACHE_MIN_CHARS:
+        _fallbacks += 1
+        return None
+
+    key = _key(model, prompt)
+    now = time.monotonic()
+    entry = _caches.get(key)
+    if entry and entry[1] - now > RENEW_MARGIN:
+        _used += 1
+        return entry[0]
+
+    if _failed_until.get(key, 0) > now:
+        _fallbacks += 1
+        return None
+
+    # one create per prefix; concurrent callers wait for it
+    pending = _creating.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_create(key, model, prompt))
+        _creating[key] = pending
+
+    try:
+        name = await asyncio.wait_for(asyncio.shield(pending), CREATE_TIMEOUT)
+    except asyncio.TimeoutError:
+        name = None
+
+    if name is None:
+        _fallbacks += 1
+    else:
+        _used += 1
+    return name
+
+
+def is_cache_error(e: BaseException) -> bool:
+    """The referenced cached content is gone or unusable (expired, deleted, wrong model)."""
+    return getattr(e, "code", None) in (400, 403, 404) and "cache" in str(e).lower()
+
+
+def invalidate(name: str):
+    for key, (cached_name, _) in list(_caches.items()):
+        if cached_name == name:
+            del _caches[key]
+
+
+async def close_context_caches():
+    """Best-effort delete of this worker's caches on shutdown (they expire anyway)."""
+    names = [name for name, _ in _caches.values()]
+    _caches.clear()
+    for name in names:
+        try:
+            await asyncio.wait_for(get_client().aio.caches.delete(name=name), CREATE_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ Could not delete context cache {name}:", e)
+
+
+def context_cache_stats() -> dict:
+    return {
+        "enabled": LLM_CONTEXT_CACHE,
+        "caches": len(_caches),
+        "created": _created,
+        "used": _used,
+        "fallbacks": _fallbacks,
+        "create_failures": _failures,
+    }
@@ -0,0 +1,41 @@
+# services/deadlines.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import time
+
+# Request deadlines. A router opens deadline_after(seconds) around the service
+# call; everything awaited inside (including tasks created there, which copy
+# the context) sees the same absolute deadline through remaining(), so an LLM
+# call made deep in a service never outlives the request that needs it.
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "25"))
+SUMMARY_DEADLINE = float(os.getenv("SUMMARY_DEADLINE", "60"))
+CALCULATION_DEADLINE = float(os.getenv("CALCULATION_DEADLINE", "90"))
+
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextmanager
+def deadline_after(seconds: float):
+    """Nested scopes can only shorten the deadline, never extend it."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline() -> float | None:
+    return _deadline.get()
+
+
+def remaining() -> float | None:
+    """Seconds left before the current deadline (None without one)."""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
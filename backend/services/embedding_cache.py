@@ -0,0 +1,103 @@
+# services/embedding_cache.py
+from collections import OrderedDict
+from database import acquire
+from typing import Dict, List
+import hashlib
+import os
+import re
+import unicodedata
+
+# In-memory tier: bounded LRU of content_hash -> vector
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "5000"))
+# Postgres tier (embedding_cache table, migrations/0002), shared by all workers
+EMBED_CACHE_PERSIST = os.getenv("EMBED_CACHE_PERSIST", "1") == "1"
+
+_memory: "OrderedDict[str, List[float]]" = OrderedDict()
+
+_memory_hits = 0
+_db_hits = 0
+_misses = 0
+
+
+def normalize(text: str) -> str:
+    """Canonical form used for hashing: NFC, whitespace collapsed, trimmed."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text: str, model: str, dimension: int) -> str:
+    raw = f"{model}\x1f{dimension}\x1f{normalize(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_memory(key: str) -> List[float] | None:
+    global _memory_hits
+
+    vector = _memory.get(key)
+    if vector is not None:
+        _memory.move_to_end(key)
+        _memory_hits += 1
+    return vector
+
+
+def put_memory(key: str, vector: List[float]):
+    _memory[key] = vector
+    _memory.move_to_end(key)
+    while len(_memory) > EMBED_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+async def load(keys: List[str]) -> Dict[str, List[float]]:
+    """Postgres tier lookup for a whole batch; misses are counted here."""
+    global _db_hits, _misses
+
+    found: Dict[str, List[float]] = {}
+    if EMBED_CACHE_PERSIST and keys:
+        try:
+            async with acquire() as connection:
+                rows = await connection.fetch("""
+                    SELECT content_hash, embedding
+                    FROM embedding_cache
+                    WHERE content_hash = ANY($1::text[])
+                """, keys)
+            found = {r["content_hash"]: [float(x) for x in r["embedding"]] for r in rows}
+        except Exception as e:
+            print("⚠️ Embedding cache lookup failed:", e)
+
+    for key, vector in found.items():
+        put_memory(key, vector)
+
+    _db_hits += len(found)
+    _misses += len(keys) - len(found)
+    return found
+
+
+async def store(entries: Dict[str, List[float]], model: str, dimension: int):
+    for key, vector in entries.items():
+        put_memory(key, vector)
+
+    if not EMBED_CACHE_PERSIST or not entries:
+        return
+
+    try:
+        async with acquire() as connection:
+            await connection.executemany("""
+                INSERT INTO embedding_cache (content_hash, model, dimension, embedding)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (content_hash) DO NOTHING
+            """, [(key, model, dimension, vector) for key, vector in entries.items()])
+    except Exception as e:
+        print("⚠️ Embedding cache write failed:", e)
+
+
+def cache_stats() -> dict:
+    lookups = _memory_hits + _db_hits + _misses
+    return {
+        "memory_size": len(_memory),
+        "memory_capacity": EMBED_CACHE_SIZE,
+        "persistent": EMBED_CACHE_PERSIST,
+        "memory_hits": _memory_hits,
+        "db_hits": _db_hits,
+        "misses": _misses,
+        "hit_ratio": round((_memory_hits + _db_hits) / lookups, 4) if lookups else 0.0,
+    }
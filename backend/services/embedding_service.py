@@ -1,22 +1,147 @@
-from google import genai
 from google.genai import types
+from services.genai_client import get_client
+from services import embedding_cache
+from services.rate_limiter import AdaptiveLimiter
+from typing import List
+import asyncio
 import os
 
-def embed_text(text: str):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY missing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
 
-    client = genai.Client(api_key=api_key)
+# Micro-batching: requests arriving within the window are sent as one
+# multi-content embed_content call (flushed early once the batch is full)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "100"))
 
-    result = client.models.embed_content(
-        model="gemini-embedding-001",
-        contents=text,
-        config=types.EmbedContentConfig(output_dimensionality=1536)
+# Admission control for embed_content calls (one per batch), separate from
+# the generate quota; see services/rate_limiter.py
+EMBED_RATE_LIMIT_RPM = float(os.getenv("EMBED_RATE_LIMIT_RPM", "0"))
+EMBED_RATE_LIMIT_BURST = int(os.getenv("EMBED_RATE_LIMIT_BURST", "20"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "16"))
+EMBED_LATENCY_TARGET = float(os.getenv("EMBED_LATENCY_TARGET", "5"))
+EMBED_QUEUE_MAX = int(os.getenv("EMBED_QUEUE_MAX", "1024"))
+EMBED_QUEUE_TIMEOUT = float(os.getenv("EMBED_QUEUE_TIMEOUT", "10"))
+# one embed_content call may not take longer than this (seconds)
+EMBED_CALL_TIMEOUT = float(os.getenv("EMBED_CALL_TIMEOUT", "15"))
+
+embed_limiter = AdaptiveLimiter(
+    "embeddings",
+    rate_per_minute=EMBED_RATE_LIMIT_RPM,
+    burst=EMBED_RATE_LIMIT_BURST,
+    min_concurrency=1,
+    max_concurrency=EMBED_MAX_CONCURRENCY,
+    latency_target=EMBED_LATENCY_TARGET,
+    max_queue=EMBED_QUEUE_MAX,
+    queue_timeout=EMBED_QUEUE_TIMEOUT,
+)
+
+
+async def embed_many(texts: List[str]) -> List[List[float]]:
+    """One embed_content round trip for all texts, results in input order."""
+    client = get_client()
+
+    result = await client.aio.models.embed_content(
+        model=EMBEDDING_MODEL,
+        contents=texts,
+        config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
     )
 
-    emb = result.embeddings[0].values
-    if not emb:
+    embeddings = [e.values for e in (result.embeddings or [])]
+    if len(embeddings) != len(texts):
+        raise RuntimeError(f"Embedding returned {len(embeddings)} vectors for {len(texts)} inputs")
+    if not all(embeddings):
         raise RuntimeError("Embedding returned empty vector")
 
-    return emb
\ No newline at end of file
+    return embeddings
+
+
+class _EmbeddingBatcher:
+    def __init__(self, window_ms: float, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending: list[tuple[str, str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.texts = 0
+
+    async def submit(self, key: str, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((key, text, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, str, asyncio.Future]]):
+        # identical content in the same window is looked up / embedded once
+        unique = {key: text for key, text, _ in batch}
+
+        try:
+            by_key = await embedding_cache.load(list(unique))
+            missing = [key for key in unique if key not in by_key]
+            fresh = {}
+            if missing:
+                async with embed_limiter.slot():
+                    vectors = await asyncio.wait_for(
+                        embed_many([unique[key] for key in missing]), EMBED_CALL_TIMEOUT
+                    )
+                fresh = dict(zip(missing, vectors))
+                self.batches += 1
+                self.texts += len(missing)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_key.update(fresh)
+        for key, _, future in batch:
+            if not future.done():
+                future.set_result(by_key[key])
+
+        await embedding_cache.store(fresh, EMBEDDING_MODEL, EMBEDDING_DIM)
+
+
+_batcher = _EmbeddingBatcher(EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_SIZE)
+
+
+async def embed_text(text: str) -> List[float]:
+    key = embedding_cache.cache_key(text, EMBEDDING_MODEL, EMBEDDING_DIM)
+
+    cached = embedding_cache.get_memory(key)
+    if cached is not None:
+        return cached
+
+    return await _batcher.submit(key, text)
+
+
+def embedding_stats() -> dict:
+    return {
+        "model": EMBEDDING_MODEL,
+        "dimension": EMBEDDING_DIM,
+        "batches": _batcher.batches,
+        "texts_embedded": _batcher.texts,
+        "avg_batch_size": round(_batcher.texts / _batcher.batches, 2) if _batcher.batches else 0.0,
+        "cache": embedding_cache.cache_stats(),
+        "limiter": embed_limiter.stats(),
+    }
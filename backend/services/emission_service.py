@@ -1,32 +1,46 @@
 # services/emissions_service.py
 
 from typing import Dict, Any
-from database import get_conn
+from database import acquire
 from services.prompt_builder import build_prompt3A
-from services.llm_service import ask_model
+from services.llm_service import ask_model, LLM_MODEL, LLM_STRUCTURED_OUTPUT
+from services import write_behind, llm_cache, session_cache
+from services.bulk_writes import upsert_emissions_snapshot
+from services.single_flight import SingleFlight
+from schemas import EmissionsResponse
+
+# concurrent identical requests (double clicks, page reloads) share one run
+_in_flight = SingleFlight("emissions")
 
 
 async def generate_emissions(data: Dict[str, Any]) -> Dict[str, Any]:
+    key = (str(data["session_id"]), data["category"], data.get("correction_note", None))
+    return await _in_flight.do(key, lambda: _generate_emissions(data))
+
+
+async def _generate_emissions(data: Dict[str, Any]) -> Dict[str, Any]:
     session_id = data["session_id"]
     category = data["category"]
     correction_note = data.get("correction_note", None)
 
-    db = await get_conn()
+    # entity_emission updates of an earlier calculation may still be queued
+    await write_behind.wait_for_session(session_id)
 
-    # 1. Fetch summary + company profile
-    session_row = await db.fetchrow("SELECT summary_text, company_profile FROM sessions WHERE session_id = $1", session_id)
-    if not session_row:
+    # 1. Summary + company profile
+    state = await session_cache.get(session_id)
+    if not state:
         raise ValueError("Invalid session_id")
 
-    summary = session_row["summary_text"] or ""
-    company_profile = session_row["company_profile"]
+    async with acquire() as db:
+        # 2. Fetch structured fields
+        field_rows = await db.fetch("""
+            SELECT id, entity_id, field_name, field_value_text, field_value_float
+            FROM structured_fields
+            WHERE session_id = $1 AND category = $2
+        """, session_id, category)
 
-    # 2. Fetch structured fields
-    field_rows = await db.fetch("""
-        SELECT id, entity_id, field_name, field_value_text, field_value_float
-        FROM structured_fields
-        WHERE session_id = $1 AND category = $2
-    """, session_id, category)
+    summary = state.summary
+    company_profile = state.company_profile
 
     structured_fields = [
         {
@@ -39,51 +53,38 @@ async def generate_emissions(data: Dict[str, Any]) -> Dict[str, Any]:
         for r in field_rows
     ]
 
-    # 3. Build prompt
-    prompt = build_prompt3A({
+    prompt_inputs = {
         "summary": summary,
         "category": category,
         "structured_fields": structured_fields,
         "correction_note": correction_note,
         "company_profile": company_profile
-    })
+    }
 
-    # 4. Ask LLM
-    llm_output = await ask_model(prompt)
+    # 3. Cached answer for identical inputs, else build prompt and ask LLM
+    cache_key = llm_cache.cache_key("prompt3A", prompt_inputs, LLM_MODEL, LLM_STRUCTURED_OUTPUT)
+    llm_output = await llm_cache.get(cache_key)
+
+    if llm_output is None:
+        prompt = build_prompt3A(prompt_inputs, structured=LLM_STRUCTURED_OUTPUT)
+        llm_output = await ask_model(prompt, EmissionsResponse, priority="calculation", session_id=session_id)
+        await llm_cache.put(cache_key, llm_output, session_id, category, "prompt3A", LLM_MODEL)
 
     scope = llm_output.get("scope", "").strip()
     raw_emissions = llm_output.get("raw_emissions", None)
     raw_steps = llm_output.get("raw_calculation_steps", "")
     entity_emissions = llm_output.get("entity_emissions", [])
 
-    # 5. Insert or update emissions snapshot
-    existing = await db.fetchrow("""
-        SELECT id FROM emissions_snapshots
-        WHERE session_id = $1 AND category = $2
-    """, session_id, category)
-
-    if existing:
-        await db.execute("""
-            UPDATE emissions_snapshots
-            SET scope = $1, raw_emissions = $2, steps = $3
-            WHERE id = $4
-        """, scope, raw_emissions, raw_steps, existing["id"])
-    else:
-        await db.execute("""
-            INSERT INTO emissions_snapshots (session_id, category, scope, raw_emissions, steps)
-            VALUES ($1, $2, $3, $4, $5)
-        """, session_id, category, scope, raw_emissions, raw_steps)
-
-    # 6. Update entity_emission for each structured field
+    # 5. Insert or update emissions snapshot (single upsert on (session_id, category))
+    async with acquire() as db:
+        await upsert_emissions_snapshot(db, session_id, category, scope, raw_emissions, raw_steps)
+
+    # 6. Update entity_emission for each structured field (write-behind)
     for row in entity_emissions:
         eid = row["entity_id"]
         emission_val = row["emission_tonnes"]
 
-        await db.execute("""
-            UPDATE structured_fields
-            SET entity_emission = $1
-            WHERE session_id = $2 AND category = $3 AND entity_id = $4
-        """, emission_val, session_id, category, eid)
+        write_behind.enqueue(session_id, "entity_emission", (emission_val, session_id, category, eid))
 
     return {
         "scope": scope,
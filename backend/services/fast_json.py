@@ -0,0 +1,17 @@
+# services/fast_json.py
+import orjson
+
+# One JSON serializer for the Postgres json/jsonb codecs (database.py), the
+# chat SSE events and prompt fragments. orjson writes compact
+# UTF-8 directly (no ASCII escaping) and handles datetimes, UUIDs and NumPy
+# values itself; anything else falls back to str().
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(value, sort_keys: bool = False) -> str:
+    option = _OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _OPTIONS
+    return orjson.dumps(value, default=str, option=option).decode("utf-8")
+
+
+loads = orjson.loads
@@ -0,0 +1,39 @@
+# services/genai_client.py
+from google import genai
+import os
+
+# One client per process. The SDK keeps its HTTP clients (and their
+# connection pools) on the client object, so reusing it keeps TLS
+# connections to Gemini warm instead of opening new ones per call.
+_client: genai.Client | None = None
+
+
+def get_client() -> genai.Client:
+    global _client
+
+    if _client is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        _client = genai.Client(api_key=api_key)
+
+    return _client
+
+
+async def close_client():
+    global _client
+
+    if _client is None:
+        return
+
+    try:
+        aclose = getattr(_client.aio, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        close = getattr(_client, "close", None)
+        if close is not None:
+            close()
+    except Exception as e:
+        print("⚠️ Error while closing Gemini client:", e)
+    finally:
+        _client = None
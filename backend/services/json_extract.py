@@ -0,0 +1,138 @@
+# services/json_extract.py
+import json
+import re
+from typing import List, Tuple
+
+# Delimiters requested by build_prompt2 (and honoured for any prompt)
+JSON_START = "<<<JSON_START>>>"
+JSON_END = "<<<JSON_END>>>"
+
+# Only these characters change scanner state; everything else is skipped by the regex engine
+_SIGNIFICANT = re.compile(r'[{}"\\]')
+
+
+def _object_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Single pass over text returning (start, end) spans of the outermost
+    balanced {...} regions. String contents (including escaped quotes
+    and braces inside strings) are skipped. An unmatched '{' in prose
+    does not hide objects that follow it: every matched pair is recorded
+    and spans nested in a later, wider pair are dropped, so the result is
+    the set of maximal, non-overlapping objects.
+    """
+    spans: List[Tuple[int, int]] = []
+    stack: List[int] = []
+    in_string = False
+    escaped_at = -1
+
+    for m in _SIGNIFICANT.finditer(text):
+        i = m.start()
+        ch = text[i]
+
+        if in_string:
+            if i == escaped_at:
+                continue
+            if ch == "\\":
+                escaped_at = i + 1
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            # quotes only matter inside a candidate object
+            in_string = bool(stack)
+        elif ch == "{":
+            stack.append(i)
+        elif ch == "}" and stack:
+            start = stack.pop()
+            while spans and spans[-1][0] > start:
+                spans.pop()
+            spans.append((start, i + 1))
+
+    return spans
+
+
+def _largest_object(text: str) -> str | None:
+    # spans never overlap, so parsing all of them costs O(len(text)) in total
+    spans = sorted(_object_spans(text), key=lambda s: s[1] - s[0], reverse=True)
+    for start, end in spans:
+        candidate = text[start:end]
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            continue
+    return None
+
+
+def extract_json_block(text: str) -> str | None:
+    """
+    Find the largest parseable JSON object in an LLM reply in linear time.
+    Text between <<<JSON_START>>> and <<<JSON_END>>> is preferred when present.
+    """
+    start = text.find(JSON_START)
+    if start != -1:
+        body_start = start + len(JSON_START)
+        end = text.find(JSON_END, body_start)
+        block = _largest_object(text[body_start:end if end != -1 else len(text)])
+        if block:
+            return block
+
+    return _largest_object(text)
+
+
+class StreamingStringField:
+    """
+    Incrementally decode one top-level string value (e.g. "next_question")
+    out of a JSON object that is still being streamed. feed() returns the
+    newly available text; escapes split across chunks are held back until
+    complete.
+    """
+
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = -1  # index of the first undecoded char of the value
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        if self.done:
+            return ""
+
+        self._buffer += chunk
+        if self._pos < 0:
+            m = self._key.search(self._buffer)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        buf = self._buffer
+        i = self._pos
+        end = len(buf)
+        while i < end:
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != "\\":
+                i += 1
+                continue
+            # escape sequence: make sure all of it has arrived
+            if i + 1 >= end:
+                break
+            if buf[i + 1] != "u":
+                i += 2
+                continue
+            if i + 6 > end:
+                break
+            # keep surrogate pairs together
+            if 0xD800 <= int(buf[i + 2:i + 6], 16) <= 0xDBFF:
+                if i + 12 > end:
+                    break
+                i += 12
+            else:
+                i += 6
+
+        raw = buf[self._pos:i]
+        self._pos = i
+        return json.loads(f'"{raw}"', strict=False) if raw else ""
@@ -0,0 +1,151 @@
+# services/llm_cache.py
+from collections import OrderedDict
+from database import acquire
+from services import write_behind, fast_json
+from services.prompt_builder import PROMPT_VERSIONS
+from typing import Any, Dict, Tuple
+import hashlib
+import os
+import time
+
+# Responses of the calculation prompts (3A / 3B), keyed by
+# sha256(builder and its template version, model, structured flag, canonical
+# JSON of the prompt inputs).
+# Different inputs give a different key, so a stale answer is never served;
+# invalidate() also drops a session/category's entries as soon as its
+# structured_fields or summary change, instead of leaving them to age out.
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# Postgres tier (llm_response_cache table, migrations/0003), shared by all workers
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "0") == "1"
+
+# bump when the key or entry format changes; template changes bump
+# PROMPT_VERSIONS in services/prompt_builder.py instead
+CACHE_VERSION = "2"
+
+# key -> (expires_at monotonic, response, (session_id, category))
+_memory: "OrderedDict[str, Tuple[float, Dict[str, Any], tuple]]" = OrderedDict()
+_by_scope: Dict[tuple, set] = {}
+
+_memory_hits = 0
+_db_hits = 0
+_misses = 0
+_invalidated = 0
+
+
+def cache_key(builder: str, inputs: Dict[str, Any], model: str, structured: bool = False) -> str:
+    canonical = fast_json.dumps(inputs, sort_keys=True)
+    raw = f"{CACHE_VERSION}\x1f{builder}\x1f{PROMPT_VERSIONS.get(builder, '')}\x1f{model}\x1f{int(structured)}\x1f{canonical}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _drop(key: str):
+    _, _, scope = _memory.pop(key)
+    keys = _by_scope.get(scope)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _by_scope[scope]
+
+
+def _put_memory(key: str, response: Dict[str, Any], scope: tuple, ttl: float):
+    if key in _memory:
+        _drop(key)
+    _memory[key] = (time.monotonic() + ttl, response, scope)
+    _by_scope.setdefault(scope, set()).add(key)
+    while len(_memory) > LLM_CACHE_SIZE:
+        _drop(next(iter(_memory)))
+
+
+async def get(key: str) -> Dict[str, Any] | None:
+    global _memory_hits, _db_hits, _misses
+
+    if not LLM_CACHE:
+        return None
+
+    entry = _memory.get(key)
+    if entry is not None:
+        if entry[0] > time.monotonic():
+            _memory.move_to_end(key)
+            _memory_hits += 1
+            return entry[1]
+        _drop(key)
+
+    if LLM_CACHE_PERSIST:
+        try:
+            async with acquire() as connection:
+                row = await connection.fetchrow("""
+                    SELECT response, session_id, category,
+                           EXTRACT(EPOCH FROM expires_at - now()) AS ttl
+                    FROM llm_response_cache
+                    WHERE cache_key = $1 AND expires_at > now()
+                """, key)
+            if row:
+                response = row["response"]
+                scope = (str(row["session_id"]), row["category"])
+                _put_memory(key, response, scope, float(row["ttl"]))
+                _db_hits += 1
+                return response
+        except Exception as e:
+            print("⚠️ LLM cache lookup failed:", e)
+
+    _misses += 1
+    return None
+
+
+async def put(key: str, response: Dict[str, Any], session_id, category: str, builder: str, model: str):
+    # fallbacks (__llm_error / __llm_raw_text) are not answers worth keeping
+    if not LLM_CACHE or any(k.startswith("__llm_") for k in response):
+        return
+
+    _put_memory(key, response, (str(session_id), category), LLM_CACHE_TTL)
+
+    if not LLM_CACHE_PERSIST:
+        return
+
+    try:
+        async with acquire() as connection:
+            await connection.execute("""
+                INSERT INTO llm_response_cache
+                    (cache_key, session_id, category, builder, model, response, expires_at)
+                VALUES ($1, $2, $3, $4, $5, $6, now() + make_interval(secs => $7))
+                ON CONFLICT (cache_key) DO UPDATE
+                SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+            """, key, session_id, category, builder, model, response, LLM_CACHE_TTL)
+    except Exception as e:
+        print("⚠️ LLM cache write failed:", e)
+
+
+def invalidate(session_id, category: str | None = None):
+    """
+    Drop cached responses for a session's category (or every category when
+    category is None). The Postgres tier is cleared through write-behind, in
+    order with the write that changed the data.
+    """
+    global _invalidated
+
+    session_id = str(session_id)
+    scopes = [s for s in _by_scope if s[0] == session_id and (category is None or s[1] == category)]
+    for scope in scopes:
+        for key in list(_by_scope.get(scope, ())):
+            _drop(key)
+            _invalidated += 1
+
+    if LLM_CACHE and LLM_CACHE_PERSIST:
+        write_behind.enqueue(session_id, "llm_cache_invalidate", (session_id, category))
+
+
+def llm_cache_stats() -> dict:
+    lookups = _memory_hits + _db_hits + _misses
+    return {
+        "enabled": LLM_CACHE,
+        "persistent": LLM_CACHE_PERSIST,
+        "memory_size": len(_memory),
+        "memory_capacity": LLM_CACHE_SIZE,
+        "memory_hits": _memory_hits,
+        "db_hits": _db_hits,
+        "misses": _misses,
+        "invalidated": _invalidated,
+        "hit_ratio": round((_memory_hits + _db_hits) / lookups, 4) if lookups else 0.0,
+    }
@@ -1,78 +1,405 @@
 # llm_service.py
+import asyncio
 import json
-import re
-from google import genai
 import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from google.genai import types
+from pydantic import BaseModel, ValidationError
+from services.genai_client import get_client
+from services.json_extract import extract_json_block
+from services.rate_limiter import WeightedFairLimiter, RetryBudget, RateLimitedError, is_throttle
+from services.deadlines import DeadlineExceeded, remaining
+from services.prompt_builder import Prompt
+from services import context_cache
 
-def _extract_json_block(text: str) -> str | None:
-    """Find largest JSON object substring in text (naive but effective)."""
-    # find first '{' and last '}' and try parsing; iterate to find a valid parse
-    start_idxs = [m.start() for m in re.finditer(r'\{', text)]
-    end_idxs = [m.start() for m in re.finditer(r'\}', text)]
-    if not start_idxs or not end_idxs:
-        return None
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
 
-    # Try pairs (start from earliest start, latest end) to find parseable JSON
-    for s in start_idxs:
-        for e in reversed(end_idxs):
-            if e <= s:
-                continue
-            candidate = text[s:e+1]
-            try:
-                json.loads(candidate)
-                return candidate
-            except Exception:
-                continue
-    return None
+# Admission control for Gemini generate calls (services/rate_limiter.py).
+# LLM_RATE_LIMIT_RPM is this worker's share of the project quota (0 = no bucket);
+# concurrency adapts between LLM_MIN_CONCURRENCY and LLM_MAX_CONCURRENCY.
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "30"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "256"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Waiting calls are admitted by priority class, weighted, with sessions taking
+# turns inside a class: interactive chat > summary > calculation (3A / 3B).
+# Non-chat classes may hold at most LLM_BACKGROUND_SHARE of the slots.
+LLM_PRIORITY_WEIGHTS = {
+    cls: float(weight)
+    for cls, weight in (
+        item.split(":") for item in os.getenv("LLM_PRIORITY_WEIGHTS", "chat:8,summary:3,calculation:1").split(",")
+    )
+}
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.75"))
+
+llm_limiter = WeightedFairLimiter(
+    "llm",
+    weights=LLM_PRIORITY_WEIGHTS,
+    default_class="chat",
+    caps={cls: LLM_BACKGROUND_SHARE for cls in LLM_PRIORITY_WEIGHTS if cls != "chat"},
+    rate_per_minute=LLM_RATE_LIMIT_RPM,
+    burst=LLM_RATE_LIMIT_BURST,
+    min_concurrency=LLM_MIN_CONCURRENCY,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    latency_target=LLM_LATENCY_TARGET,
+    max_queue=LLM_QUEUE_MAX,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+)
+
+# Timeouts: one attempt may take LLM_ATTEMPT_TIMEOUT; the whole call (queueing,
+# retries, hedges) ends at the caller's deadline (services/deadlines.py) or
+# after LLM_REQUEST_TIMEOUT when there is none.
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "45"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+
+# Retries of transient failures (timeouts, 429, 5xx, connection errors) with
+# full-jitter exponential backoff, within a retry budget shared by the worker
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_RETRY_MAX_BACKOFF = float(os.getenv("LLM_RETRY_MAX_BACKOFF", "8"))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+LLM_RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("LLM_RETRY_BUDGET_MIN_PER_SEC", "0.5"))
+
+# Hedging (callers opt in with hedge=True): if the first attempt has not
+# answered after the p95 latency of its priority class, a second one is sent
+# and the first answer wins. Paid from the retry budget.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+_retry_budget = RetryBudget(LLM_RETRY_BUDGET_RATIO, LLM_RETRY_BUDGET_MIN_PER_SEC)
+# recent successful attempt durations per priority class
+_latencies: dict = {}
+
+_retries = 0
+_hedges = 0
+_hedge_wins = 0
+_deadline_exceeded = 0
+# usage_metadata totals: how much of the prompt Gemini served from cache
+_prompt_tokens = 0
+_cached_tokens = 0
+
+# Structured-output mode: the caller's pydantic model is sent as the response
+# schema (JSON MIME type) and prompt builders drop their prose output format.
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "0") == "1"
+
+def llm_stats() -> dict:
+    return {
+        "model": LLM_MODEL,
+        "structured_output": LLM_STRUCTURED_OUTPUT,
+        "limiter": llm_limiter.stats(),
+        "retry_budget": _retry_budget.stats(),
+        "retries": _retries,
+        "hedges": _hedges,
+        "hedge_wins": _hedge_wins,
+        "deadline_exceeded": _deadline_exceeded,
+        "p95_ms": {cls: round(_p95(cls) * 1000, 1) for cls in _latencies if _p95(cls) is not None},
+        "prompt_tokens": _prompt_tokens,
+        "cached_tokens": _cached_tokens,
+        "context_cache": context_cache.context_cache_stats(),
+    }
+
+def _structured(response_schema: type[BaseModel] | None) -> bool:
+    return LLM_STRUCTURED_OUTPUT and response_schema is not None
 
-async def ask_model(prompt: str) -> dict:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables")
+def _generation_config(response_schema: type[BaseModel] | None, cached_content: str | None = None):
+    config = {}
+    if _structured(response_schema):
+        config["response_mime_type"] = "application/json"
+        config["response_json_schema"] = response_schema.model_json_schema()
+    if cached_content:
+        config["cached_content"] = cached_content
+    return types.GenerateContentConfig(**config) if config else None
 
+async def _contents(prompt: str | Prompt) -> tuple:
+    """
+    (contents, cached_content) for a call. A Prompt whose static prefix is in
+    a Gemini context cache sends only its dynamic part; anything else is sent
+    whole.
+    """
+    if not isinstance(prompt, Prompt):
+        return prompt, None
+    cached = await context_cache.cached_content_for(LLM_MODEL, prompt)
+    return (prompt.dynamic, cached) if cached else (prompt.text, None)
+
+def _record_usage(response):
+    global _prompt_tokens, _cached_tokens
+
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    _prompt_tokens += getattr(usage, "prompt_token_count", None) or 0
+    _cached_tokens += getattr(usage, "cached_content_token_count", None) or 0
+
+def _fallback(**extra) -> dict:
+    return {
+        **extra,
+        "next_question": "",
+        "category_complete": False,
+        "next_category": None,
+        "analysis_complete": False,
+        "updated_missing_field": [],
+        "extracted_fields": []
+    }
+
+def parse_model_text(raw: str, response_schema: type[BaseModel] | None = None) -> dict:
+    """Turn the raw model text into a dict (shared by ask_model and stream_model callers)."""
+    # 0) structured mode: validate straight into the schema
+    if _structured(response_schema):
+        try:
+            return response_schema.model_validate_json(raw).model_dump()
+        except ValidationError as e:
+            print("⚠️ Structured output failed validation, falling back to text parse:", e)
+
+    # 1) try full-parse
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model = "gemini-2.5-flash",
-            contents = prompt
-        )
+        return json.loads(raw)
+    except Exception:
+        pass
 
-        raw = getattr(response, "text", None) or str(response)
-        # 1) try full-parse
+    # 2) try extracting JSON block
+    block = extract_json_block(raw)
+    if block:
         try:
-            return json.loads(raw)
+            return json.loads(block)
         except Exception:
             pass
 
-        # 2) try extracting JSON block
-        block = _extract_json_block(raw)
-        if block:
-            try:
-                return json.loads(block)
-            except Exception:
-                pass
-
-        # 3) fallback: return helpful debug dict (do NOT return empty dict)
-        print("❌ LLM did not return valid JSON. Raw response:", raw)
-        return {
-            "__llm_raw_text": raw,
-            "next_question": "",
-            "category_complete": False,
-            "next_category": None,
-            "analysis_complete": False,
-            "updated_missing_field": [],
-            "extracted_fields": []
-        }
+    # 3) fallback: return helpful debug dict (do NOT return empty dict)
+    print("❌ LLM did not return valid JSON. Raw response:", raw)
+    return _fallback(__llm_raw_text=raw)
+
+def _record_latency(priority: str, seconds: float):
+    _latencies.setdefault(priority, deque(maxlen=200)).append(seconds)
+
+def _p95(priority: str) -> float | None:
+    samples = _latencies.get(priority)
+    if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+def _retryable(e: BaseException) -> bool:
+    if is_throttle(e) or isinstance(e, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    # transport errors of the SDK's HTTP client (status errors arrive as genai APIError)
+    if type(e).__module__.split(".")[0] in ("httpx", "httpcore", "aiohttp"):
+        return True
+    code = getattr(e, "code", None)
+    return isinstance(code, int) and (code >= 500 or code == 408)
+
+def _past_deadline(message: str) -> DeadlineExceeded:
+    global _deadline_exceeded
 
+    _deadline_exceeded += 1
+    return DeadlineExceeded(message)
+
+@asynccontextmanager
+async def _slot(deadline: float, **meta):
+    """
+    A limiter slot, waited for until the deadline at most. A deadline that is
+    already spent, or that runs out in the queue, is DeadlineExceeded (504),
+    not RateLimitedError (503): capacity was not the problem.
+    """
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise _past_deadline("LLM call deadline spent before it was admitted")
+    admitted = False
+    try:
+        async with llm_limiter.slot(timeout=left, **meta):
+            admitted = True
+            yield
+    except RateLimitedError as e:
+        if not admitted and time.monotonic() >= deadline:
+            raise _past_deadline("LLM call deadline ran out waiting for capacity") from e
+        raise
+
+async def _attempt(client, request: tuple, response_schema, deadline: float, **meta):
+    """One generate call: limiter slot, then the request, both bounded by the deadline."""
+    # async surface of the SDK: the event loop keeps serving other
+    # requests while this one waits on Gemini
+    async with _slot(deadline, **meta):
+        started = time.monotonic()
+        timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - started)
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        contents, cached_content = request
+        response = await asyncio.wait_for(client.aio.models.generate_content(
+            model = LLM_MODEL,
+            contents = contents,
+            config = _generation_config(response_schema, cached_content)
+        ), timeout)
+        _record_latency(meta.get("priority", "chat"), time.monotonic() - started)
+        _record_usage(response)
+        return response
+
+async def _hedged(client, request: tuple, response_schema, deadline: float, **meta):
+    global _hedges, _hedge_wins
+
+    first = asyncio.ensure_future(_attempt(client, request, response_schema, deadline, **meta))
+    tasks = {first}
+    try:
+        delay = _p95(meta.get("priority", "chat"))
+        if delay is None or delay >= deadline - time.monotonic():
+            return await first
+
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not llm_limiter.has_capacity(**meta) or not _retry_budget.withdraw():
+            return await first
+
+        _hedges += 1
+        second = asyncio.ensure_future(_attempt(client, request, response_schema, deadline, **meta))
+        tasks.add(second)
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        _hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+def _call_deadline() -> float:
+    """Absolute end of a call: the request deadline, capped by LLM_REQUEST_TIMEOUT."""
+    left = remaining()
+    return time.monotonic() + (LLM_REQUEST_TIMEOUT if left is None else min(left, LLM_REQUEST_TIMEOUT))
+
+async def _generate(client, prompt: str | Prompt, response_schema: type[BaseModel] | None, hedge: bool = False, **meta):
+    """
+    Generate with deadline, retries and optional hedging. Transient failures
+    are retried after a full-jitter backoff while attempts, the retry budget
+    and the deadline allow; RateLimitedError (no capacity before the
+    deadline) is not retried.
+    """
+    global _retries
+
+    deadline = _call_deadline()
+    _retry_budget.deposit()
+    attempt = 0
+    request = await _contents(prompt)
+
+    while True:
+        try:
+            if hedge and LLM_HEDGE:
+                return await _hedged(client, request, response_schema, deadline, **meta)
+            return await _attempt(client, request, response_schema, deadline, **meta)
+        except (RateLimitedError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            # the context cache expired or was deleted under us: resend the
+            # whole prompt at once, this is not a provider failure
+            if request[1] and context_cache.is_cache_error(e):
+                print(f"⚠️ Context cache {request[1]} rejected, sending full prompt:", e)
+                context_cache.invalidate(request[1])
+                request = (prompt.text, None)
+                continue
+            if time.monotonic() >= deadline:
+                raise _past_deadline(f"LLM call exceeded its deadline ({e!r})") from e
+            pause = random.uniform(0, min(LLM_RETRY_MAX_BACKOFF, LLM_RETRY_BACKOFF * 2 ** attempt))
+            if (not _retryable(e) or attempt >= LLM_MAX_RETRIES
+                    or time.monotonic() + pause >= deadline or not _retry_budget.withdraw()):
+                raise
+            print(f"⚠️ Gemini call failed ({e!r}); retry {attempt + 1} in {pause:.2f}s")
+            attempt += 1
+            _retries += 1
+            await asyncio.sleep(pause)
+
+async def ask_model(
+    prompt: str | Prompt,
+    response_schema: type[BaseModel] | None = None,
+    priority: str = "chat",
+    session_id: str | None = None,
+    hedge: bool = False
+) -> dict:
+    """
+    Returns the parsed model answer, or a fallback dict when the call or the
+    parse fails. RateLimitedError (no capacity before the queue deadline) and
+    DeadlineExceeded are raised instead, so routers can answer 503 / 504
+    rather than an empty question. priority / session_id place the call in
+    the limiter's fair queue; hedge=True allows a hedged second attempt
+    (short interactive prompts, LLM_HEDGE=1).
+    """
+    client = get_client()
+
+    try:
+        response = await _generate(
+            client, prompt, response_schema, hedge=hedge, priority=priority, session_id=session_id
+        )
+
+        raw = getattr(response, "text", None) or str(response)
+        return parse_model_text(raw, response_schema)
+
+    except (RateLimitedError, DeadlineExceeded):
+        raise
     except Exception as e:
         print("Model request failed:", e)
         # raise or return an explicit failure dict
-        return {
-            "__llm_error": str(e),
-            "next_question": "",
-            "category_complete": False,
-            "next_category": None,
-            "analysis_complete": False,
-            "updated_missing_field": [],
-            "extracted_fields": []
-        }
\ No newline at end of file
+        return _fallback(__llm_error=str(e))
+
+async def stream_model(
+    prompt: str | Prompt,
+    response_schema: type[BaseModel] | None = None,
+    priority: str = "chat",
+    session_id: str | None = None
+):
+    """
+    Yield text chunks as Gemini generates them. Errors propagate to the
+    caller; join the chunks and pass them to parse_model_text at the end.
+    Opening the stream and every wait for the next chunk end at the request
+    deadline (LLM_REQUEST_TIMEOUT without one): a stalled stream raises
+    DeadlineExceeded and gives its limiter slot back.
+    """
+    client = get_client()
+    deadline = _call_deadline()
+
+    async def _open(contents, config):
+        timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(client.aio.models.generate_content_stream(
+            model = LLM_MODEL,
+            contents = contents,
+            config = config
+        ), timeout)
+
+    # a whole stream's duration says little about provider load: only
+    # throttling feeds back into the limit
+    contents, cached_content = await _contents(prompt)
+    async with _slot(deadline, measure_latency=False, priority=priority, session_id=session_id):
+        try:
+            try:
+                stream = await _open(contents, _generation_config(response_schema, cached_content))
+            except Exception as e:
+                if not (cached_content and context_cache.is_cache_error(e)):
+                    raise
+                print(f"⚠️ Context cache {cached_content} rejected, sending full prompt:", e)
+                context_cache.invalidate(cached_content)
+                stream = await _open(prompt.text, _generation_config(response_schema))
+
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                text = getattr(chunk, "text", None)
+                if text:
+                    yield text
+        except asyncio.TimeoutError as e:
+            if time.monotonic() < deadline:
+                raise
+            raise _past_deadline("LLM stream exceeded its deadline") from e
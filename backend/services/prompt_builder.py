@@ -1,16 +1,135 @@
 #File for building prompts, no storing in db, no llm calls, just buidling
-import json
+from dataclasses import dataclass
+from functools import lru_cache
+from services import fast_json
+
+# Every builder returns a Prompt: the static instructions first (identical for
+# every call of that builder, version and output mode), then the per-call
+# context. llm_service can register the static part once as Gemini cached
+# content and send only the dynamic part; Prompt.text is the plain
+# concatenation used otherwise. Bump a version when its template changes.
+PROMPT_VERSIONS = {
+    "prompt1": "4",
+    "prompt2": "3",
+    "prompt3A": "3",
+    "prompt3B": "3",
+}
+
+
+def _json_text(value) -> str:
+    # fragments already serialized upstream are embedded as they are
+    return value if isinstance(value, str) else fast_json.dumps(value)
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    version: str
+    static: str
+    dynamic: str
+
+    @property
+    def text(self) -> str:
+        return f"{self.static}\n\n{self.dynamic}"
+
+    def __str__(self) -> str:
+        return self.text
+
+# Output format sections. In structured-output mode (llm_service.LLM_STRUCTURED_OUTPUT)
+# the pydantic schema is sent to Gemini as response schema, so the prose
+# description of the JSON is replaced by SCHEMA_OUTPUT_FORMAT.
+SCHEMA_OUTPUT_FORMAT = """    <output_format>
+        Respond with a single JSON object matching the response schema supplied with this request.
+    </output_format>"""
+
+PROMPT1_OUTPUT_FORMAT = """    <output_format_strict>
+        MUST output ONLY valid JSON (no extra text). Use JSON booleans and null.
+        Follow this exact schema (example types shown):
+
+        ```json
+        {
+          "next_question": "string (max 30 words)",
+          "category_complete": true or false,
+          "next_category": null or "string",
+          "analysis_complete": true or false,
+          "updated_missing_field": [],
+          "extracted_fields": [
+            {
+              "entity_id": "string",
+              "field_name": "string",
+              "field_type": "text" or "numeric",
+              "field_value_text": "string or null",
+              "field_value_float": null or float
+            }
+          ]
+        }
+        ```"""
+
+PROMPT2_OUTPUT_FORMAT = """    <output_requirements>
+        STRICT RULES:
+        1. Output ONLY valid JSON.
+        2. JSON schema:
+           {
+             "updated_summary": "string"
+           }
+        3. "updated_summary" must:
+           - contain ALL information from previous_summary,
+           - include new info from recent_qa,
+           - but expressed in a more compact, simplified form.
+    </output_requirements>
+
+    <output_delimiters>
+        When you respond, place the JSON object **between these exact markers**:
+        <<<JSON_START>>>
+        { ... }
+        <<<JSON_END>>>
+        No extra text is permitted outside or between these markers.
+    </output_delimiters>"""
+
+PROMPT2_SCHEMA_OUTPUT_FORMAT = """    <output_requirements>
+        "updated_summary" must:
+           - contain ALL information from previous_summary,
+           - include new info from recent_qa,
+           - but expressed in a more compact, simplified form.
+    </output_requirements>"""
 
-def build_prompt1(data: dict) -> str:
-    import json
+PROMPT3A_OUTPUT_FORMAT = """    <required_output_format>
+        {
+            "scope": "Scope 1 or Scope 2 or Scope 3",
+            "raw_emissions": float or null,
+            "raw_calculation_steps": "string",
+            "entity_emissions": [
+                {
+                    "entity_id": "string",
+                    "emission_tonnes": float or null
+                }
+            ]
+        }
+    </required_output_format>
+
+    <final_instruction>
+        Respond ONLY with the JSON object above.
+    </final_instruction>"""
+
+PROMPT3B_OUTPUT_FORMAT = """    <output_format>
+        STRICT JSON ONLY. MATCH THIS EXACT SCHEMA:
+
+        {
+            "calculation_valid": true or false,
+            "correction_note": "string",
+            "confidence_model": float,
+            "missing_fields": []
+        }
+    </output_format>
+
+    <final_instruction>
+        Respond ONLY with the JSON object.
+        Do NOT include XML, explanations, or extra text.
+    </final_instruction>"""
 
-    company_profile = json.dumps(data["company_profile"])
-    summary = json.dumps(data.get("summary", ""))
-    relevant_qa = json.dumps(data.get("relevant_qa", []))
-    missing_fields = json.dumps(data.get("missing_fields", []))
-    current_category = json.dumps(data.get("current_category", None))
-    qa_in_category = json.dumps(data.get("qa_in_category", []))
-    last_qa = json.dumps(data.get("last_qa", []))
+@lru_cache(maxsize=None)
+def _prompt1_static(structured: bool) -> str:
+    output_format = SCHEMA_OUTPUT_FORMAT if structured else PROMPT1_OUTPUT_FORMAT
 
     return f"""
 <eco_agent_instruction>
@@ -84,6 +203,11 @@ def build_prompt1(data: dict) -> str:
         - analysis_complete = true ONLY IF all categories are completed (find out using summary).
     </analysis_completion_rules>
 
+    <category_transcript_rules>
+        - category_digest condenses the earlier Q/A of the CURRENT category; qa_in_category
+          holds the turns after it. Read both together as the category transcript.
+    </category_transcript_rules>
+
     <next_category_rules>
         - Return next_category ONLY IF current category is complete or empty AND analysis is NOT complete.
         - Otherwise next_category = null.
@@ -95,46 +219,41 @@ def build_prompt1(data: dict) -> str:
           remove it from updated_missing_field. Otherwise return the same list or an empty list.
     </missing_fields_rules>
 
-    <input_context>
-        {{
-            "company_profile": {company_profile},
-            "summary": {summary},
-            "current_category": {current_category},
-            "relevant_qa": {relevant_qa},
-            "qa_in_category": {qa_in_category},
-            "last_qa": {last_qa},
-            "missing_fields": {missing_fields}
-        }}
-    </input_context>
-
-    <output_format_strict>
-        MUST output ONLY valid JSON (no extra text). Use JSON booleans and null.
-        Follow this exact schema (example types shown):
-
-        ```json
-        {{
-          "next_question": "string (max 30 words)",
-          "category_complete": true or false,
-          "next_category": null or "string",
-          "analysis_complete": true or false,
-          "updated_missing_field": [],
-          "extracted_fields": [
-            {{
-              "entity_id": "string",
-              "field_name": "string",
-              "field_type": "text" or "numeric",
-              "field_value_text": "string or null",
-              "field_value_float": null or float
-            }}
-          ]
-        }}
-        ```
+{output_format}
 </eco_agent_instruction>
 """.strip()
 
-def build_prompt2(data: dict) -> str:
-    previous_summary = data.get("previous_summary", "")
-    recent_qa = data.get("recent_qa", [])
+def build_prompt1(data: dict, structured: bool = False) -> Prompt:
+    # pre-serialized by the context assembler / session cache when available
+    company_profile = data.get("company_profile_json") or fast_json.dumps(data["company_profile"])
+    summary = fast_json.dumps(data.get("summary", ""))
+    relevant_qa = fast_json.dumps(data.get("relevant_qa", []))
+    missing_fields = fast_json.dumps(data.get("missing_fields", []))
+    current_category = fast_json.dumps(data.get("current_category", None))
+    category_digest = fast_json.dumps(data.get("category_digest", ""))
+    qa_in_category = fast_json.dumps(data.get("qa_in_category", []))
+    last_qa = fast_json.dumps(data.get("last_qa", []))
+
+    dynamic = f"""
+<input_context>
+    {{
+        "company_profile": {company_profile},
+        "summary": {summary},
+        "current_category": {current_category},
+        "category_digest": {category_digest},
+        "relevant_qa": {relevant_qa},
+        "qa_in_category": {qa_in_category},
+        "last_qa": {last_qa},
+        "missing_fields": {missing_fields}
+    }}
+</input_context>
+""".strip()
+
+    return Prompt("prompt1", PROMPT_VERSIONS["prompt1"], _prompt1_static(structured), dynamic)
+
+@lru_cache(maxsize=None)
+def _prompt2_static(structured: bool) -> str:
+    output_format = PROMPT2_SCHEMA_OUTPUT_FORMAT if structured else PROMPT2_OUTPUT_FORMAT
 
     return f"""
 <eco_agent_summary_update>
@@ -158,45 +277,31 @@ def build_prompt2(data: dict) -> str:
         - Avoid speculation.
     </goal>
 
-    <input_data>
-        <previous_summary>
-            {previous_summary}
-        </previous_summary>
-
-        <recent_qa_json>
-            {recent_qa}
-        </recent_qa_json>
-    </input_data>
-
-    <output_requirements>
-        STRICT RULES:
-        1. Output ONLY valid JSON.
-        2. JSON schema:
-           {{
-             "updated_summary": "string"
-           }}
-        3. "updated_summary" must:
-           - contain ALL information from previous_summary,
-           - include new info from recent_qa,
-           - but expressed in a more compact, simplified form.
-    </output_requirements>
-
-    <output_delimiters>
-        When you respond, place the JSON object **between these exact markers**:
-        <<<JSON_START>>>
-        {{ ... }}
-        <<<JSON_END>>>
-        No extra text is permitted outside or between these markers.
-    </output_delimiters>
+{output_format}
 </eco_agent_summary_update>
 """.strip()
 
-def build_prompt3A(data: dict) -> str:
-    summary = data["summary"]
-    category = data["category"]
-    structured_fields = data["structured_fields"]
-    correction_note = data.get("correction_note", "")
-    company_profile = data.get("company_profile")
+def build_prompt2(data: dict, structured: bool = False) -> Prompt:
+    previous_summary = data.get("previous_summary", "")
+    recent_qa = _json_text(data.get("recent_qa", []))
+
+    dynamic = f"""
+<input_data>
+    <previous_summary>
+        {previous_summary}
+    </previous_summary>
+
+    <recent_qa_json>
+        {recent_qa}
+    </recent_qa_json>
+</input_data>
+""".strip()
+
+    return Prompt("prompt2", PROMPT_VERSIONS["prompt2"], _prompt2_static(structured), dynamic)
+
+@lru_cache(maxsize=None)
+def _prompt3A_static(structured: bool) -> str:
+    output_format = SCHEMA_OUTPUT_FORMAT if structured else PROMPT3A_OUTPUT_FORMAT
 
     prompt = f"""
 <eco_agent_calculation_instruction>
@@ -207,14 +312,6 @@ def build_prompt3A(data: dict) -> str:
         You always output strict JSON.
     </persona>
 
-    <input_context>
-        <company_profile>{company_profile}</company_profile>
-        <category>{category}</category>
-        <summary>{summary}</summary>
-        <structured_fields>{structured_fields}</structured_fields>
-        <correction_note>{correction_note}</correction_note>
-    </input_context>
-
     <ghg_protocol_core_rules>
         <!-- 1. Scope Assignment -->
         - Every emission must belong to EXACTLY one of:
@@ -302,34 +399,34 @@ def build_prompt3A(data: dict) -> str:
             "Scope 1", "Scope 2", or "Scope 3"
     </output_rules>
 
-    <required_output_format>
-        {{
-            "scope": "Scope 1 or Scope 2 or Scope 3",
-            "raw_emissions": float or null,
-            "raw_calculation_steps": "string",
-            "entity_emissions": [
-                {{
-                    "entity_id": "string",
-                    "emission_tonnes": float or null
-                }}
-            ]
-        }}
-    </required_output_format>
-
-    <final_instruction>
-        Respond ONLY with the JSON object above.
-    </final_instruction>
+{output_format}
 
 </eco_agent_calculation_instruction>
 """
     return prompt.strip()
 
-def build_prompt3B(data: dict) -> str:
-    raw_emissions = data["raw_emissions"]
-    raw_steps = data["raw_steps"]
-    structured_fields = data["structured_fields"]
-    scope = data.get("scope", "")
-    company_profile = data.get("company_profile", {})
+def build_prompt3A(data: dict, structured: bool = False) -> Prompt:
+    summary = data["summary"]
+    category = data["category"]
+    structured_fields = _json_text(data["structured_fields"])
+    correction_note = data.get("correction_note", "")
+    company_profile = _json_text(data.get("company_profile"))
+
+    dynamic = f"""
+<input_context>
+    <company_profile>{company_profile}</company_profile>
+    <category>{category}</category>
+    <summary>{summary}</summary>
+    <structured_fields>{structured_fields}</structured_fields>
+    <correction_note>{correction_note}</correction_note>
+</input_context>
+""".strip()
+
+    return Prompt("prompt3A", PROMPT_VERSIONS["prompt3A"], _prompt3A_static(structured), dynamic)
+
+@lru_cache(maxsize=None)
+def _prompt3B_static(structured: bool) -> str:
+    output_format = SCHEMA_OUTPUT_FORMAT if structured else PROMPT3B_OUTPUT_FORMAT
 
     prompt = f"""
 <eco_agent_validation_instruction>
@@ -347,14 +444,6 @@ def build_prompt3B(data: dict) -> str:
         You ALWAYS output strict JSON. No commentary.
     </persona>
 
-    <input_data>
-        <company_profile>{company_profile}</company_profile>
-        <scope>{scope}</scope>
-        <raw_emissions>{raw_emissions}</raw_emissions>
-        <raw_calculation_steps>{raw_steps}</raw_calculation_steps>
-        <structured_fields>{structured_fields}</structured_fields>
-    </input_data>
-
     <validation_checks>
 
         <!-- 1. Unit Conversion Check -->
@@ -403,22 +492,27 @@ def build_prompt3B(data: dict) -> str:
         - If everything is valid → correction_note must be "" (empty string).
     </validation_checks>
 
-    <output_format>
-        STRICT JSON ONLY. MATCH THIS EXACT SCHEMA:
-
-        {{
-            "calculation_valid": true or false,
-            "correction_note": "string",
-            "confidence_model": float,
-            "missing_fields": []
-        }}
-    </output_format>
-
-    <final_instruction>
-        Respond ONLY with the JSON object.
-        Do NOT include XML, explanations, or extra text.
-    </final_instruction>
+{output_format}
 
 </eco_agent_validation_instruction>
 """
-    return prompt.strip()
\ No newline at end of file
+    return prompt.strip()
+
+def build_prompt3B(data: dict, structured: bool = False) -> Prompt:
+    raw_emissions = data["raw_emissions"]
+    raw_steps = data["raw_steps"]
+    structured_fields = _json_text(data["structured_fields"])
+    scope = data.get("scope", "")
+    company_profile = _json_text(data.get("company_profile", {}))
+
+    dynamic = f"""
+<input_data>
+    <company_profile>{company_profile}</company_profile>
+    <scope>{scope}</scope>
+    <raw_emissions>{raw_emissions}</raw_emissions>
+    <raw_calculation_steps>{raw_steps}</raw_calculation_steps>
+    <structured_fields>{structured_fields}</structured_fields>
+</input_data>
+""".strip()
+
+    return Prompt("prompt3B", PROMPT_VERSIONS["prompt3B"], _prompt3B_static(structured), dynamic)
\ No newline at end of file
@@ -0,0 +1,413 @@
+# services/rate_limiter.py
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+import asyncio
+import math
+import time
+
+# Client-side admission control for provider calls. Each call needs
+#   - a token from a token bucket (the provider's request quota), and
+#   - a concurrency slot; the limit adapts AIMD-style: +1/limit per call that
+#     finished under the latency target, x0.5 on a 429 / overload (at most
+#     once per typical call duration), x0.9 on a slow call.
+# Callers that cannot start at once wait in a bounded queue until a deadline;
+# a full queue or an expired deadline raises RateLimitedError, which routers
+# turn into 503 + Retry-After instead of an empty answer.
+# Which waiter is admitted next is up to the _enqueue / _pop_waiter hooks:
+# FIFO here, weighted classes with per-session fairness in WeightedFairLimiter.
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(math.ceil(self.retry_after))}
+
+
+def is_throttle(e: BaseException) -> bool:
+    """429 / RESOURCE_EXHAUSTED or 503 overload from the google-genai SDK."""
+    code = getattr(e, "code", None)
+    if code in (429, 503):
+        return True
+    text = str(e)
+    return "RESOURCE_EXHAUSTED" in text or "429" in text.split(" ", 1)[0]
+
+
+class _Waiter:
+    __slots__ = ("future", "meta")
+
+    def __init__(self, future: asyncio.Future, meta: dict):
+        self.future = future
+        self.meta = meta
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        rate_per_minute: float,
+        burst: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        latency_target: float,
+        max_queue: int,
+        queue_timeout: float,
+    ):
+        self.name = name
+        self.rate = rate_per_minute / 60 if rate_per_minute > 0 else 0.0
+        self.burst = max(burst, 1)
+        self.min_concurrency = max(min_concurrency, 1)
+        self.max_concurrency = max(max_concurrency, self.min_concurrency)
+        self.latency_target = latency_target
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.limit = float(self.max_concurrency)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._timer: asyncio.TimerHandle | None = None
+        self._latency = 0.0          # EWMA of call duration (s)
+        self._last_decrease = 0.0
+
+        self.started = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+
+    # ---------- token bucket ----------
+    def _refill(self):
+        if not self.rate:
+            self._tokens = float(self.burst)
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _can_start(self) -> bool:
+        self._refill()
+        return self._in_flight < max(int(self.limit), self.min_concurrency) and self._tokens >= 1
+
+    def _start(self, meta: dict):
+        self._tokens -= 1
+        self._in_flight += 1
+        self.started += 1
+        self._on_start(meta)
+
+    def _finish(self, meta: dict):
+        self._in_flight -= 1
+        self._on_finish(meta)
+
+    # ---------- scheduling hooks ----------
+    def _on_start(self, meta: dict):
+        pass
+
+    def _on_finish(self, meta: dict):
+        pass
+
+    def _admissible(self, meta: dict) -> bool:
+        return True
+
+    def _queue_full(self, meta: dict) -> bool:
+        return self.queue_depth() >= self.max_queue
+
+    # ---------- waiter queue ----------
+    def _enqueue(self, waiter: _Waiter):
+        self._waiters.append(waiter)
+
+    def _pop_waiter(self) -> _Waiter | None:
+        """Next waiter to admit (FIFO); cancelled / timed-out waiters are skipped."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.future.done():
+                return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _dispatch(self):
+        while self.queue_depth() and self._can_start():
+            waiter = self._pop_waiter()
+            if waiter is None:
+                break
+            self._start(waiter.meta)
+            waiter.future.set_result(None)
+
+        # out of tokens with callers waiting: try again when the next one is due
+        if self.queue_depth() and self._tokens < 1 and self.rate and self._timer is None:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self, timeout: float | None = None, **meta):
+        if not self.queue_depth() and self._can_start() and self._admissible(meta):
+            self._start(meta)
+            return
+
+        if self._queue_full(meta):
+            self.rejected += 1
+            raise RateLimitedError(f"{self.name}: wait queue full", self._retry_after())
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), meta)
+        self._enqueue(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout if timeout is not None else self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self.timed_out += 1
+            raise RateLimitedError(f"{self.name}: timed out waiting for capacity", self._retry_after())
+        except asyncio.CancelledError:
+            self._remove(waiter)
+            # admitted just before the caller went away: give the slot back
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._finish(meta)
+                self._dispatch()
+            raise
+
+    def release(self, duration: float | None, throttled: bool = False, **meta):
+        self._finish(meta)
+        now = time.monotonic()
+
+        if throttled:
+            self.throttled += 1
+            self._tokens = min(self._tokens, 0.0)
+            if now - self._last_decrease > max(self._latency, 1.0):
+                self.limit = max(self.min_concurrency, self.limit * 0.5)
+                self._last_decrease = now
+        elif duration is not None:
+            self._latency = duration if not self._latency else 0.8 * self._latency + 0.2 * duration
+            if self.latency_target and duration > self.latency_target:
+                if now - self._last_decrease > max(self._latency, 1.0):
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+        self._dispatch()
+
+    def has_capacity(self, **meta) -> bool:
+        """Whether a call with this meta would be admitted right now, without queueing."""
+        return not self.queue_depth() and self._can_start() and self._admissible(meta)
+
+    def _retry_after(self) -> float:
+        if self.rate:
+            return max(1.0, (self.queue_depth() + 1) / self.rate)
+        return max(1.0, self._latency)
+
+    @asynccontextmanager
+    async def slot(self, timeout: float | None = None, measure_latency: bool = True, **meta):
+        """Hold one admitted call; a throttling exception from the body shrinks the limit."""
+        await self.acquire(timeout, **meta)
+        started = time.monotonic()
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttle(e)
+            raise
+        finally:
+            self.release(time.monotonic() - started if measure_latency and not throttled else None, throttled, **meta)
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "tokens": round(self._tokens, 2),
+            "rate_per_minute": round(self.rate * 60, 2),
+            "latency_ewma_ms": round(self._latency * 1000, 1),
+            "started": self.started,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class RetryBudget:
+    """
+    Caps extra load from retries and hedges: every call deposits `ratio`
+    tokens, every retry / hedge spends one, plus a floor of `min_per_second`
+    so a quiet worker can still retry. During an outage the budget runs dry
+    and calls fail fast instead of multiplying the load on the provider.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, cap: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self._balance = cap
+        self._updated_at = time.monotonic()
+
+        self.spent = 0
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.cap, self._balance + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def deposit(self):
+        self._refill()
+        self._balance = min(self.cap, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self._balance < 1:
+            self.exhausted += 1
+            return False
+        self._balance -= 1
+        self.spent += 1
+        return True
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "balance": round(self._balance, 2),
+            "spent": self.spent,
+            "exhausted": self.exhausted,
+        }
+
+
+class _Class:
+    __slots__ = ("weight", "cap", "pass_", "sessions", "depth", "in_flight", "admitted")
+
+    def __init__(self, weight: float, cap: float | None):
+        self.weight = weight
+        self.cap = cap
+        self.pass_ = 0.0
+        self.sessions: "OrderedDict[str | None, Deque[_Waiter]]" = OrderedDict()
+        self.depth = 0
+        self.in_flight = 0
+        self.admitted = 0
+
+
+class WeightedFairLimiter(AdaptiveLimiter):
+    """
+    Waiters are grouped by priority class (meta "priority") and, inside a
+    class, by session (meta "session_id"):
+      - classes are picked by stride scheduling: each admission advances the
+        class's pass by 1/weight and the lowest pass goes next, so with weights
+        8:3:1 a backlog of calculations still gets 1 in 12 slots
+      - a class that was idle starts at the current virtual time, it cannot
+        save up credit while it has nothing queued
+      - sessions inside a class take turns (round robin), so one session's
+        batch does not hold up another session's calls
+      - a class with a cap may hold at most cap * limit slots at once, which
+        keeps room for the uncapped interactive class
+    """
+
+    def __init__(self, name: str, weights: Dict[str, float], default_class: str,
+                 caps: Dict[str, float] | None = None, **limits):
+        super().__init__(name, **limits)
+        caps = caps or {}
+        self._classes = {
+            cls: _Class(max(weight, 0.001), caps.get(cls))
+            for cls, weight in weights.items()
+        }
+        self._default_class = default_class
+        self._depth = 0
+        self._vtime = 0.0
+
+    def _class(self, meta: dict) -> _Class:
+        return self._classes.get(meta.get("priority"), self._classes[self._default_class])
+
+    def _under_cap(self, cls: _Class) -> bool:
+        return cls.cap is None or cls.in_flight < max(1, int(self.limit * cls.cap))
+
+    def _on_start(self, meta: dict):
+        cls = self._class(meta)
+        cls.in_flight += 1
+        cls.admitted += 1
+
+    def _on_finish(self, meta: dict):
+        self._class(meta).in_flight -= 1
+
+    def _admissible(self, meta: dict) -> bool:
+        return self._under_cap(self._class(meta))
+
+    def _queue_full(self, meta: dict) -> bool:
+        # bounded per class: a calculation backlog cannot get chat rejected
+        return self._class(meta).depth >= self.max_queue
+
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def _enqueue(self, waiter: _Waiter):
+        cls = self._class(waiter.meta)
+        if not cls.depth:
+            cls.pass_ = max(cls.pass_, self._vtime)
+        cls.sessions.setdefault(waiter.meta.get("session_id"), deque()).append(waiter)
+        cls.depth += 1
+        self._depth += 1
+
+    def _pop_waiter(self) -> _Waiter | None:
+        while True:
+            ready = [cls for cls in self._classes.values() if cls.depth and self._under_cap(cls)]
+            if not ready:
+                return None
+            cls = min(ready, key=lambda c: c.pass_)
+
+            session_id, queue = next(iter(cls.sessions.items()))
+            waiter = queue.popleft()
+            if queue:
+                cls.sessions.move_to_end(session_id)
+            else:
+                del cls.sessions[session_id]
+            cls.depth -= 1
+            self._depth -= 1
+
+            if waiter.future.done():
+                continue
+            self._vtime = cls.pass_
+            cls.pass_ += 1 / cls.weight
+            return waiter
+
+    def _remove(self, waiter: _Waiter):
+        cls = self._class(waiter.meta)
+        session_id = waiter.meta.get("session_id")
+        queue = cls.sessions.get(session_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del cls.sessions[session_id]
+        cls.depth -= 1
+        self._depth -= 1
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["classes"] = {
+            name: {
+                "weight": cls.weight,
+                "cap": cls.cap,
+                "queue_depth": cls.depth,
+                "waiting_sessions": len(cls.sessions),
+                "in_flight": cls.in_flight,
+                "admitted": cls.admitted,
+            }
+            for name, cls in self._classes.items()
+        }
+        return stats
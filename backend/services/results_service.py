@@ -1,14 +1,12 @@
 # services/results_service.py
 
 from typing import Dict, Any, List
-from database import get_conn  # asyncpg pool
+import asyncpg
 
 
 class ResultsService:
     @staticmethod
-    async def get_results(session_id: str) -> Dict[str, Any]:
-        db = await get_conn()
-
+    async def get_results(db: asyncpg.Connection, session_id: str) -> Dict[str, Any]:
         # -------------------------------------------------
         # FETCH CATEGORY-LEVEL SNAPSHOTS
         # -------------------------------------------------
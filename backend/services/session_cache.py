@@ -0,0 +1,98 @@
+# services/session_cache.py
+from collections import OrderedDict
+from database import acquire
+from services.context_assembler import serialize_profile
+from typing import Any, Dict, List
+import os
+import time
+
+# Decoded sessions row (profile, summary, current category, missing fields)
+# kept per worker, so chat turns and the calculation calls stop re-reading
+# and re-decoding it. Every UPDATE of those columns writes through
+# update(); entries idle for SESSION_CACHE_TTL are dropped.
+# The copy is per worker and writes only reach the local one: enable it with
+# one worker or session-affine routing, like SESSION_VECTOR_CACHE.
+SESSION_CACHE = os.getenv("SESSION_CACHE", "0") == "1"
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "900"))
+
+_hits = 0
+_misses = 0
+
+
+class SessionState:
+    __slots__ = ("company_profile", "profile_json", "summary", "current_category",
+                 "missing_fields", "expires_at")
+
+    def __init__(self, row):
+        self.company_profile: Dict[str, Any] = row["company_profile"] or {}
+        # compacted and serialized once, as the chat prompt sends it
+        self.profile_json: str = serialize_profile(self.company_profile)
+        self.summary: str = row["summary_text"] or ""
+        self.current_category: str | None = row["current_category"]
+        self.missing_fields: List[Any] = row["missing_fields"] or []
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + SESSION_CACHE_TTL
+
+
+_sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+
+
+async def get(session_id) -> SessionState | None:
+    """The session's state (None for an unknown session_id)."""
+    global _hits, _misses
+
+    key = str(session_id)
+    if SESSION_CACHE:
+        state = _sessions.get(key)
+        if state is not None:
+            if state.expires_at > time.monotonic():
+                _sessions.move_to_end(key)
+                state.touch()
+                _hits += 1
+                return state
+            del _sessions[key]
+        _misses += 1
+
+    async with acquire() as connection:
+        row = await connection.fetchrow("""
+            SELECT company_profile, summary_text, current_category, missing_fields
+            FROM sessions WHERE session_id = $1
+        """, session_id)
+
+    if not row:
+        return None
+
+    state = SessionState(row)
+    if SESSION_CACHE:
+        _sessions[key] = state
+        while len(_sessions) > SESSION_CACHE_SIZE:
+            _sessions.popitem(last=False)
+    return state
+
+
+def update(session_id, **fields):
+    """Write-through after an UPDATE of sessions (summary, current_category, missing_fields)."""
+    state = _sessions.get(str(session_id))
+    if state is None:
+        return
+    for name, value in fields.items():
+        setattr(state, name, value)
+
+
+def invalidate(session_id):
+    _sessions.pop(str(session_id), None)
+
+
+def session_cache_stats() -> Dict[str, Any]:
+    lookups = _hits + _misses
+    return {
+        "enabled": SESSION_CACHE,
+        "size": len(_sessions),
+        "capacity": SESSION_CACHE_SIZE,
+        "hits": _hits,
+        "misses": _misses,
+        "hit_ratio": round(_hits / lookups, 4) if lookups else 0.0,
+    }
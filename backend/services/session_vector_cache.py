@@ -0,0 +1,170 @@
+# services/session_vector_cache.py
+from collections import OrderedDict
+from database import acquire
+from typing import Any, Dict, List
+import asyncio
+import os
+import time
+
+import numpy as np
+
+# Per-worker copy of each session's vector_memory rows, so semantic_search is
+# a dot product instead of a Postgres round trip. Rows written by another
+# worker are only picked up when the session is hydrated again, so enable it
+# with a single worker or session-affine routing.
+SESSION_VECTOR_CACHE = os.getenv("SESSION_VECTOR_CACHE", "0") == "1"
+# Bounded by rows (~6 KB each at 1536 dims), evicting least recently used sessions
+SESSION_VECTOR_CACHE_MAX_ROWS = int(os.getenv("SESSION_VECTOR_CACHE_MAX_ROWS", "50000"))
+# Sessions idle this long are dropped (seconds)
+SESSION_VECTOR_CACHE_TTL = float(os.getenv("SESSION_VECTOR_CACHE_TTL", "1800"))
+
+
+class _SessionVectors:
+    """Unit-normalized rows of one session, grown by doubling."""
+
+    def __init__(self):
+        self.matrix: np.ndarray | None = None
+        self.categories: List[str] = []
+        self.contents: List[str] = []
+        self.seen: set = set()
+        self.last_used = time.monotonic()
+
+    def __len__(self):
+        return len(self.contents)
+
+    def append(self, content: str, category: str, vector) -> bool:
+        if (category, content) in self.seen:
+            return False
+
+        row = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(row)
+        if norm:
+            row = row / norm
+
+        n = len(self.contents)
+        if self.matrix is None:
+            self.matrix = np.empty((16, row.shape[0]), dtype=np.float32)
+        elif n == self.matrix.shape[0]:
+            grown = np.empty((n * 2, self.matrix.shape[1]), dtype=np.float32)
+            grown[:n] = self.matrix
+            self.matrix = grown
+
+        self.matrix[n] = row
+        self.categories.append(category)
+        self.contents.append(content)
+        self.seen.add((category, content))
+        return True
+
+    def search(self, exclude_category: str, query, limit: int) -> List[Dict[str, Any]]:
+        n = len(self.contents)
+        if not n or limit <= 0:
+            return []
+
+        q = np.asarray(query, dtype=np.float32)
+        scores = self.matrix[:n] @ q
+        excluded = np.fromiter((c == exclude_category for c in self.categories), dtype=bool, count=n)
+        scores[excluded] = -np.inf
+
+        k = min(limit, n - int(excluded.sum()))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [{"content": self.contents[i], "category": self.categories[i]} for i in top]
+
+
+_sessions: "OrderedDict[str, _SessionVectors]" = OrderedDict()
+_hydrating: Dict[str, asyncio.Future] = {}
+_rows = 0
+
+_hits = 0
+_hydrations = 0
+_evictions = 0
+
+
+def _evict():
+    global _rows, _evictions
+
+    now = time.monotonic()
+    while _sessions:
+        session_id, entry = next(iter(_sessions.items()))
+        if _rows <= SESSION_VECTOR_CACHE_MAX_ROWS and now - entry.last_used < SESSION_VECTOR_CACHE_TTL:
+            break
+        _sessions.popitem(last=False)
+        _rows -= len(entry)
+        _evictions += 1
+
+
+async def _hydrate(session_id: str) -> _SessionVectors:
+    global _rows, _hydrations
+
+    async with acquire() as connection:
+        rows = await connection.fetch("""
+            SELECT content, category, embedding::vector AS embedding
+            FROM vector_memory
+            WHERE session_id = $1
+            ORDER BY id ASC
+        """, session_id)
+
+    entry = _SessionVectors()
+    for r in rows:
+        entry.append(r["content"], r["category"], r["embedding"])
+
+    _sessions[session_id] = entry
+    _rows += len(entry)
+    _hydrations += 1
+    _evict()
+    return entry
+
+
+async def _entry(session_id: str) -> _SessionVectors:
+    global _hits
+
+    _evict()
+    entry = _sessions.get(session_id)
+    if entry is not None:
+        _sessions.move_to_end(session_id)
+        entry.last_used = time.monotonic()
+        _hits += 1
+        return entry
+
+    # one hydration per session; concurrent callers wait for it
+    pending = _hydrating.get(session_id)
+    if pending is None:
+        pending = asyncio.ensure_future(_hydrate(session_id))
+        _hydrating[session_id] = pending
+        pending.add_done_callback(lambda _: _hydrating.pop(session_id, None))
+    return await asyncio.shield(pending)
+
+
+async def add(session_id: str, content: str, category: str, vector):
+    """
+    Record a row that was just queued for vector_memory. Hydrates first, so
+    a row the write-behind writer already flushed is not added twice.
+    """
+    global _rows
+
+    entry = await _entry(session_id)
+    if entry.append(content, category, vector):
+        _rows += 1
+        _evict()
+
+
+async def search(session_id: str, current_category: str, query_embedding, limit: int) -> List[Dict[str, Any]]:
+    entry = await _entry(session_id)
+    return entry.search(current_category, query_embedding, limit)
+
+
+def session_vector_stats() -> dict:
+    lookups = _hits + _hydrations
+    return {
+        "enabled": SESSION_VECTOR_CACHE,
+        "sessions": len(_sessions),
+        "rows": _rows,
+        "max_rows": SESSION_VECTOR_CACHE_MAX_ROWS,
+        "hits": _hits,
+        "hydrations": _hydrations,
+        "evictions": _evictions,
+        "hit_ratio": round(_hits / lookups, 4) if lookups else 0.0,
+    }
@@ -0,0 +1,50 @@
+# services/single_flight.py
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+# Concurrent calls with the same key share one in-flight computation: the
+# first caller starts it, later callers await the same result (or exception).
+# The computation runs as its own task, so a caller that disconnects does not
+# cancel it for the others, and its writes still complete.
+
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        _groups[name] = self
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # mark the exception retrieved in case every caller went away
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
+
+
+def single_flight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
@@ -1,70 +1,129 @@
 # services/summary_service.py
 
-from database import get_conn
+from database import acquire
 from typing import Dict, Any
-from services.llm_service import ask_model
+from services.llm_service import ask_model, LLM_STRUCTURED_OUTPUT
 from services.prompt_builder import build_prompt2
+from services.single_flight import SingleFlight
+from services import llm_cache, session_cache
+from schemas import SummaryResponse
+
+# Summaries are incremental: summary_watermarks stores, per session and
+# category, the last qa_messages.id already folded into summary_text, so each
+# update only sends the Q/A recorded since (and skips the LLM when there is none).
+# The new summary is saved only if summary_text is still the one the prompt
+# was built from; a concurrent update of another category makes us rebuild.
+MAX_CONFLICT_RETRIES = 3
+
+_in_flight = SingleFlight("summary")
+
+_calls = 0
+_skipped = 0
+_conflicts = 0
+
 
 async def generate_summary(session_id: str, category: str) -> Dict[str, Any]:
+    return await _in_flight.do((str(session_id), category), lambda: _generate_summary(session_id, category))
+
+
+async def _generate_summary(session_id: str, category: str) -> Dict[str, Any]:
     """
-    Simplified summary logic:
-    - Get existing summary
-    - Fetch ALL Q/A for the given category (no timestamps)
-    - Build Prompt2
-    - Send to LLM
-    - Save updated summary
+    - Get existing summary and the category's watermark
+    - Fetch the Q/A of the category newer than the watermark
+    - Nothing new: return the existing summary without calling the LLM
+    - Build Prompt2, send to LLM
+    - Save updated summary and advance the watermark together
     """
-    conn = await get_conn()
-
-    # --- Fetch existing summary ---
-    session = await conn.fetchrow("""
-        SELECT summary_text
-        FROM sessions
-        WHERE session_id = $1
-    """, session_id)
-
-    if not session:
-        raise ValueError("Invalid session_id")
-
-    previous_summary = session["summary_text"] or ""
-
-    # --- Fetch ALL Q/A for this category ---
-    qa_rows = await conn.fetch("""
-        SELECT question_text, answer_text
-        FROM qa_messages
-        WHERE session_id = $1
-          AND category = $2
-        ORDER BY id ASC
-    """, session_id, category)
-
-    recent_qa = [
-        {
-            "question": r["question_text"],
-            "answer": r["answer_text"]
+    global _calls, _skipped, _conflicts
+
+    for _ in range(MAX_CONFLICT_RETRIES):
+        async with acquire() as conn:
+            # --- Fetch existing summary + watermark ---
+            session = await conn.fetchrow("""
+                SELECT s.summary_text, COALESCE(w.last_qa_id, 0) AS last_qa_id
+                FROM sessions s
+                LEFT JOIN summary_watermarks w
+                  ON w.session_id = s.session_id AND w.category = $2
+                WHERE s.session_id = $1
+            """, session_id, category)
+
+            if not session:
+                raise ValueError("Invalid session_id")
+
+            # --- Fetch Q/A newer than the watermark ---
+            qa_rows = await conn.fetch("""
+                SELECT id, question_text, answer_text
+                FROM qa_messages
+                WHERE session_id = $1
+                  AND category = $2
+                  AND id > $3
+                ORDER BY id ASC
+            """, session_id, category, session["last_qa_id"])
+
+        previous_summary = session["summary_text"] or ""
+
+        if not qa_rows:
+            _skipped += 1
+            return {"updated_summary": previous_summary}
+
+        recent_qa = [
+            {
+                "question": r["question_text"],
+                "answer": r["answer_text"]
+            }
+            for r in qa_rows
+        ]
+
+        # --- Build Prompt2 ---
+        prompt_data = {
+            "previous_summary": previous_summary,
+            "recent_qa": recent_qa
         }
-        for r in qa_rows
-    ]
 
-    # --- Build Prompt2 ---
-    prompt_data = {
-        "previous_summary": previous_summary,
-        "recent_qa": recent_qa
-    }
+        prompt = build_prompt2(prompt_data, structured=LLM_STRUCTURED_OUTPUT)
+
+        # --- Ask LLM ---
+        _calls += 1
+        llm_output = await ask_model(prompt, SummaryResponse, priority="summary", session_id=session_id)
 
-    prompt = build_prompt2(prompt_data)
+        updated_summary = llm_output.get("updated_summary", "").strip()
+        if not updated_summary:
+            raise ValueError("LLM returned empty summary")
 
-    # --- Ask LLM ---
-    llm_output = await ask_model(prompt)
+        # --- Update DB: summary and watermark move together ---
+        async with acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute("""
+                    UPDATE sessions
+                    SET summary_text = $1
+                    WHERE session_id = $2
+                      AND summary_text IS NOT DISTINCT FROM $3
+                """, updated_summary, session_id, session["summary_text"])
 
-    updated_summary = llm_output.get("updated_summary", "").strip()
-    if not updated_summary:
-        raise ValueError("LLM returned empty summary")
+                if result == "UPDATE 1":
+                    await conn.execute("""
+                        INSERT INTO summary_watermarks (session_id, category, last_qa_id)
+                        VALUES ($1, $2, $3)
+                        ON CONFLICT (session_id, category) DO UPDATE
+                        SET last_qa_id = GREATEST(summary_watermarks.last_qa_id, EXCLUDED.last_qa_id),
+                            updated_at = now()
+                    """, session_id, category, qa_rows[-1]["id"])
 
-    # --- Update DB ---
-    await conn.execute("""
-        UPDATE sessions
-        SET summary_text = $1
-        WHERE session_id = $2
-    """, updated_summary, session_id)
+        if result == "UPDATE 1":
+            session_cache.update(session_id, summary=updated_summary)
+            # the summary is part of every calculation prompt of the session
+            llm_cache.invalidate(session_id)
+            return {"updated_summary": updated_summary}
 
-    return {"updated_summary": updated_summary}
\ No newline at end of file
+        _conflicts += 1
+        print(f"🔁 Summary of {session_id} changed concurrently, rebuilding {category}")
+
+    raise RuntimeError("Summary kept changing concurrently, retry shortly")
+
+
+def summary_stats() -> Dict[str, Any]:
+    return {
+        "llm_calls": _calls,
+        "skipped": _skipped,
+        "conflicts": _conflicts,
+    }
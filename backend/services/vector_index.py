@@ -0,0 +1,250 @@
+# services/vector_index.py
+import asyncpg
+import os
+
+# ANN index on vector_memory.embedding: hnsw | ivfflat | none
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "hnsw").lower()
+VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "16"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "64"))
+VECTOR_IVFFLAT_LISTS = int(os.getenv("VECTOR_IVFFLAT_LISTS", "100"))
+# Build a missing index in the background at startup
+VECTOR_INDEX_AUTO_BUILD = os.getenv("VECTOR_INDEX_AUTO_BUILD", "1") == "1"
+
+# Search-time defaults, applied to every pooled connection
+VECTOR_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "40"))
+VECTOR_IVFFLAT_PROBES = int(os.getenv("VECTOR_IVFFLAT_PROBES", "10"))
+# Without iterative scans (pgvector < 0.8) filtered HNSW queries run with
+# hnsw.ef_search raised to at least limit * VECTOR_OVERFETCH
+VECTOR_OVERFETCH = int(os.getenv("VECTOR_OVERFETCH", "10"))
+
+# Compact storage target for `python migrate.py --vector-storage`: vector | halfvec,
+# at EMBEDDING_DIM dimensions. Queries follow whatever type the column has.
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+# binary: index binary_quantize(embedding) (hamming distance) and re-rank
+# limit * VECTOR_RERANK_FACTOR candidates with the stored vectors
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+
+INDEX_NAME = "vector_memory_embedding_ann_idx"
+# only one worker builds; the others skip while the lock is held
+INDEX_BUILD_LOCK_KEY = 781_240_012
+HNSW_MAX_EF_SEARCH = 1000
+
+_pgvector_version: tuple | None = None
+# (type name, dimensions) of vector_memory.embedding
+_column: tuple | None = None
+
+
+def ann_enabled() -> bool:
+    return VECTOR_INDEX in ("hnsw", "ivfflat")
+
+
+def iterative_scan_supported() -> bool:
+    return _pgvector_version is not None and _pgvector_version >= (0, 8, 0)
+
+
+def binary_quantized() -> bool:
+    return VECTOR_QUANTIZATION == "binary"
+
+
+def column_type() -> str:
+    kind, dim = _column or ("vector", EMBEDDING_DIM)
+    return f"{kind}({dim})"
+
+
+def query_vector(param: str = "$3") -> str:
+    """Query parameter cast to the column type (sent as vector, cast server-side)."""
+    kind, _ = _column or ("vector", EMBEDDING_DIM)
+    return f"{param}::vector" if kind == "vector" else f"{param}::vector::{column_type()}"
+
+
+def bit_expression(vector_sql: str) -> str:
+    _, dim = _column or ("vector", EMBEDDING_DIM)
+    return f"binary_quantize({vector_sql})::bit({dim})"
+
+
+def _indexed() -> tuple:
+    """(index expression, operator class) for the configured quantization."""
+    if binary_quantized():
+        return f"({bit_expression('embedding')})", "bit_hamming_ops"
+    kind, _ = _column or ("vector", EMBEDDING_DIM)
+    return "embedding", f"{kind}_cosine_ops"
+
+
+def index_ddl() -> str:
+    expression, opclass = _indexed()
+    if VECTOR_INDEX == "hnsw":
+        return f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+            ON vector_memory USING hnsw ({expression} {opclass})
+            WITH (m = {VECTOR_HNSW_M}, ef_construction = {VECTOR_HNSW_EF_CONSTRUCTION})
+        """
+    if VECTOR_INDEX == "ivfflat":
+        return f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+            ON vector_memory USING ivfflat ({expression} {opclass})
+            WITH (lists = {VECTOR_IVFFLAT_LISTS})
+        """
+    raise ValueError(f"No ANN index for VECTOR_INDEX={VECTOR_INDEX!r}")
+
+
+def search_settings(ef_search: int | None = None) -> list:
+    """SET statements for the configured index type (ef_search overrides the default)."""
+    if VECTOR_INDEX == "hnsw":
+        ef = min(ef_search or VECTOR_EF_SEARCH, HNSW_MAX_EF_SEARCH)
+        settings = [f"SET {{scope}} hnsw.ef_search = {int(ef)}"]
+        if iterative_scan_supported():
+            settings.append("SET {scope} hnsw.iterative_scan = relaxed_order")
+        return settings
+    if VECTOR_INDEX == "ivfflat":
+        probes = ef_search or VECTOR_IVFFLAT_PROBES
+        settings = [f"SET {{scope}} ivfflat.probes = {int(probes)}"]
+        if iterative_scan_supported():
+            settings.append("SET {scope} ivfflat.iterative_scan = relaxed_order")
+        return settings
+    return []
+
+
+async def _inspect(connection: asyncpg.Connection):
+    global _pgvector_version, _column
+
+    if _pgvector_version is None:
+        version = await connection.fetchval(
+            "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+        )
+        if version:
+            _pgvector_version = tuple(int(p) for p in version.split(".")[:3] if p.isdigit())
+
+    if _column is None:
+        _column = await _column_type(connection)
+        if _column and _column[1] != EMBEDDING_DIM:
+            print(f"⚠️ vector_memory.embedding is {column_type()} but EMBEDDING_DIM={EMBEDDING_DIM}")
+
+
+async def _column_type(connection: asyncpg.Connection) -> tuple | None:
+    declared = await connection.fetchval("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass('vector_memory') AND attname = 'embedding'
+    """)
+    if not declared or "(" not in declared:
+        return None
+    kind, dim = declared.rstrip(")").split("(")
+    return kind, int(dim)
+
+
+def session_settings() -> list:
+    """Session-level SET statements for the search defaults (none without an ANN index)."""
+    if not ann_enabled():
+        return []
+    return [statement.format(scope="SESSION") + ";" for statement in search_settings()]
+
+
+async def configure_connection(connection: asyncpg.Connection):
+    """Session-level search defaults, so ordinary queries need no extra round trip."""
+    await _inspect(connection)
+    for statement in session_settings():
+        await connection.execute(statement)
+
+
+async def ensure_vector_index(connection: asyncpg.Connection):
+    """
+    Create the configured ANN index if it is missing (CONCURRENTLY, so writes
+    continue during the build). An invalid index left by an interrupted build,
+    or one of a different type, is dropped and rebuilt.
+    """
+    if not ann_enabled():
+        return
+
+    await _inspect(connection)
+    if not await connection.fetchval("SELECT pg_try_advisory_lock($1)", INDEX_BUILD_LOCK_KEY):
+        print("ℹ️ Vector index build already running in another worker.")
+        return
+
+    try:
+        await _ensure_vector_index(connection)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", INDEX_BUILD_LOCK_KEY)
+
+
+async def _ensure_vector_index(connection: asyncpg.Connection):
+    row = await connection.fetchrow("""
+        SELECT pg_get_indexdef(i.indexrelid) AS indexdef, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1
+    """, INDEX_NAME)
+
+    _, opclass = _indexed()
+    if row and (
+        not row["indisvalid"]
+        or f"USING {VECTOR_INDEX} " not in row["indexdef"]
+        or opclass not in row["indexdef"]
+    ):
+        print(f"🔁 Rebuilding vector index {INDEX_NAME}")
+        await connection.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+        row = None
+
+    if row is None:
+        print(f"🏗️ Building {VECTOR_INDEX} index {INDEX_NAME} ...")
+        await connection.execute(index_ddl())
+        print(f"✅ Vector index {INDEX_NAME} ready.")
+
+
+async def convert_storage(connection: asyncpg.Connection) -> bool:
+    """
+    Rewrite vector_memory.embedding as VECTOR_STORAGE(EMBEDDING_DIM), e.g.
+    vector(1536) -> halfvec(1536) halves the table, halfvec(768) quarters it.
+    Shrinking keeps the leading dimensions (subvector): the Gemini embeddings
+    are Matryoshka-trained, so a prefix is what a smaller output_dimensionality
+    returns, up to scale. The ANN index is dropped and rebuilt afterwards.
+    The table is locked for the rewrite; restart workers once it is done.
+    """
+    global _column
+
+    if VECTOR_STORAGE not in ("vector", "halfvec"):
+        raise ValueError(f"Unsupported VECTOR_STORAGE={VECTOR_STORAGE!r}")
+
+    current = await _column_type(connection)
+    target = (VECTOR_STORAGE, EMBEDDING_DIM)
+    if current is None or current == target:
+        return False
+    if target[1] > current[1]:
+        raise ValueError(f"Cannot grow vector_memory.embedding from {current[1]} to {target[1]} dimensions")
+
+    source = "embedding::vector"
+    if target[1] < current[1]:
+        source = f"subvector({source}, 1, {target[1]})"
+
+    print(f"🔁 Converting vector_memory.embedding {current[0]}({current[1]}) -> {target[0]}({target[1]})")
+    async with connection.transaction():
+        await connection.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+        await connection.execute(f"""
+            ALTER TABLE vector_memory
+            ALTER COLUMN embedding TYPE {target[0]}({target[1]})
+            USING {source}::{target[0]}({target[1]})
+        """)
+
+    _column = target
+    await ensure_vector_index(connection)
+    return True
+
+
+async def storage_stats(connection: asyncpg.Connection) -> dict:
+    return dict(await connection.fetchrow("""
+        SELECT pg_size_pretty(pg_total_relation_size('vector_memory')) AS table_size,
+               pg_size_pretty(COALESCE(pg_relation_size(to_regclass($1)), 0)) AS index_size
+    """, INDEX_NAME))
+
+
+async def build_in_background(dsn: str):
+    # dedicated connection: an index build can take minutes on a large table
+    try:
+        connection = await asyncpg.connect(dsn)
+        try:
+            await ensure_vector_index(connection)
+        finally:
+            await connection.close()
+    except Exception as e:
+        print("⚠️ Vector index build failed:", e)
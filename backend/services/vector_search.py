@@ -1,26 +1,119 @@
 # services/vector_search.py
-from database import get_conn
+from database import acquire
 from typing import List, Dict, Any
+from services import vector_index, session_vector_cache
+
+# Query text depends on the column type (vector / halfvec, detected when the
+# pool connects) and VECTOR_QUANTIZATION; built once per combination.
+_queries: Dict[tuple, tuple] = {}
+
+
+def _build_queries() -> tuple:
+    vec = vector_index.query_vector("$3")
+
+    # Filtered top-k. The materialized CTE re-sorts rows an iterative (relaxed
+    # order) index scan may return slightly out of order.
+    ann = f"""
+    WITH candidates AS MATERIALIZED (
+        SELECT content, category, embedding <=> {vec} AS distance
+        FROM vector_memory
+        WHERE session_id = $1
+          AND category != $2
+        ORDER BY embedding <=> {vec}
+        LIMIT $4
+    )
+    SELECT content, category FROM candidates ORDER BY distance
+"""
+
+    if vector_index.binary_quantized():
+        # Coarse hamming search on the bit index, re-ranked by cosine distance
+        # against the stored vectors.
+        ann = f"""
+    WITH candidates AS MATERIALIZED (
+        SELECT content, category, embedding
+        FROM vector_memory
+        WHERE session_id = $1
+          AND category != $2
+        ORDER BY {vector_index.bit_expression("embedding")} <~> {vector_index.bit_expression(vec)}
+        LIMIT $4 * {vector_index.VECTOR_RERANK_FACTOR}
+    )
+    SELECT content, category FROM candidates
+    ORDER BY embedding <=> {vec}
+    LIMIT $4
+"""
+
+    # Same result computed without the ANN index: "+ 0" keeps the planner from
+    # matching the index, so it filters on (session_id, category) and sorts.
+    exact = f"""
+    SELECT content, category
+    FROM vector_memory
+    WHERE session_id = $1
+      AND category != $2
+    ORDER BY (embedding <=> {vec}) + 0
+    LIMIT $4
+"""
+    return ann, exact
+
+
+def _search_queries() -> tuple:
+    key = (vector_index.column_type(), vector_index.VECTOR_QUANTIZATION)
+    if key not in _queries:
+        _queries[key] = _build_queries()
+    return _queries[key]
+
 
 async def semantic_search(
     session_id: str,
     current_category: str,
     query_embedding: List[float],
-    limit: int = 5
+    limit: int = 5,
+    ef_search: int | None = None
 ) -> List[Dict[str, Any]]:
     """
     Returns top-N most similar vector_memory rows using cosine similarity.
     Excludes the current category.
+
+    With an ANN index the session/category filter is applied during the index
+    scan (pgvector >= 0.8 iterative scans) or, on older pgvector, by raising
+    hnsw.ef_search to limit * VECTOR_OVERFETCH. With VECTOR_QUANTIZATION=binary
+    the index returns limit * VECTOR_RERANK_FACTOR hamming-distance candidates
+    that are re-ranked with the stored vectors. If the index still yields fewer
+    than `limit` rows, the exact query fills the result, so callers always
+    get a full top-k when that many rows exist.
+
+    With SESSION_VECTOR_CACHE=1 the search runs in-process over the session's
+    cached rows instead (services/session_vector_cache.py).
     """
-    connection = await get_conn()
-    rows = await connection.fetch("""
-        SELECT content, category
-        FROM vector_memory
-        WHERE session_id = $1
-          AND category != $2
-        ORDER BY embedding <=> $3
-        LIMIT $4
-    """, session_id, current_category, query_embedding, limit)
+    if session_vector_cache.SESSION_VECTOR_CACHE:
+        return await session_vector_cache.search(session_id, current_category, query_embedding, limit)
+
+    args = (session_id, current_category, query_embedding, limit)
+    ann_query, exact_query = _search_queries()
+
+    async with acquire() as connection:
+        if not vector_index.ann_enabled():
+            rows = await connection.fetch(exact_query, *args)
+        else:
+            if (ef_search is None and vector_index.VECTOR_INDEX == "hnsw"
+                    and not vector_index.iterative_scan_supported()):
+                ef_search = max(vector_index.VECTOR_EF_SEARCH, limit * vector_index.VECTOR_OVERFETCH)
+            if ef_search is None and vector_index.binary_quantized():
+                # the coarse scan must be able to return all re-rank candidates
+                candidates = limit * vector_index.VECTOR_RERANK_FACTOR
+                if vector_index.VECTOR_INDEX == "hnsw" and candidates > vector_index.VECTOR_EF_SEARCH:
+                    ef_search = candidates
+
+            if ef_search is None:
+                # connection defaults from vector_index.configure_connection
+                rows = await connection.fetch(ann_query, *args)
+            else:
+                async with connection.transaction():
+                    for statement in vector_index.search_settings(ef_search):
+                        await connection.execute(statement.format(scope="LOCAL"))
+                    rows = await connection.fetch(ann_query, *args)
+
+            if len(rows) < limit:
+                rows = await connection.fetch(exact_query, *args)
 
     return [
         {
@@ -28,4 +121,4 @@ async def semantic_search(
             "category": r["category"]
         }
         for r in rows
-    ]
\ No newline at end of file
+    ]
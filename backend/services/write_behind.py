@@ -0,0 +1,212 @@
+# services/write_behind.py
+from collections import deque
+from database import acquire
+from services import bulk_writes
+from typing import Any, Deque, Dict, List, Tuple
+import asyncio
+import asyncpg
+import os
+
+# Writes that the caller does not need to see before responding are queued
+# here and applied by a single background worker. Only derived data goes
+# through it (vector_memory embeddings of stored Q/As, entity_emission
+# results, LLM cache invalidations): the queue is in memory, so ops still
+# queued when the process dies are lost. User-provided data (qa_messages,
+# structured_fields) is written inline.
+#   - wait_for_session() only sees this process's queue: read-your-writes
+#     across requests needs one worker or session-affine routing, like
+#     SESSION_CACHE and SESSION_VECTOR_CACHE
+#   - ops are applied in enqueue order, so writes of one session stay ordered
+#   - whatever accumulated while the previous flush ran is written as one
+#     batch: consecutive ops of the same kind become one set-based statement,
+#     the whole batch runs in one transaction
+#   - params are coerced to the column types at enqueue time; an op that
+#     cannot be coerced is rejected there, in the request that produced it
+#   - a failed batch stays queued and is retried with backoff; when it fails
+#     on bad data, its ops are written one by one so only the bad op is dropped
+#   - readers that need the rows call wait_for_session() first
+#   - lifespan drains the queue on shutdown
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+WRITE_BEHIND_WAIT_TIMEOUT = float(os.getenv("WRITE_BEHIND_WAIT_TIMEOUT", "10"))
+
+# kind -> set-based writer taking (connection, rows)
+_WRITERS = {
+    "vector_memory": bulk_writes.insert_vector_memory,
+    "entity_emission": bulk_writes.update_entity_emissions,
+    "llm_cache_invalidate": bulk_writes.delete_llm_cache_entries,
+}
+
+_Op = Tuple[str, str, tuple]  # (session_id, kind, params)
+
+# params are coerced to the writer's row shape at enqueue time
+_COERCE = {
+    "vector_memory": bulk_writes.vector_memory_row,
+    "entity_emission": bulk_writes.entity_emission_row,
+    "llm_cache_invalidate": bulk_writes.llm_cache_entry_row,
+}
+
+# errors that retrying the same data cannot fix
+_BAD_DATA = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, TypeError, ValueError)
+
+
+class _WriteBehind:
+    def __init__(self):
+        self._queue: Deque[_Op] = deque()
+        self._pending: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._flushed = asyncio.Condition()
+        self._worker: asyncio.Task | None = None
+
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+
+    def enqueue(self, session_id, kind: str, params: tuple):
+        if kind not in _WRITERS:
+            raise ValueError(f"Unknown write-behind op: {kind}")
+
+        # raises ValueError for the caller on a malformed session_id
+        params = _COERCE[kind](params)
+        session_id = str(session_id)
+        self._queue.append((session_id, kind, params))
+        self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._wakeup.set()
+
+    async def wait_for_session(self, session_id, timeout: float = WRITE_BEHIND_WAIT_TIMEOUT):
+        """Block until every op queued so far for this session is written (bounded by timeout)."""
+        session_id = str(session_id)
+        if not self._pending.get(session_id):
+            return
+
+        async def _wait():
+            async with self._flushed:
+                await self._flushed.wait_for(lambda: not self._pending.get(session_id))
+
+        try:
+            await asyncio.wait_for(_wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Write-behind still pending for session {session_id} after {timeout}s")
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = WRITE_BEHIND_WAIT_TIMEOUT):
+        if self._worker is None:
+            return
+
+        # let the worker drain what is left, then stop it
+        try:
+            await asyncio.wait_for(self._drained(), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ Write-behind shutdown: {len(self._queue)} ops could not be written")
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _drained(self):
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: not self._queue)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._queue:
+                batch = [self._queue[i] for i in range(min(len(self._queue), WRITE_BEHIND_BATCH_SIZE))]
+                written, failed = await self._flush(batch)
+
+                for _ in batch:
+                    self._queue.popleft()
+                for session_id, _, _ in batch:
+                    left = self._pending[session_id] - 1
+                    if left:
+                        self._pending[session_id] = left
+                    else:
+                        del self._pending[session_id]
+
+                self.written += written
+                self.failed += failed
+
+                async with self._flushed:
+                    self._flushed.notify_all()
+
+    async def _flush(self, batch: List[_Op]) -> Tuple[int, int]:
+        """Write a batch; returns (ops written, ops dropped)."""
+        result = await self._write_with_retry(batch)
+        if result is not None:
+            return (len(batch), 0) if result else (0, len(batch))
+
+        # bad data in one op: write them one by one (in order, so each
+        # session's writes stay ordered) and drop only the ops that fail
+        if len(batch) == 1:
+            return 0, 1
+        print(f"⚠️ Write-behind batch of {len(batch)} ops hit bad data, writing ops one by one")
+        written = failed = 0
+        for op in batch:
+            w, f = await self._flush([op])
+            written += w
+            failed += f
+        return written, failed
+
+    async def _write_with_retry(self, batch: List[_Op]) -> bool | None:
+        """True when written, False when dropped after retries, None on bad data (not retried)."""
+        for attempt in range(WRITE_BEHIND_MAX_RETRIES + 1):
+            try:
+                await self._write(batch)
+                self.batches += 1
+                return True
+            except _BAD_DATA as e:
+                if len(batch) == 1:
+                    session_id, kind, _ = batch[0]
+                    print(f"❌ Write-behind {kind} op of session {session_id} dropped:", e)
+                return None
+            except Exception as e:
+                if attempt == WRITE_BEHIND_MAX_RETRIES:
+                    print(f"❌ Write-behind batch of {len(batch)} ops dropped:", e)
+                    return False
+                print(f"⚠️ Write-behind batch failed (attempt {attempt + 1}), retrying:", e)
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+        return False
+
+    async def _write(self, batch: List[_Op]):
+        # consecutive ops of the same kind -> one set-based statement
+        runs: List[Tuple[str, List[tuple]]] = []
+        for _, kind, params in batch:
+            if runs and runs[-1][0] == kind:
+                runs[-1][1].append(params)
+            else:
+                runs.append((kind, [params]))
+
+        async with acquire() as connection:
+            async with connection.transaction():
+                for kind, rows in runs:
+                    await _WRITERS[kind](connection, rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_depth,
+            "sessions_pending": len(self._pending),
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+_writer = _WriteBehind()
+
+enqueue = _writer.enqueue
+wait_for_session = _writer.wait_for_session
+start = _writer.start
+stop = _writer.stop
+write_behind_stats = _writer.stats
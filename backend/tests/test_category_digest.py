@@ -0,0 +1,23 @@
+from services import category_digest
+
+
+def _rows(n, answer="Diesel"):
+    return [{"id": i, "question_text": f"Q{i}?", "answer_text": answer} for i in range(n)]
+
+
+def test_compaction_is_due_after_enough_turns(monkeypatch):
+    monkeypatch.setattr(category_digest, "CATEGORY_COMPACT_TURNS", 6)
+    monkeypatch.setattr(category_digest, "CATEGORY_KEEP_RECENT", 2)
+
+    assert not category_digest._due(_rows(5))
+    assert category_digest._due(_rows(6))
+
+
+def test_compaction_is_due_on_tokens_of_the_older_turns(monkeypatch):
+    monkeypatch.setattr(category_digest, "CATEGORY_COMPACT_TURNS", 100)
+    monkeypatch.setattr(category_digest, "CATEGORY_COMPACT_TOKENS", 200)
+    monkeypatch.setattr(category_digest, "CATEGORY_KEEP_RECENT", 2)
+
+    # only the recent turns are long: nothing older to fold in
+    assert not category_digest._due(_rows(2, answer="x" * 4000))
+    assert category_digest._due(_rows(3, answer="x" * 1000))
@@ -0,0 +1,81 @@
+import json
+
+from services.context_assembler import (
+    PROFILE_SHARE, assemble_prompt1, estimate_tokens, fit_profile, serialize_profile,
+)
+
+PROFILE = {
+    "company_name": "Acme Cement",
+    "industry": "Manufacturing",
+    "description": "Clinker kilns and grinding. " * 40,
+    "sites": [f"Plant {i}, Industrial Estate Road, Pune" for i in range(40)],
+    "fleet": "Forty diesel trucks. " * 20,
+}
+
+
+def _data(**extra):
+    return {
+        "current_category": "Stationary Combustion",
+        "missing_fields": ["diesel_litres"],
+        "last_qa": [{"question": "Fuel?", "answer": "Diesel"}],
+        "company_profile": PROFILE,
+        **extra,
+    }
+
+
+def test_over_budget_profile_stays_a_json_object_within_its_share():
+    budget = 1500
+    out, report = assemble_prompt1(_data(), budget=budget)
+
+    profile = json.loads(out["company_profile_json"])
+    assert isinstance(profile, dict)
+    assert profile["company_name"] == "Acme Cement"
+    assert estimate_tokens(out["company_profile_json"]) <= int(budget * PROFILE_SHARE)
+    assert report["sections"]["company_profile"]["tokens"] <= int(budget * PROFILE_SHARE)
+
+
+def test_trailing_keys_go_when_trimming_is_not_enough():
+    text = fit_profile(serialize_profile(PROFILE), 12)
+
+    profile = json.loads(text)
+    assert estimate_tokens(text) <= 12
+    assert list(profile) == list(PROFILE)[:len(profile)]
+
+
+def test_profile_within_budget_is_untouched():
+    small = serialize_profile({"company_name": "Acme"})
+    assert fit_profile(small, 100) == small
+
+
+def _qa(i):
+    return {"question": f"Question {i} about the diesel generators?", "answer": f"Answer {i}: " + "litres " * 20}
+
+
+def test_sections_fill_the_budget_in_priority_order():
+    budget = 800
+    data = _data(
+        qa_in_category=[_qa(i) for i in range(30)],
+        summary="Older summary. " * 200,
+        category_digest="Digest of early turns. " * 100,
+        relevant_qa=[{"content": f"Q: Other {i}?\nA: " + "tonnes " * 20} for i in range(20)],
+    )
+
+    out, report = assemble_prompt1(data, budget=budget)
+
+    assert report["total"] <= budget
+    sections = report["sections"]
+    # required sections are always there; the newest Q/As outrank older ones
+    assert out["last_qa"] == data["last_qa"]
+    assert out["qa_in_category"] == data["qa_in_category"][-len(out["qa_in_category"]):]
+    assert sections["qa_in_category"]["dropped"] > 0
+    assert out["summary"].startswith("…")
+
+
+def test_semantic_hits_duplicating_the_transcript_are_dropped():
+    qa = _qa(1)
+    hit = {"content": f"Q: {qa['question']}\nA: {qa['answer']}"}
+    other = {"content": "Q: Site?\nA: Pune"}
+
+    out, _ = assemble_prompt1(_data(qa_in_category=[qa], relevant_qa=[hit, other]), budget=4000)
+
+    assert out["relevant_qa"] == [other]
@@ -0,0 +1,27 @@
+import json
+
+from services.json_extract import StreamingStringField, extract_json_block
+
+
+def test_largest_object_in_prose():
+    text = 'Sure {oops. Here you go: {"a": {"b": 1}, "s": "brace } in string"} and {"c": 2}'
+    assert json.loads(extract_json_block(text)) == {"a": {"b": 1}, "s": "brace } in string"}
+
+
+def test_delimited_block_is_preferred():
+    text = '{"noise": "this is a much longer object than the real one"} <<<JSON_START>>>{"updated_summary": "x"}<<<JSON_END>>>'
+    assert json.loads(extract_json_block(text)) == {"updated_summary": "x"}
+
+
+def test_no_json():
+    assert extract_json_block("no object { here") is None
+
+
+def test_streaming_field_across_chunks():
+    field = StreamingStringField("next_question")
+    chunks = ['{"next_question": "How many \\', 'u00e9', 'l\\u00e9ments \\"exactly\\"?', '", "analysis_complete": false}']
+
+    text = "".join(field.feed(chunk) for chunk in chunks)
+
+    assert text == 'How many éléments "exactly"?'
+    assert field.done
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+import asyncio
+import uuid
+
+import pytest
+
+from services import llm_cache
+
+SESSION_ID = str(uuid.uuid4())
+INPUTS = {"category": "Waste", "structured_fields": [{"field_name": "waste_kg", "field_value_float": 12.0}]}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE", True)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PERSIST", False)
+    monkeypatch.setattr(llm_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(llm_cache, "_by_scope", {})
+
+
+def _key(inputs=INPUTS):
+    return llm_cache.cache_key("prompt3A", inputs, "model", structured=False)
+
+
+def test_key_ignores_dict_order_but_not_values():
+    reordered = dict(reversed(list(INPUTS.items())))
+    assert _key(reordered) == _key()
+    assert _key({**INPUTS, "category": "Energy"}) != _key()
+    assert llm_cache.cache_key("prompt3B", INPUTS, "model") != _key()
+
+
+def test_answers_are_served_until_invalidated():
+    answer = {"scope": "Scope 3", "raw_emissions": 0.5}
+
+    async def run():
+        await llm_cache.put(_key(), answer, SESSION_ID, "Waste", "prompt3A", "model")
+        assert await llm_cache.get(_key()) == answer
+        llm_cache.invalidate(SESSION_ID, "Energy")
+        assert await llm_cache.get(_key()) == answer
+        llm_cache.invalidate(SESSION_ID, "Waste")
+        return await llm_cache.get(_key())
+
+    assert asyncio.run(run()) is None
+
+
+@pytest.mark.parametrize("fallback", [
+    {"__llm_error": "deadline exceeded", "next_question": ""},
+    {"__llm_raw_text": "not json", "next_question": ""},
+])
+def test_fallbacks_bypass_the_cache(fallback):
+    async def run():
+        await llm_cache.put(_key(), fallback, SESSION_ID, "Waste", "prompt3A", "model")
+        return await llm_cache.get(_key())
+
+    assert asyncio.run(run()) is None
+    assert llm_cache.llm_cache_stats()["memory_size"] == 0
@@ -0,0 +1,72 @@
+# Deadlines of the LLM calls: a spent deadline is a 504 (DeadlineExceeded),
+# never a 503, and a stalled stream gives its limiter slot back.
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+
+from services import llm_service
+from services.deadlines import DeadlineExceeded, deadline_after
+
+
+class _StalledStream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks:
+            return SimpleNamespace(text=self.chunks.pop(0))
+        await asyncio.sleep(3600)
+
+
+def _client(stream):
+    async def generate_content_stream(**kwargs):
+        return stream
+
+    models = SimpleNamespace(generate_content_stream=generate_content_stream)
+    return SimpleNamespace(aio=SimpleNamespace(models=models))
+
+
+def test_stalled_stream_hits_deadline_and_releases_slot(monkeypatch):
+    monkeypatch.setattr(llm_service, "get_client", lambda: _client(_StalledStream(['{"next_question": "Fu'])))
+    received = []
+
+    async def run():
+        with deadline_after(0.2):
+            async for text in llm_service.stream_model("prompt"):
+                received.append(text)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert received == ['{"next_question": "Fu']
+    assert llm_service.llm_limiter.stats()["in_flight"] == 0
+
+
+def test_spent_deadline_is_not_rate_limited():
+    async def run():
+        async with llm_service._slot(0.0, priority="chat"):
+            pass
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+
+
+def test_deadline_running_out_in_queue_is_deadline_exceeded(monkeypatch):
+    limiter = llm_service.WeightedFairLimiter(
+        "test", weights={"chat": 1}, default_class="chat", rate_per_minute=0, burst=1,
+        min_concurrency=1, max_concurrency=1, latency_target=0, max_queue=8, queue_timeout=30,
+    )
+    monkeypatch.setattr(llm_service, "llm_limiter", limiter)
+
+    async def run():
+        async with limiter.slot(priority="chat"):
+            deadline = llm_service.time.monotonic() + 0.05
+            async with llm_service._slot(deadline, priority="chat"):
+                pass
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert limiter.stats()["in_flight"] == 0
@@ -0,0 +1,26 @@
+import migrate
+
+
+def test_statements_keep_dollar_quoted_bodies_whole():
+    sql = """-- header; with a semicolon
+CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx ON a (x);
+
+DO $$
+BEGIN
+    RAISE EXCEPTION 'x';
+END
+$$;
+SELECT 1;
+"""
+    found = migrate.statements(sql)
+    assert len(found) == 3
+    assert found[1].startswith("DO $$") and found[1].endswith("$$;")
+
+
+def test_concurrent_indexes_run_outside_a_transaction():
+    for _, name, path in migrate._discover():
+        sql = path.read_text()
+        if "INDEX CONCURRENTLY" in sql.upper():
+            assert sql.startswith(migrate.NO_TRANSACTION), name
+        # no migration removes rows on its own: dedupe is an operator step
+        assert "DELETE FROM" not in sql.upper(), name
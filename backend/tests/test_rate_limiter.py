@@ -0,0 +1,171 @@
+# Admission control: weighted classes, per-session turns, class caps,
+# cancellation while queued, AIMD limit and the retry budget.
+import asyncio
+
+import pytest
+
+from services.rate_limiter import RateLimitedError, RetryBudget, WeightedFairLimiter
+
+
+def _limiter(concurrency=1, weights=None, caps=None, max_queue=64):
+    return WeightedFairLimiter(
+        "test", weights=weights or {"chat": 8, "summary": 3, "calculation": 1},
+        default_class="chat", caps=caps, rate_per_minute=0, burst=1,
+        min_concurrency=1, max_concurrency=concurrency, latency_target=0,
+        max_queue=max_queue, queue_timeout=5,
+    )
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _admission_order(limiter, callers):
+    """Queue callers (priority, session_id) behind a held slot, return the order they are admitted in."""
+    order = []
+
+    async def call(priority, session_id):
+        async with limiter.slot(priority=priority, session_id=session_id):
+            order.append((priority, session_id))
+
+    async with limiter.slot(priority="chat", session_id="holder"):
+        tasks = [asyncio.ensure_future(call(p, s)) for p, s in callers]
+        await _settle()
+        assert limiter.queue_depth() == len(callers)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_classes_share_slots_by_weight():
+    limiter = _limiter(weights={"chat": 3, "calculation": 1})
+    callers = [("calculation", f"c{i}") for i in range(8)] + [("chat", f"u{i}") for i in range(8)]
+
+    order = asyncio.run(_admission_order(limiter, callers))
+
+    first = [priority for priority, _ in order[:8]]
+    assert first.count("chat") == 6 and first.count("calculation") == 2
+    # a calculation backlog is slowed down, never starved
+    assert "calculation" in first[:4]
+
+
+def test_sessions_take_turns_inside_a_class():
+    limiter = _limiter()
+    callers = [("chat", "a"), ("chat", "a"), ("chat", "a"), ("chat", "b")]
+
+    order = asyncio.run(_admission_order(limiter, callers))
+
+    assert [session for _, session in order] == ["a", "b", "a", "a"]
+
+
+def test_capped_class_leaves_room_for_chat():
+    limiter = _limiter(concurrency=4, caps={"calculation": 0.5})
+
+    async def run():
+        release = asyncio.Event()
+
+        async def calculation():
+            async with limiter.slot(priority="calculation"):
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(calculation()) for _ in range(4)]
+        try:
+            await _settle()
+            stats = limiter.stats()["classes"]["calculation"]
+            assert (stats["in_flight"], stats["queue_depth"]) == (2, 2)
+            # chat is admitted at once, past the calculations waiting on their cap
+            await asyncio.wait_for(limiter.acquire(priority="chat"), 0.5)
+            limiter.release(None, priority="chat")
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_full_class_queue_does_not_reject_other_classes():
+    limiter = _limiter(max_queue=1)
+
+    async def run():
+        async def call(priority):
+            async with limiter.slot(priority=priority):
+                pass
+
+        async with limiter.slot(priority="chat"):
+            queued = asyncio.ensure_future(call("calculation"))
+            await _settle()
+            with pytest.raises(RateLimitedError):
+                await call("calculation")
+            chat = asyncio.ensure_future(call("chat"))
+            await _settle()
+            assert limiter.queue_depth() == 2
+        await asyncio.gather(queued, chat)
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = _limiter()
+
+    async def run():
+        async def call():
+            async with limiter.slot(priority="summary", session_id="s"):
+                pass
+
+        async with limiter.slot(priority="chat"):
+            waiter = asyncio.ensure_future(call())
+            await _settle()
+            assert limiter.queue_depth() == 1
+            waiter.cancel()
+            await _settle()
+            assert limiter.queue_depth() == 0
+            assert limiter.stats()["classes"]["summary"]["waiting_sessions"] == 0
+
+    asyncio.run(run())
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_waiter_cancelled_after_admission_gives_the_slot_back():
+    limiter = _limiter()
+
+    async def run():
+        async def call():
+            async with limiter.slot(priority="chat"):
+                pass
+
+        async with limiter.slot(priority="chat"):
+            waiter = asyncio.ensure_future(call())
+            await _settle()
+        # the release admitted the waiter; it is cancelled before it resumes
+        waiter.cancel()
+        await _settle()
+        assert waiter.done()
+
+    asyncio.run(run())
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_aimd_limit():
+    limiter = _limiter(concurrency=8)
+
+    async def run():
+        await limiter.acquire()
+        limiter.release(None, throttled=True)
+        assert limiter.limit == 4
+        await limiter.acquire()
+        limiter.release(0.1)
+        assert limiter.limit == pytest.approx(4.25)
+
+    asyncio.run(run())
+
+
+def test_retry_budget_runs_dry():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, cap=2)
+
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.stats()["exhausted"] == 1
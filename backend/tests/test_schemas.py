@@ -0,0 +1,40 @@
+from schemas import ChatLLMResponse, ConfidenceLLMResponse, EmissionsResponse
+
+
+def _chat(fields):
+    return {
+        "next_question": "How many generators?",
+        "category_complete": False,
+        "next_category": None,
+        "analysis_complete": False,
+        "updated_missing_field": [],
+        "extracted_fields": fields,
+    }
+
+
+def test_extracted_fields_are_coerced():
+    response = ChatLLMResponse.model_validate(_chat([
+        {"entity_id": 1, "field_name": "fuel_litres", "field_type": "numeric", "field_value_float": "1200"},
+        {"entity_id": "gen-2", "field_name": "waste", "field_value_float": "12 kg"},
+    ]))
+    first, second = response.extracted_fields
+    assert first.entity_id == "1"
+    assert first.field_value_float == 1200.0
+    # non-numeric "float" kept as text, as write_behind stores it
+    assert second.field_value_text == "12 kg"
+    assert second.field_value_float is None
+
+
+def test_entity_emission_id_is_coerced():
+    response = EmissionsResponse.model_validate({
+        "scope": "Scope 1",
+        "raw_calculation_steps": "",
+        "entity_emissions": [{"entity_id": 3, "emission_tonnes": 1}],
+    })
+    assert response.entity_emissions[0].entity_id == "3"
+
+
+def test_confidence_llm_schema_has_only_model_fields():
+    assert set(ConfidenceLLMResponse.model_json_schema()["properties"]) == {
+        "calculation_valid", "correction_note", "confidence_model", "missing_fields",
+    }
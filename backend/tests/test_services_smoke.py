@@ -0,0 +1,205 @@
+# Smoke tests: import the services and drive one request through each with
+# the database (acquire) and the model (ask_model) replaced by fakes.
+from contextlib import asynccontextmanager
+import asyncio
+import uuid
+
+import pytest
+
+from services import (
+    chat_service, confidence_service, emission_service, summary_service,
+    session_cache, category_digest, llm_cache, write_behind,
+)
+
+SESSION_ID = str(uuid.uuid4())
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    async def fetchrow(self, query, *args):
+        if "FROM sessions" in query:
+            return {
+                "company_profile": {"name": "Acme", "country": "IN"},
+                "summary_text": "Runs two diesel generators.",
+                "current_category": "Stationary Combustion",
+                "missing_fields": [],
+                "last_qa_id": 0,
+            }
+        if "FROM emissions_snapshots" in query:
+            return {"id": 1, "raw_emissions": 12.5, "steps": "1000 l x 2.68", "scope": "Scope 1"}
+        return None
+
+    async def fetch(self, query, *args):
+        if "FROM structured_fields" in query:
+            return [{
+                "id": 1, "entity_id": "gen-1", "field_name": "diesel_litres",
+                "field_value_text": None, "field_value_float": 1000.0,
+            }]
+        if "FROM qa_messages" in query:
+            return [{"id": 7, "question_text": "Fuel used?", "answer_text": "1000 litres of diesel"}]
+        return []
+
+    async def fetchval(self, query, *args):
+        self.executed.append(query)
+        return 1
+
+    async def execute(self, query, *args):
+        self.executed.append(query)
+        return "UPDATE 1" if query.lstrip().startswith("UPDATE") else "INSERT 0 1"
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+@pytest.fixture
+def db(monkeypatch):
+    connection = FakeConnection()
+
+    @asynccontextmanager
+    async def acquire():
+        yield connection
+
+    for module in (chat_service, confidence_service, emission_service, summary_service,
+                   session_cache, category_digest, llm_cache):
+        monkeypatch.setattr(module, "acquire", acquire)
+    return connection
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    ops = []
+    monkeypatch.setattr(write_behind, "enqueue", lambda session_id, kind, params: ops.append((kind, params)))
+    return ops
+
+
+def _fake_model(monkeypatch, module, answer):
+    prompts = []
+
+    async def ask_model(prompt, response_schema=None, **kwargs):
+        prompts.append(prompt)
+        return dict(answer)
+
+    monkeypatch.setattr(module, "ask_model", ask_model)
+    return prompts
+
+
+def test_emissions(monkeypatch, db, queued):
+    prompts = _fake_model(monkeypatch, emission_service, {
+        "scope": "Scope 1",
+        "raw_emissions": 2.68,
+        "raw_calculation_steps": "1000 l x 2.68 kg/l",
+        "entity_emissions": [{"entity_id": "gen-1", "emission_tonnes": 2.68}],
+    })
+
+    result = asyncio.run(emission_service.generate_emissions({
+        "session_id": SESSION_ID, "category": "Stationary Combustion", "correction_note": "smoke",
+    }))
+
+    assert result["scope"] == "Scope 1"
+    assert "Acme" in str(prompts[0])
+    assert any("emissions_snapshots" in q for q in db.executed)
+    assert queued == [("entity_emission", (2.68, SESSION_ID, "Stationary Combustion", "gen-1"))]
+
+
+def test_confidence(monkeypatch, db):
+    _fake_model(monkeypatch, confidence_service, {
+        "calculation_valid": True,
+        "correction_note": "",
+        "confidence_model": 0.8,
+        "missing_fields": ["generator_hours"],
+    })
+
+    result = asyncio.run(confidence_service.generate_confidence({
+        "session_id": SESSION_ID, "category": "Stationary Combustion",
+    }))
+
+    assert result["scope"] == "Scope 1"
+    assert result["confidence_data"] == 0.5
+    assert result["confidence_final"] == pytest.approx(0.65)
+    assert any("UPDATE sessions" in q for q in db.executed)
+
+
+def test_summary(monkeypatch, db):
+    _fake_model(monkeypatch, summary_service, {"updated_summary": "Uses 1000 l of diesel."})
+
+    result = asyncio.run(summary_service.generate_summary(SESSION_ID, "Stationary Combustion"))
+
+    assert result == {"updated_summary": "Uses 1000 l of diesel."}
+    assert any("summary_watermarks" in q for q in db.executed)
+
+
+def test_summary_skips_without_new_qa(monkeypatch, db):
+    prompts = _fake_model(monkeypatch, summary_service, {"updated_summary": "unused"})
+
+    async def no_qa(query, *args):
+        return []
+    monkeypatch.setattr(db, "fetch", no_qa)
+
+    result = asyncio.run(summary_service.generate_summary(SESSION_ID, "Waste"))
+
+    assert result == {"updated_summary": "Runs two diesel generators."}
+    assert prompts == []
+
+
+def test_chat_turns(monkeypatch, db, queued):
+    prompts = _fake_model(monkeypatch, chat_service, {
+        "next_question": "How many hours does each generator run per month?",
+        "category_complete": False,
+        "next_category": None,
+        "analysis_complete": False,
+        "updated_missing_field": ["generator_hours"],
+        "extracted_fields": [{
+            "entity_id": "gen-1", "field_name": "diesel_litres",
+            "field_value_text": None, "field_value_float": 1000.0,
+        }],
+    })
+
+    async def embed_text(text):
+        return [0.0] * 8
+
+    async def semantic_search(**kwargs):
+        return [{"content": "Q: Site?\nA: Pune", "category": "General"}]
+
+    monkeypatch.setattr(chat_service, "embed_text", embed_text)
+    monkeypatch.setattr(chat_service, "semantic_search", semantic_search)
+
+    first = asyncio.run(chat_service.first_question(SESSION_ID))
+    assert first["next_question"]
+
+    answer = asyncio.run(chat_service.next_question({
+        "session_id": SESSION_ID,
+        "category": "Stationary Combustion",
+        "question": "Fuel used?",
+        "answer": "1000 litres of diesel",
+    }))
+
+    assert answer["updated_missing_field"] == ["generator_hours"]
+    assert "1000 litres of diesel" in str(prompts[-1])
+    assert [kind for kind, _ in queued] == ["vector_memory"]
+    # extracted fields are written inline, not queued
+    assert any("INSERT INTO structured_fields" in q for q in db.executed)
+
+
+def test_chat_unknown_session_queues_nothing(monkeypatch, db, queued):
+    _fake_model(monkeypatch, chat_service, {})
+
+    async def no_session(query, *args):
+        return None
+
+    async def embed_text(text):
+        return [0.0] * 8
+
+    monkeypatch.setattr(db, "fetchrow", no_session)
+    monkeypatch.setattr(chat_service, "embed_text", embed_text)
+
+    with pytest.raises(ValueError):
+        asyncio.run(chat_service.next_question({
+            "session_id": str(uuid.uuid4()),
+            "category": "Waste",
+            "question": "Waste?",
+            "answer": "2 t",
+        }))
+    assert queued == []
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    group = SingleFlight("test-share")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(group.do("k", fn), group.do("k", fn), group.do("other", fn))
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert len(calls) == 2
+    assert group.stats() == {"calls": 2, "coalesced": 1, "in_flight": 0}
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    group = SingleFlight("test-cancel")
+    finished = []
+
+    async def fn():
+        await asyncio.sleep(0.02)
+        finished.append(1)
+        return "answer"
+
+    async def run():
+        first = asyncio.ensure_future(group.do("k", fn))
+        second = asyncio.ensure_future(group.do("k", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await second
+        assert first.cancelled()
+        return result
+
+    assert asyncio.run(run()) == "answer"
+    assert finished == [1]
+
+
+def test_call_completes_after_every_caller_left():
+    group = SingleFlight("test-orphan")
+
+    async def run():
+        done = asyncio.Event()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            done.set()
+
+        caller = asyncio.ensure_future(group.do("k", fn))
+        await asyncio.sleep(0)
+        caller.cancel()
+        # the writes of the shared call still happen
+        await asyncio.wait_for(done.wait(), 1)
+        await asyncio.sleep(0)
+        assert group.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_errors_are_shared_and_not_cached():
+    group = SingleFlight("test-error")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    async def run():
+        results = await asyncio.gather(group.do("k", fn), group.do("k", fn), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await group.do("k", fn)
+
+    asyncio.run(run())
+    assert len(calls) == 2
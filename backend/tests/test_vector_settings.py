@@ -0,0 +1,31 @@
+# The pool's release query must re-apply the vector search defaults that its
+# RESET ALL clears.
+from database import _Connection
+from services import vector_index
+
+
+class _Unconnected(_Connection):
+    # built without a protocol: nothing to close
+    def __del__(self):
+        pass
+
+
+def test_reset_query_restores_search_settings(monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_INDEX", "hnsw")
+    monkeypatch.setattr(vector_index, "_pgvector_version", (0, 8, 0))
+
+    connection = object.__new__(_Unconnected)
+    connection._reset_query = "RESET ALL;"
+    query = connection.get_reset_query()
+
+    assert query.index("RESET ALL;") < query.index("SET SESSION hnsw.ef_search")
+    assert "SET SESSION hnsw.iterative_scan = relaxed_order;" in query
+
+
+def test_reset_query_without_ann_index(monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_INDEX", "none")
+
+    connection = object.__new__(_Unconnected)
+    connection._reset_query = "RESET ALL;"
+
+    assert connection.get_reset_query() == "RESET ALL;"
@@ -0,0 +1,70 @@
+# Write-behind queue: coercion at enqueue and isolation of a bad op.
+import asyncio
+import uuid
+
+import asyncpg
+import pytest
+
+from services import bulk_writes, write_behind
+
+A = str(uuid.uuid4())
+B = str(uuid.uuid4())
+
+
+def test_enqueue_coerces_llm_values():
+    writer = write_behind._WriteBehind()
+    writer.enqueue(A, "entity_emission", ("3.5", A, "Waste", 7))
+    writer.enqueue(A, "entity_emission", ("n/a", A, "Waste", "gen-1"))
+
+    (_, _, emission), (_, _, unknown) = writer._queue
+    assert emission == (3.5, A, "Waste", "7")
+    assert unknown == (None, A, "Waste", "gen-1")
+
+
+def test_structured_fields_are_not_queued():
+    writer = write_behind._WriteBehind()
+    with pytest.raises(ValueError):
+        writer.enqueue(A, "structured_fields", (A, "Waste", 1, "waste_kg", None, "12 kg"))
+
+
+def test_structured_field_row_coerces_llm_values():
+    row = bulk_writes.structured_field_row((A, "Waste", 1, "waste_kg", None, "12 kg"))
+    assert row == (A, "Waste", "1", "waste_kg", "12 kg", None)
+
+
+def test_enqueue_rejects_malformed_session():
+    writer = write_behind._WriteBehind()
+    with pytest.raises(ValueError):
+        writer.enqueue("not-a-uuid", "vector_memory", ("not-a-uuid", "Q: x\nA: y", "Waste", [0.0]))
+    assert not writer._queue
+
+
+def test_bad_op_only_drops_itself(monkeypatch):
+    written = []
+
+    async def write(self, batch):
+        if any(params[3] == "bad" for _, _, params in batch):
+            raise asyncpg.DataError("invalid input")
+        written.extend(batch)
+
+    async def no_sleep(_):
+        raise AssertionError("bad data must not be retried with backoff")
+
+    monkeypatch.setattr(write_behind._WriteBehind, "_write", write)
+    monkeypatch.setattr(write_behind.asyncio, "sleep", no_sleep)
+
+    async def run():
+        writer = write_behind._WriteBehind()
+        writer.enqueue(A, "entity_emission", (1.0, A, "Waste", "ok-1"))
+        writer.enqueue(B, "entity_emission", (2.0, B, "Waste", "bad"))
+        writer.enqueue(A, "entity_emission", (3.0, A, "Waste", "ok-2"))
+        writer.start()
+        await writer.wait_for_session(A, timeout=1)
+        await writer.wait_for_session(B, timeout=1)
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(run())
+
+    assert [params[3] for _, _, params in written] == ["ok-1", "ok-2"]
+    assert (writer.written, writer.failed) == (2, 1)